@@ -0,0 +1,130 @@
+from http import HTTPStatus
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author',
+                                              first_name='Лев',
+                                              last_name='Толстой')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='api-group',
+                                         description='Описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.posts = [
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Пост #{number}')
+            for number in range(settings.COUNT_OF_VISIBLE_POSTS + 3)
+        ]
+        cls.post = cls.posts[-1]
+        Comment.objects.create(post=cls.post, author=cls.reader,
+                               text='Комментарий')
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+
+    def test_feeds_return_json_pages(self):
+        """Ленты отдают JSON со страницей постов и курсором."""
+        urls = (
+            reverse('api:index'),
+            reverse('api:group_posts', kwargs={'slug': self.group.slug}),
+            reverse('api:profile', kwargs={'username': 'author'}),
+            reverse('api:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.reader_client.get(url)
+                self.assertEqual(response['Content-Type'],
+                                 'application/json')
+                data = response.json()
+                self.assertEqual(len(data['results']),
+                                 settings.COUNT_OF_VISIBLE_POSTS)
+                self.assertEqual(data['results'][0]['text'], self.post.text)
+                self.assertEqual(data['results'][0]['author'], 'author')
+                self.assertEqual(data['results'][0]['comments_count'], 1)
+                self.assertIsNotNone(data['next'])
+                self.assertIsNone(data['previous'])
+
+    def test_cursor_second_page(self):
+        """Курсор next ведёт на оставшиеся посты."""
+        first = self.guest_client.get(reverse('api:index')).json()
+        second = self.guest_client.get(reverse('api:index'),
+                                       {'after': first['next']}).json()
+        self.assertEqual(len(second['results']), 3)
+        self.assertEqual(second['results'][-1]['id'], self.posts[0].pk)
+        self.assertIsNone(second['next'])
+
+    def test_profile_and_group_metadata(self):
+        """Лента автора и группы описывает саму страницу."""
+        profile = self.guest_client.get(
+            reverse('api:profile', kwargs={'username': 'author'})).json()
+        self.assertEqual(profile['author']['full_name'], 'Лев Толстой')
+        self.assertEqual(profile['author']['posts_count'], len(self.posts))
+        self.assertEqual(profile['author']['followers_count'], 1)
+        group = self.guest_client.get(
+            reverse('api:group_posts',
+                    kwargs={'slug': self.group.slug})).json()
+        self.assertEqual(group['group']['title'], self.group.title)
+
+    def test_post_detail_with_comments(self):
+        """Пост отдаётся с первой страницей комментариев."""
+        data = self.guest_client.get(
+            reverse('api:post_detail', kwargs={'post_id': self.post.pk})
+        ).json()
+        self.assertEqual(data['post']['group'], self.group.slug)
+        self.assertEqual([comment['text']
+                          for comment in data['comments']['results']],
+                         ['Комментарий'])
+
+    def test_etag_not_modified(self):
+        """Повторный запрос с ETag получает 304."""
+        urls = (
+            reverse('api:index'),
+            reverse('api:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('api:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                etag = self.reader_client.get(url)['ETag']
+                response = self.reader_client.get(url,
+                                                  HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+
+    def test_follow_etag_changes_with_feed(self):
+        """Новый пост автора меняет ETag ленты подписок."""
+        url = reverse('api:follow_index')
+        etag = self.reader_client.get(url)['ETag']
+        Post.objects.create(author=self.author, text='Свежий пост')
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['results'][0]['text'],
+                         'Свежий пост')
+
+    def test_errors_are_json(self):
+        """Ошибки API приходят в JSON, без перенаправлений."""
+        cases = (
+            (reverse('api:follow_index'), HTTPStatus.UNAUTHORIZED),
+            (reverse('api:group_posts', kwargs={'slug': 'missing'}),
+             HTTPStatus.NOT_FOUND),
+            (reverse('api:profile', kwargs={'username': 'missing'}),
+             HTTPStatus.NOT_FOUND),
+            (reverse('api:post_detail', kwargs={'post_id': 10 ** 6}),
+             HTTPStatus.NOT_FOUND),
+        )
+        for url, status in cases:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertEqual(response.status_code, status)
+                self.assertIn('detail', response.json())
@@ -0,0 +1,254 @@
+"""JSON-версии лент и страницы поста для мобильного клиента.
+
+Данные выбираются через values() без создания моделей и сразу
+сериализуются в JSON, шаблоны не участвуют. Страницы листаются
+курсором ?after=/?before=, ответы получают ETag, как и HTML-ленты.
+При шардировании ленты собираются со всех шардов, а имена авторов
+и слаги групп догружаются из default одним запросом на страницу.
+"""
+import hashlib
+import json
+from functools import wraps
+from http import HTTPStatus
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.views.decorators.http import condition, require_safe
+
+from core.routers import use_replica
+from posts import follows, sharding
+from posts.caching import (GROUPS_SCOPE, cache_listing, get_versions,
+                           post_detail_etag, post_detail_last_modified)
+from posts.models import (ArchivedComment, ArchivedPost, Comment, FeedEntry,
+                          Group, Post, User)
+from posts.utils import cursor_paginator
+
+POST_FIELDS = ('id', 'text', 'created', 'author__username', 'group__slug',
+               'comments_count', 'thumbnail')
+COMMENT_FIELDS = ('id', 'text', 'created', 'author__username')
+# На шардах нет пользователей и групп: вместо join - их id.
+SHARDED_POST_FIELDS = ('id', 'text', 'created', 'author_id', 'group_id',
+                       'comments_count', 'thumbnail')
+SHARDED_COMMENT_FIELDS = ('id', 'text', 'created', 'author_id')
+
+
+def json_response(payload, status=HTTPStatus.OK) -> HttpResponse:
+    return HttpResponse(
+        json.dumps(payload, ensure_ascii=False, separators=(',', ':')),
+        content_type='application/json',
+        status=status,
+    )
+
+
+def error(status: HTTPStatus) -> HttpResponse:
+    return json_response({'detail': status.phrase}, status=status)
+
+
+def api_login_required(view):
+    """Как login_required, но отвечает 401 вместо перенаправления."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return error(HTTPStatus.UNAUTHORIZED)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def serialize_post(row: dict, prefix: str = '') -> dict:
+    thumbnail = row[f'{prefix}thumbnail']
+    return {
+        'id': row[f'{prefix}id'],
+        'text': row[f'{prefix}text'],
+        'created': row[f'{prefix}created'].isoformat(),
+        'author': row[f'{prefix}author__username'],
+        'group': row[f'{prefix}group__slug'],
+        'comments_count': row[f'{prefix}comments_count'],
+        'thumbnail': default_storage.url(thumbnail) if thumbnail else None,
+    }
+
+
+def serialize_comment(row: dict) -> dict:
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'created': row['created'].isoformat(),
+        'author': row['author__username'],
+    }
+
+
+def post_values(queryset):
+    if sharding.enabled():
+        return queryset.values(*SHARDED_POST_FIELDS)
+    return queryset.values(*POST_FIELDS)
+
+
+def comment_values(queryset):
+    if sharding.enabled():
+        return queryset.values(*SHARDED_COMMENT_FIELDS)
+    return queryset.values(*COMMENT_FIELDS)
+
+
+def attach_names(rows) -> None:
+    """Добавляет к строкам с шардов имена авторов и слаги групп."""
+    if not sharding.enabled() or not rows:
+        return
+    usernames = dict(
+        User.objects.filter(pk__in={row['author_id'] for row in rows})
+        .values_list('id', 'username')
+    )
+    group_ids = {row['group_id'] for row in rows if row.get('group_id')}
+    slugs = dict(
+        Group.objects.filter(pk__in=group_ids).values_list('id', 'slug')
+    ) if group_ids else {}
+    for row in rows:
+        row['author__username'] = usernames.get(row['author_id'])
+        if 'group_id' in row:
+            row['group__slug'] = slugs.get(row['group_id'])
+
+
+def paginate(request, rows, per_page=settings.COUNT_OF_VISIBLE_POSTS,
+             databases=None, fallback=None, names=True):
+    page = cursor_paginator(rows, per_page, databases, fallback).get_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    if names:
+        attach_names(page.object_list)
+    return page
+
+
+def page_payload(page, serialize) -> dict:
+    return {
+        'results': [serialize(row) for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+@use_replica
+@require_safe
+@cache_listing('index')
+def index(request):
+    page = paginate(request, post_values(Post.objects.all()),
+                    databases=sharding.shards())
+    return json_response(page_payload(page, serialize_post))
+
+
+@use_replica
+@require_safe
+@cache_listing('group:{slug}')
+def group_posts(request, slug):
+    group = Group.objects.filter(slug=slug).values(
+        'id', 'title', 'slug', 'description').first()
+    if group is None:
+        return error(HTTPStatus.NOT_FOUND)
+    page = paginate(
+        request, post_values(Post.objects.filter(group_id=group['id'])),
+        databases=sharding.shards()
+    )
+    return json_response({'group': group,
+                          **page_payload(page, serialize_post)})
+
+
+@use_replica
+@require_safe
+@cache_listing('profile:{username}')
+def profile(request, username):
+    author = User.objects.filter(username=username).values(
+        'id', 'username', 'first_name', 'last_name',
+        'stats__posts_count', 'stats__followers_count',
+        'stats__following_count',
+    ).first()
+    if author is None:
+        return error(HTTPStatus.NOT_FOUND)
+    posts, archived = (
+        sharding.on_author_shard(model.objects.filter(author_id=author['id']),
+                                 author['id'])
+        for model in (Post, ArchivedPost)
+    )
+    page = paginate(request, post_values(posts),
+                    fallback=post_values(archived))
+    return json_response({
+        'author': {
+            'username': author['username'],
+            'full_name': f'{author["first_name"]} {author["last_name"]}'
+                         .strip(),
+            'posts_count': author['stats__posts_count'],
+            'followers_count': author['stats__followers_count'],
+            'following_count': author['stats__following_count'],
+        },
+        **page_payload(page, serialize_post),
+    })
+
+
+@use_replica
+@require_safe
+@condition(etag_func=post_detail_etag,
+           last_modified_func=post_detail_last_modified)
+def post_detail(request, post_id):
+    # Пост из горячей таблицы, а если его там нет - из архива.
+    for post_model, comment_model in ((Post, Comment),
+                                      (ArchivedPost, ArchivedComment)):
+        post = post_values(sharding.on_post_shard(
+            post_model.objects.filter(pk=post_id), post_id)).first()
+        if post is not None:
+            break
+    else:
+        return error(HTTPStatus.NOT_FOUND)
+    comments = paginate(
+        request,
+        comment_values(sharding.on_post_shard(
+            comment_model.objects.filter(post_id=post_id), post_id)),
+        settings.COUNT_OF_VISIBLE_COMMENTS,
+        names=False,
+    )
+    # Авторы поста и комментариев - одним запросом.
+    attach_names([post, *comments.object_list])
+    return json_response({
+        'post': serialize_post(post),
+        'comments': page_payload(comments, serialize_comment),
+    })
+
+
+def follow_index_etag(request):
+    """Состав ленты подписок и версия общей ленты, где видны правки."""
+    if not request.user.is_authenticated:
+        return None
+    if sharding.enabled():
+        # Лент нет: страница зависит от подписок и от постов,
+        # а любое изменение поста меняет версию index.
+        parts = [request.user.pk, request.get_full_path(),
+                 *sorted(follows.followee_ids(request.user.pk)),
+                 *get_versions(['index', GROUPS_SCOPE])]
+        return hashlib.md5(
+            ':'.join(str(part) for part in parts).encode()
+        ).hexdigest()
+    feed = FeedEntry.objects.filter(user=request.user).aggregate(
+        last=Max('id'), total=Count('id'))
+    parts = [request.user.pk, request.get_full_path(), feed['last'],
+             feed['total'], *get_versions(['index', GROUPS_SCOPE])]
+    return hashlib.md5(
+        ':'.join(str(part) for part in parts).encode()
+    ).hexdigest()
+
+
+@use_replica
+@require_safe
+@api_login_required
+@condition(etag_func=follow_index_etag)
+def follow_index(request):
+    if sharding.enabled():
+        author_ids = follows.followee_ids(request.user.pk)
+        page = paginate(
+            request,
+            post_values(Post.objects.filter(author_id__in=author_ids)),
+            databases=sharding.shards(author_ids)
+        )
+        return json_response(page_payload(page, serialize_post))
+    entries = FeedEntry.objects.filter(user=request.user).values(
+        'id', 'created', *(f'post__{field}' for field in POST_FIELDS))
+    page = paginate(request, entries)
+    return json_response(page_payload(
+        page, lambda row: serialize_post(row, prefix='post__')))
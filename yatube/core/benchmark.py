@@ -0,0 +1,53 @@
+"""Общие инструменты замеров для команд-бенчмарков."""
+import json
+import platform
+import statistics
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence
+
+import django
+from django.utils import timezone
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/среднее по замерам в секундах, результат в миллисекундах."""
+    ordered = sorted(samples)
+    if len(ordered) > 1:
+        cut_points = statistics.quantiles(ordered, n=100,
+                                          method='inclusive')
+        p50, p95 = cut_points[49], cut_points[94]
+    else:
+        p50 = p95 = ordered[0]
+    return {
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'samples': len(ordered),
+    }
+
+
+@contextmanager
+def stopwatch(samples: List[float]):
+    """Добавляет длительность блока в samples."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples.append(time.perf_counter() - started)
+
+
+def write_report(path: str, name: str, results: list, **meta) -> dict:
+    """Сохраняет результаты в JSON вместе с описанием окружения."""
+    report = {
+        'benchmark': name,
+        'created': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        **meta,
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
+    return report
@@ -0,0 +1,347 @@
+"""Двухуровневый кеш: LRU в памяти процесса перед общим SQLite-файлом.
+
+L2 - файл SQLite, общий для всех процессов сервера: значения видны
+всем воркерам, add() и incr() атомарны (блокировки и версии лент
+на них опираются). L1 - небольшой LRU в памяти процесса для горячих
+ключей, значения в нём хранятся сериализованными, как в LocMemCache.
+
+Каждая запись в L2 получает новую метку (stamp) и увеличивает общий
+счётчик поколений. Запись L1 помнит поколение, при котором её метка
+совпадала с L2. Поколение процесс перечитывает не чаще раза
+в GENERATION_TTL секунд, и пока оно не изменилось, L1 отдаёт значения
+без запросов к SQLite. Когда поколение сменилось, метки ключей из L1
+сверяются с L2 - одним запросом по первичному ключу без передачи
+и распаковки самого значения. Так запись в другом процессе видна
+не позже чем через GENERATION_TTL, свои записи - сразу.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache.TwoTierCache',
+            'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+            'OPTIONS': {'L1_MAX_ENTRIES': 512, 'GENERATION_TTL': 0.5},
+        }
+    }
+"""
+import itertools
+import os
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .metrics import CACHE_REQUESTS
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL,
+        stamp INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS cache_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO cache_generation VALUES (0, 0);
+'''
+
+
+class LRU:
+    """Потокобезопасный LRU-словарь ограниченного размера."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                self._data.move_to_end(key)
+            return item
+
+    def set(self, key, item):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = item
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = location
+        self.busy_timeout = options.get('BUSY_TIMEOUT', 5)
+        self.l1 = LRU(options.get('L1_MAX_ENTRIES', 256))
+        # Число записей L2 проверяется не на каждой записи, а раз
+        # в cull_interval записей процесса.
+        self.cull_interval = options.get('CULL_INTERVAL', 100)
+        self._writes = itertools.count(1)
+        self.generation_ttl = options.get('GENERATION_TTL', 0.5)
+        # (поколение L2, время его чтения) - общее для потоков процесса.
+        self._seen = None
+        self._local = threading.local()
+
+    # Соединения с L2
+
+    def _connection(self) -> sqlite3.Connection:
+        """Своё соединение у каждого потока и каждого процесса."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path,
+                                         timeout=self.busy_timeout,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def _write(self):
+        """Транзакция с блокировкой записи на всё время чтения-изменения.
+
+        Записанные значения попадают в L1 только после COMMIT.
+        """
+        connection = self._connection()
+        self._local.staged = staged = {}
+        connection.execute('BEGIN IMMEDIATE')
+        changes = connection.total_changes
+        try:
+            yield connection
+            if connection.total_changes != changes:
+                connection.execute(
+                    'UPDATE cache_generation SET value = value + 1')
+            generation = connection.execute(
+                'SELECT value FROM cache_generation').fetchone()[0]
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        self._seen = (generation, time.monotonic())
+        for key, item in staged.items():
+            self.l1.set(key, (*item, generation))
+
+    def _generation(self) -> int:
+        """Поколение L2, перечитанное не раньше чем GENERATION_TTL назад."""
+        seen = self._seen
+        if (seen is not None
+                and time.monotonic() - seen[1] < self.generation_ttl):
+            return seen[0]
+        generation = self._connection().execute(
+            'SELECT value FROM cache_generation').fetchone()[0]
+        self._seen = (generation, time.monotonic())
+        return generation
+
+    # Вспомогательное
+
+    @staticmethod
+    def _alive(expires) -> bool:
+        return expires is None or expires > time.time()
+
+    def _store(self, connection, key, value, expires):
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        stamp = secrets.randbits(62)
+        connection.execute(
+            'INSERT OR REPLACE INTO cache_entries '
+            '(key, value, expires, stamp) VALUES (?, ?, ?, ?)',
+            (key, pickled, expires, stamp)
+        )
+        self._local.staged[key] = (pickled, expires, stamp)
+
+    def _cull(self, connection):
+        if next(self._writes) % self.cull_interval:
+            return
+        count = connection.execute(
+            'SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        if count <= self._max_entries:
+            return
+        connection.execute('DELETE FROM cache_entries WHERE expires < ?',
+                           (time.time(),))
+        if self._cull_frequency == 0:
+            connection.execute('DELETE FROM cache_entries')
+            self.l1.clear()
+            return
+        # Бессрочные ключи (версии лент, каталоги) - последними:
+        # NULL в SQLite при сортировке идёт первым.
+        connection.execute(
+            'DELETE FROM cache_entries WHERE key IN ('
+            'SELECT key FROM cache_entries '
+            'ORDER BY expires IS NULL, expires LIMIT ?)',
+            (count // self._cull_frequency,)
+        )
+
+    # API BaseCache
+
+    def _check(self, connection, keys, generation):
+        """Сверяет метки ключей из L1 с L2.
+
+        Возвращает {ключ: запись L1} для подтверждённых записей
+        и обновляет в них поколение и срок жизни.
+        """
+        placeholders = ', '.join('?' * len(keys))
+        confirmed = {}
+        for key, stamp, expires in connection.execute(
+                'SELECT key, stamp, expires FROM cache_entries '
+                f'WHERE key IN ({placeholders})', list(keys)):
+            cached = keys[key]
+            if cached[2] == stamp:
+                confirmed[key] = (cached[0], expires, stamp, generation)
+                self.l1.set(key, confirmed[key])
+        for key in keys.keys() - confirmed.keys():
+            self.l1.discard(key)
+        return confirmed
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version)
+        # Поколение читается до L2: запись, сделанная после чтения
+        # поколения, пометит L1 устаревшим.
+        generation = self._generation()
+        cached = self.l1.get(key)
+        if cached is not None and cached[3] != generation:
+            cached = self._check(self._connection(), {key: cached},
+                                 generation).get(key)
+        if cached is not None:
+            if self._alive(cached[1]):
+                CACHE_REQUESTS.inc('hit_l1')
+                return pickle.loads(cached[0])
+            CACHE_REQUESTS.inc('miss')
+            return default
+        row = self._connection().execute(
+            'SELECT value, expires, stamp FROM cache_entries WHERE key = ?',
+            (key,)
+        ).fetchone()
+        if row is None or not self._alive(row[1]):
+            CACHE_REQUESTS.inc('miss')
+            return default
+        CACHE_REQUESTS.inc('hit_l2')
+        self.l1.set(key, (row[0], row[1], row[2], generation))
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_and_validate_key(key, version): key
+                for key in keys}
+        if not keys:
+            return {}
+        generation = self._generation()
+        fresh, unchecked, missing = {}, {}, []
+        for key in keys:
+            cached = self.l1.get(key)
+            if cached is None:
+                missing.append(key)
+            elif cached[3] == generation:
+                fresh[key] = cached
+            else:
+                unchecked[key] = cached
+        connection = self._connection()
+        if unchecked:
+            confirmed = self._check(connection, unchecked, generation)
+            fresh.update(confirmed)
+            missing.extend(unchecked.keys() - confirmed.keys())
+        found = {keys[key]: pickle.loads(cached[0])
+                 for key, cached in fresh.items() if self._alive(cached[1])}
+        CACHE_REQUESTS.inc('hit_l1', amount=len(found))
+        loaded = 0
+        if missing:
+            placeholders = ', '.join('?' * len(missing))
+            for key, value, expires, stamp in connection.execute(
+                    'SELECT key, value, expires, stamp FROM cache_entries '
+                    f'WHERE key IN ({placeholders})', missing):
+                if not self._alive(expires):
+                    continue
+                self.l1.set(key, (value, expires, stamp, generation))
+                found[keys[key]] = pickle.loads(value)
+                loaded += 1
+        CACHE_REQUESTS.inc('hit_l2', amount=loaded)
+        CACHE_REQUESTS.inc('miss', amount=len(keys) - len(found))
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version)
+        with self._write() as connection:
+            self._cull(connection)
+            self._store(connection, key, value,
+                        self.get_backend_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version)
+        with self._write() as connection:
+            row = connection.execute(
+                'SELECT expires FROM cache_entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and self._alive(row[0]):
+                return False
+            self._cull(connection)
+            self._store(connection, key, value,
+                        self.get_backend_timeout(timeout))
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version)
+        with self._write() as connection:
+            updated = connection.execute(
+                'UPDATE cache_entries SET expires = ? '
+                'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, time.time())
+            ).rowcount
+        # Поколение сменилось: срок в L1 обновится при сверке с L2.
+        return bool(updated)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version)
+        with self._write() as connection:
+            row = connection.execute(
+                'SELECT value, expires FROM cache_entries WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is None or not self._alive(row[1]):
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            self._store(connection, key, value, row[1])
+        return value
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version)
+        self.l1.discard(key)
+        with self._write() as connection:
+            deleted = connection.execute(
+                'DELETE FROM cache_entries WHERE key = ?', (key,)
+            ).rowcount
+        return bool(deleted)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version)
+        row = self._connection().execute(
+            'SELECT expires FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        return row is not None and self._alive(row[0])
+
+    def clear(self):
+        self.l1.clear()
+        with self._write() as connection:
+            connection.execute('DELETE FROM cache_entries')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.routers import refresh_replica
+
+
+class Command(BaseCommand):
+    help = ('Обновляет SQLite-реплики копией базы primary '
+            '(запускается по расписанию)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*',
+                            help='Алиасы реплик, по умолчанию все')
+
+    def handle(self, *args, **options):
+        replicas = [alias for alias in connections
+                    if connections[alias].settings_dict.get('REPLICA_OF')]
+        aliases = options['aliases'] or replicas
+        for alias in aliases:
+            if alias not in replicas:
+                raise CommandError(f'{alias} не описан как реплика')
+            refresh_replica(alias)
+            self.stdout.write(self.style.SUCCESS(f'Реплика {alias} обновлена'))
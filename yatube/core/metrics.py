@@ -0,0 +1,289 @@
+"""Метрики в текстовом формате Prometheus.
+
+Каждый процесс копит значения в памяти и не чаще раза
+в METRICS_FLUSH_INTERVAL секунд сохраняет снимок в свой файл
+в METRICS_DIR. Страница /metrics суммирует файлы всех процессов,
+поэтому на какой бы воркер ни пришёл сборщик, он видит сервер
+целиком. Файлы завершившихся процессов продолжают входить в сумму
+(счётчики не должны уменьшаться), каталог очищают при деплое.
+"""
+import atexit
+import bisect
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from typing import Dict, Sequence, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Значения метрик текущего процесса и их сборка со всех процессов."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # После fork дочерний процесс начинает с нуля и пишет в свой
+        # файл, иначе значения родителя посчитались бы дважды.
+        self._pid = os.getpid()
+        self._values = {}
+        self._flushed_at = 0.0
+        self._filename = f'{self._pid}-{secrets.token_hex(4)}.json'
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def _series(self, name: str) -> dict:
+        if self._pid != os.getpid():
+            self._reset()
+        return self._values.setdefault(name, {})
+
+    def add(self, name: str, labels: Tuple[str, ...], amount: float):
+        with self._lock:
+            series = self._series(name)
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name: str, labels: Tuple[str, ...],
+                bucket: int, buckets: int, value: float):
+        with self._lock:
+            series = self._series(name)
+            # Счётчики по корзинам (последняя - +Inf) и сумма.
+            state = series.setdefault(labels, [0] * (buckets + 1) + [0.0])
+            state[bucket] += 1
+            state[-1] += value
+
+    def flush(self, force: bool = False):
+        """Сохраняет снимок процесса в METRICS_DIR."""
+        now = time.monotonic()
+        interval = settings.METRICS_FLUSH_INTERVAL
+        if not force and now - self._flushed_at < interval:
+            return
+        with self._lock:
+            self._flushed_at = now
+            snapshot = {
+                name: [[list(labels), value]
+                       for labels, value in series.items()]
+                for name, series in self._values.items()
+            }
+            filename = self._filename
+        directory = settings.METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory,
+                                                 suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temporary, os.path.join(directory, filename))
+
+    def collect(self) -> Dict[str, dict]:
+        """Сумма значений всех процессов: {имя: {метки: значение}}."""
+        self.flush(force=True)
+        merged = {}
+        directory = settings.METRICS_DIR
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, series in snapshot.items():
+                if name not in self.metrics:
+                    continue
+                target = merged.setdefault(name, {})
+                for labels, value in series:
+                    labels = tuple(labels)
+                    if labels not in target:
+                        target[labels] = value
+                    elif isinstance(value, list):
+                        target[labels] = [
+                            old + new
+                            for old, new in zip(target[labels], value)
+                        ]
+                    else:
+                        target[labels] += value
+        return merged
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        merged = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for labels, value in sorted(merged.get(name, {}).items()):
+                lines.extend(metric.samples(labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+@atexit.register
+def _flush_at_exit():
+    if REGISTRY._values and REGISTRY._pid == os.getpid():
+        REGISTRY.flush(force=True)
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ''
+    escaped = (
+        str(value).replace('\\', r'\\').replace('"', r'\"')
+        .replace('\n', r'\n')
+        for _, value in pairs
+    )
+    return '{' + ','.join(
+        f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)
+    ) + '}'
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.register(self)
+
+    def _labels(self, labels) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f'{self.name}: ожидались метки {self.labelnames}'
+            )
+        return tuple(str(label) for label in labels)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        REGISTRY.add(self.name, self._labels(labels), amount)
+
+    def samples(self, labels, value):
+        pairs = list(zip(self.labelnames, labels))
+        return [f'{self.name}{_format_labels(pairs)} {_format_value(value)}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        REGISTRY.observe(self.name, self._labels(labels),
+                         bisect.bisect_left(self.buckets, value),
+                         len(self.buckets), value)
+
+    def samples(self, labels, value):
+        pairs = list(zip(self.labelnames, labels))
+        counts, total = value[:-1], value[-1]
+        lines = []
+        cumulative = 0
+        bounds = [_format_value(bound) for bound in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            lines.append(
+                f'{self.name}_bucket{_format_labels(pairs + [("le", bound)])} '
+                f'{cumulative}'
+            )
+        lines.append(f'{self.name}_sum{_format_labels(pairs)} '
+                     f'{_format_value(total)}')
+        lines.append(f'{self.name}_count{_format_labels(pairs)} '
+                     f'{cumulative}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'yatube_request_duration_seconds',
+    'Время ответа по имени URL.',
+    ('view', 'method'),
+)
+REQUESTS = Counter(
+    'yatube_requests_total',
+    'Ответы по имени URL и классу кода ответа.',
+    ('view', 'status'),
+)
+DB_QUERIES = Counter(
+    'yatube_db_queries_total',
+    'Запросы к БД по имени URL.',
+    ('view',),
+)
+DB_DURATION = Counter(
+    'yatube_db_query_seconds_total',
+    'Суммарное время запросов к БД по имени URL.',
+    ('view',),
+)
+TEMPLATE_DURATION = Histogram(
+    'yatube_template_render_seconds',
+    'Время отрисовки шаблона верхнего уровня.',
+    ('template',),
+)
+CACHE_REQUESTS = Counter(
+    'yatube_cache_requests_total',
+    'Чтения кеша по результату: hit_l1, hit_l2, miss.',
+    ('result',),
+)
+COMMENT_FLUSH_BATCH = Histogram(
+    'yatube_comment_flush_batch_size',
+    'Комментариев в одной записи из очереди в БД (posts.comment_queue).',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+COMMENT_FLUSH_DURATION = Histogram(
+    'yatube_comment_flush_seconds',
+    'Время записи одной пачки комментариев из очереди в БД.',
+)
+COMMENT_FLUSH_DELAY = Histogram(
+    'yatube_comment_flush_delay_seconds',
+    'Время от постановки комментария в очередь до его записи в БД.',
+)
+
+
+class QueryTimer:
+    """Число и время запросов во все базы внутри блока with."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(
+                connection.execute_wrapper(self._record)
+            )
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def _record(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
@@ -0,0 +1,101 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics
+from .query_budget import QueryBudgetExceededError, QueryRecorder, check_budget
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetMiddleware:
+    """Проверяет бюджет SQL-запросов GET-запроса (для разработки и тестов).
+
+    Нарушение пишется в лог, а при QUERY_BUDGETS_STRICT = True
+    превращается в исключение QueryBudgetExceededError. Работает
+    и в цепочке ASGI, не переводя запрос в поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.is_checked(request):
+            return self.get_response(request)
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        return self.check(request, response, recorder)
+
+    async def __acall__(self, request):
+        if not self.is_checked(request):
+            return await self.get_response(request)
+        with QueryRecorder() as recorder:
+            response = await self.get_response(request)
+        return self.check(request, response, recorder)
+
+    def is_checked(self, request):
+        return (settings.QUERY_BUDGETS_ENABLED
+                and request.method in ('GET', 'HEAD'))
+
+    def check(self, request, response, recorder):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        response['X-Query-Count'] = len(recorder.queries)
+        problem = check_budget(view_name, recorder)
+        if problem is not None:
+            if settings.QUERY_BUDGETS_STRICT:
+                raise QueryBudgetExceededError(problem)
+            logger.warning(problem)
+        return response
+
+
+class MetricsMiddleware:
+    """Записывает в метрики время ответа и запросы к БД по имени URL.
+
+    Стоит первым в MIDDLEWARE, чтобы время ответа включало остальные
+    middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with metrics.QueryTimer() as queries:
+            response = self.get_response(request)
+        self.record(request, response, queries, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with metrics.QueryTimer() as queries:
+            response = await self.get_response(request)
+        self.record(request, response, queries, started)
+        return response
+
+    def record(self, request, response, queries, started):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else '<unresolved>'
+        metrics.REQUEST_DURATION.observe(time.perf_counter() - started,
+                                         view_name, request.method)
+        metrics.REQUESTS.inc(view_name, f'{response.status_code // 100}xx')
+        metrics.DB_QUERIES.inc(view_name, amount=queries.count)
+        metrics.DB_DURATION.inc(view_name, amount=queries.duration)
+        metrics.REGISTRY.flush()
@@ -0,0 +1,131 @@
+"""Бюджеты SQL-запросов для страниц.
+
+settings.QUERY_BUDGETS задаёт для имени URL (view_name) максимальное
+число запросов и суммарное время в БД. Проверяют бюджет middleware
+в разработке и QueryBudgetTestMixin в тестах. В тестах время
+не проверяется (QUERY_BUDGETS_CHECK_TIME, см. core.testing.TestRunner):
+на загруженной машине CI оно случайно выходит за бюджет.
+"""
+import os
+import sys
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import connections
+
+
+class QueryBudgetExceededError(Exception):
+    """Страница вышла за бюджет запросов."""
+
+
+# Собственные файлы проверки бюджета не считаются местом вызова.
+_SKIPPED_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'middleware.py'),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics.py'),
+}
+
+
+@dataclass
+class RecordedQuery:
+    alias: str
+    sql: str
+    duration: float
+    call_site: str
+
+
+@dataclass
+class QueryRecorder:
+    """Записывает запросы во все базы вместе с местом вызова в проекте."""
+    queries: List[RecordedQuery] = field(default_factory=list)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(
+                connection.execute_wrapper(self._wrapper(connection.alias))
+            )
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def _wrapper(self, alias):
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.queries.append(RecordedQuery(
+                    alias=alias,
+                    sql=sql,
+                    duration=time.perf_counter() - started,
+                    call_site=_project_call_site(),
+                ))
+        return record
+
+    @property
+    def total_time(self) -> float:
+        return sum(query.duration for query in self.queries)
+
+
+def get_budget(view_name: Optional[str]) -> Optional[dict]:
+    """Бюджет страницы; при шардировании число запросов берётся
+    из QUERY_BUDGETS_SHARDED: окна с каждого шарда и догрузка
+    авторов и групп из default - отдельные запросы.
+    """
+    budget = settings.QUERY_BUDGETS.get(view_name)
+    sharded = settings.QUERY_BUDGETS_SHARDED.get(view_name)
+    if budget is None or sharded is None or not settings.POST_SHARDS:
+        return budget
+    return {
+        **budget,
+        'queries': (sharded['queries']
+                    + sharded.get('per_shard', 0) * len(settings.POST_SHARDS)),
+    }
+
+
+def check_budget(view_name: Optional[str],
+                 recorder: QueryRecorder) -> Optional[str]:
+    """Описание нарушения бюджета или None, если бюджет соблюдён."""
+    budget = get_budget(view_name)
+    if budget is None:
+        return None
+    problems = []
+    if len(recorder.queries) > budget['queries']:
+        problems.append(
+            f'{len(recorder.queries)} запросов при бюджете '
+            f'{budget["queries"]}'
+        )
+    if (settings.QUERY_BUDGETS_CHECK_TIME
+            and recorder.total_time > budget['time']):
+        problems.append(
+            f'{recorder.total_time * 1000:.1f} мс в БД при бюджете '
+            f'{budget["time"] * 1000:.1f} мс'
+        )
+    if not problems:
+        return None
+    lines = [f'{view_name}: ' + '; '.join(problems)]
+    for number, query in enumerate(recorder.queries, start=1):
+        lines.append(
+            f'{number:>3}. [{query.alias}] {query.duration * 1000:.2f} мс '
+            f'{query.call_site}\n     {query.sql}'
+        )
+    return '\n'.join(lines)
+
+
+def _project_call_site() -> str:
+    """Ближайший к запросу кадр стека из кода проекта."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (filename.startswith(settings.BASE_DIR)
+                and filename not in _SKIPPED_FILES
+                and 'site-packages' not in filename):
+            relative = os.path.relpath(filename, settings.BASE_DIR)
+            return f'{relative}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return '<вне проекта>'
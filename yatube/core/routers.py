@@ -0,0 +1,112 @@
+"""Разделение чтения и записи между primary и репликами.
+
+Запись всегда идёт в default (primary). Чтение уходит на реплики
+из settings.DATABASE_REPLICAS только внутри view, помеченных
+@use_replica: ленты и страницы постов. Сессии, вход и страницы
+записи читают из primary.
+
+После записи (@pin_to_primary) пользователь REPLICA_STICKINESS_SECONDS
+секунд читает из primary и видит свои изменения, даже если реплика
+отстаёт. Метка хранится в общем кеше и видна всем процессам.
+
+Реплика описывается в DATABASES ключом 'REPLICA_OF': на неё
+не применяются миграции. Для SQLite её заменяет копия файла primary,
+которую обновляет refresh_replica().
+"""
+import asyncio
+import contextvars
+import random
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+PIN_KEY = 'replica-pin:{user_id}'
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что и на primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if connections[db].settings_dict.get('REPLICA_OF'):
+            return False
+        return None
+
+
+def reading_from_replica() -> bool:
+    return bool(_use_replica.get() and settings.DATABASE_REPLICAS)
+
+
+def _pin_key(request):
+    if settings.DATABASE_REPLICAS and request.user.is_authenticated:
+        return PIN_KEY.format(user_id=request.user.pk)
+    return None
+
+
+def use_replica(view):
+    """Чтение внутри view идёт на реплику, если пользователь
+    недавно ничего не записывал. Подходит и для async-view.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not settings.DATABASE_REPLICAS:
+                return await view(request, *args, **kwargs)
+            key = await sync_to_async(_pin_key)(request)
+            if key is not None and await cache.aget(key):
+                return await view(request, *args, **kwargs)
+            token = _use_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _use_replica.reset(token)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.DATABASE_REPLICAS:
+            return view(request, *args, **kwargs)
+        key = _pin_key(request)
+        if key is not None and cache.get(key):
+            return view(request, *args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+def pin_to_primary(view):
+    """После view пользователь какое-то время читает только из primary."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        key = _pin_key(request)
+        if key is not None:
+            cache.set(key, True, settings.REPLICA_STICKINESS_SECONDS)
+        return response
+    return wrapper
+
+
+def refresh_replica(alias: str) -> None:
+    """Копирует SQLite-базу primary в реплику alias (backup API)."""
+    replica = connections[alias]
+    primary = connections[replica.settings_dict['REPLICA_OF']]
+    primary.ensure_connection()
+    replica.ensure_connection()
+    primary.connection.backup(replica.connection)
@@ -0,0 +1,27 @@
+"""Бэкенд шаблонов Django, замеряющий время отрисовки для метрик."""
+import time
+
+from django.template.backends.django import DjangoTemplates, Template
+
+from .metrics import TEMPLATE_DURATION
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            TEMPLATE_DURATION.observe(time.perf_counter() - started,
+                                      self.origin.template_name or '<string>')
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Шаблоны верхнего уровня попадают в yatube_template_render_seconds."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template,
+                             self)
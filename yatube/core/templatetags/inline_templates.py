@@ -0,0 +1,63 @@
+"""{% inline_include %} - include, встроенный при компиляции шаблона.
+
+{% include %} на каждой отрисовке ищет шаблон по имени, создаёт
+изолированное состояние отрисовки и новый контекст. В цикле по постам
+ленты это повторяется на каждой карточке. inline_include подставляет
+разобранные узлы шаблона в родителя один раз при компиляции, поэтому
+имя шаблона должно быть строкой:
+
+    {% inline_include 'includes/post.html' with is_profile=True %}
+
+Встраиваемый шаблон не может наследовать другой ({% extends %}).
+С кешированным загрузчиком изменения встроенного шаблона видны после
+сброса кеша шаблонов (runserver делает это сам).
+"""
+from django import template
+from django.template.base import Node, token_kwargs
+from django.template.engine import Engine
+from django.template.loader_tags import ExtendsNode
+
+register = template.Library()
+
+
+class InlineIncludeNode(Node):
+    def __init__(self, included, extra_context):
+        self.included = included
+        self.extra_context = extra_context
+
+    def render(self, context):
+        values = {name: value.resolve(context)
+                  for name, value in self.extra_context.items()}
+        # Ошибки в узлах показываются со строками встроенного шаблона.
+        with context.render_context.push_state(self.included,
+                                               isolated_context=False):
+            with context.push(**values):
+                return self.included.nodelist.render(context)
+
+
+@register.tag
+def inline_include(parser, token):
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает имя шаблона')
+    name = bits[1]
+    if name[0] not in '"\'' or name[-1] != name[0]:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]}: имя шаблона должно быть строкой')
+    extra_context = {}
+    if len(bits) > 2:
+        if bits[2] != 'with':
+            raise template.TemplateSyntaxError(
+                f'{bits[0]}: после имени шаблона ожидается with')
+        extra_context = token_kwargs(bits[3:], parser)
+        if not extra_context or len(extra_context) != len(bits) - 3:
+            raise template.TemplateSyntaxError(
+                f'{bits[0]}: после with ожидаются пары имя=значение')
+    loader = getattr(parser.origin, 'loader', None)
+    engine = loader.engine if loader is not None else Engine.get_default()
+    included = engine.get_template(name[1:-1])
+    if included.nodelist.get_nodes_by_type(ExtendsNode):
+        raise template.TemplateSyntaxError(
+            f'{bits[0]}: шаблон {name} наследует другой шаблон')
+    return InlineIncludeNode(included, extra_context)
@@ -0,0 +1,113 @@
+"""Вспомогательные классы для тестов и бенчмарков."""
+import copy
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.test import Client, override_settings
+from django.test.runner import DiscoverRunner
+from django.urls import URLResolver, get_resolver
+
+from . import metrics
+from .query_budget import QueryRecorder, check_budget
+
+
+def scratch_settings(directory: str) -> dict:
+    """Кеш, метрики и очередь комментариев в каталоге directory.
+
+    Тесты и бенчмарки не должны читать и сбрасывать общий кеш
+    и метрики работающего сервера.
+    """
+    caches = copy.deepcopy(settings.CACHES)
+    for alias, config in caches.items():
+        if config['BACKEND'] == 'core.cache.TwoTierCache':
+            config['LOCATION'] = os.path.join(directory,
+                                              f'cache-{alias}.sqlite3')
+    return {
+        'CACHES': caches,
+        'METRICS_DIR': os.path.join(directory, 'metrics'),
+        'COMMENT_QUEUE_DIR': os.path.join(directory, 'comment_queue'),
+    }
+
+
+@contextmanager
+def scratch_environment():
+    """Блок with со scratch_settings во временном каталоге."""
+    directory = tempfile.mkdtemp(prefix='yatube-')
+    try:
+        with override_settings(**scratch_settings(directory)):
+            yield directory
+            # Иначе при выходе из процесса значения замеров допишутся
+            # в METRICS_DIR сервера.
+            metrics.REGISTRY._reset()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    """Запускает тесты с временными кешем и каталогами."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._environment = ExitStack()
+        self._environment.enter_context(scratch_environment())
+        # Время запросов зависит от загрузки машины, в тестах
+        # проверяется только их число.
+        self._environment.enter_context(
+            override_settings(QUERY_BUDGETS_CHECK_TIME=False))
+
+    def teardown_test_environment(self, **kwargs):
+        self._environment.close()
+        super().teardown_test_environment(**kwargs)
+
+
+def iter_view_names(urlconf: str):
+    """Полные имена (namespace:name) всех маршрутов модуля urls."""
+    for resolver in get_resolver().url_patterns:
+        if (isinstance(resolver, URLResolver)
+                and getattr(resolver.urlconf_module, '__name__',
+                            resolver.urlconf_name) == urlconf):
+            for pattern in resolver.url_patterns:
+                if pattern.name:
+                    yield f'{resolver.namespace}:{pattern.name}'
+
+
+class QueryBudgetTestMixin:
+    """Проверяет страницы модулей budget_urlconfs на бюджет запросов.
+
+    Наследник задаёт get_budget_requests(): словарь
+    {view_name: (url, client)} с адресами для проверки.
+    """
+    budget_urlconfs = ('posts.urls', 'users.urls', 'api.urls')
+
+    def get_budget_requests(self) -> dict:
+        raise NotImplementedError
+
+    def assert_within_budget(self, view_name, url, client=None):
+        client = client or Client()
+        with QueryRecorder() as recorder:
+            response = client.get(url)
+        self.assertEqual(response.resolver_match.view_name, view_name)
+        problem = check_budget(view_name, recorder)
+        if problem is not None:
+            self.fail(problem)
+        return response
+
+    def test_every_url_has_budget(self):
+        """Для каждого маршрута объявлен бюджет запросов."""
+        for urlconf in self.budget_urlconfs:
+            for view_name in iter_view_names(urlconf):
+                with self.subTest(view_name=view_name):
+                    self.assertIn(view_name, settings.QUERY_BUDGETS)
+
+    def test_views_within_budget(self):
+        """Страницы укладываются в бюджет запросов."""
+        requests = self.get_budget_requests()
+        for urlconf in self.budget_urlconfs:
+            for view_name in iter_view_names(urlconf):
+                with self.subTest(view_name=view_name):
+                    self.assertIn(view_name, requests)
+                    url, client = requests[view_name]
+                    self.assert_within_budget(view_name, url, client)
@@ -0,0 +1,367 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.template import Context, Template, TemplateSyntaxError
+from django.test import (Client, SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+
+from core import metrics
+from core.cache import TwoTierCache
+from core.query_budget import QueryRecorder, RecordedQuery, check_budget
+from core.routers import refresh_replica
+from posts.models import Post, User
+
+
+def increment_many(path, times):
+    cache = TwoTierCache(path, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+def record_in_other_process():
+    metrics.REQUESTS.inc('posts:index', '2xx', amount=3)
+    metrics.REQUEST_DURATION.observe(20, 'posts:index', 'GET')
+    metrics.REGISTRY.flush(force=True)
+
+
+class TwoTierCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        """Отдельный экземпляр - как кеш другого процесса.
+
+        Поколение перечитывается на каждом чтении, если не задано иное.
+        """
+        options.setdefault('GENERATION_TTL', 0)
+        return TwoTierCache(self.path, {'OPTIONS': options})
+
+    def test_set_get_delete(self):
+        """Базовые операции и срок жизни."""
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertIn('key', self.cache)
+        self.cache.set('short', 'value', timeout=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('short'))
+        self.assertTrue(self.cache.delete('key'))
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+
+    def test_l1_copy_is_not_shared(self):
+        """Изменение полученного объекта не портит кеш."""
+        self.cache.set('key', [1])
+        self.cache.get('key').append(2)
+        self.assertEqual(self.cache.get('key'), [1])
+
+    def test_other_process_sees_writes(self):
+        """Запись в одном процессе делает устаревшим L1 другого."""
+        other = self.make_cache()
+        self.cache.set('key', 'old')
+        self.assertEqual(other.get('key'), 'old')
+        self.assertEqual(len(other.l1), 1)
+        self.cache.set('key', 'new')
+        self.assertEqual(other.get('key'), 'new')
+        self.assertEqual(other.get_many(['key']), {'key': 'new'})
+        self.cache.delete('key')
+        self.assertIsNone(other.get('key'))
+        self.cache.set('key', 'again')
+        other.get('key')
+        self.cache.clear()
+        self.assertIsNone(other.get('key'))
+
+    def test_l1_hit_skips_l2(self):
+        """Пока поколение не перечитано, L1 отдаёт значения без SQLite."""
+        other = self.make_cache(GENERATION_TTL=60)
+        self.cache.set('key', 'old')
+        self.assertEqual(other.get('key'), 'old')
+        queries = []
+        other._connection().set_trace_callback(queries.append)
+        self.assertEqual(other.get('key'), 'old')
+        self.assertEqual(other.get_many(['key']), {'key': 'old'})
+        self.assertEqual(queries, [])
+        self.cache.set('key', 'new')
+        other.generation_ttl = 0
+        self.assertEqual(other.get('key'), 'new')
+        self.assertEqual(other.get_many(['key']), {'key': 'new'})
+
+    def test_l1_is_filled_after_commit(self):
+        """Значение из откаченной транзакции не попадает в L1."""
+        with self.assertRaises(RuntimeError):
+            with self.cache._write() as connection:
+                self.cache._store(connection, 'key', 'value', None)
+                raise RuntimeError
+        self.assertEqual(len(self.cache.l1), 0)
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.set('key', 'value')
+        self.assertEqual(len(self.cache.l1), 1)
+
+    def test_add_and_incr(self):
+        """add() не перезаписывает живой ключ, incr() меняет значение."""
+        other = self.make_cache()
+        self.assertTrue(self.cache.add('lock', 1))
+        self.assertFalse(other.add('lock', 2))
+        self.assertEqual(other.incr('lock', 5), 6)
+        self.assertEqual(self.cache.get('lock'), 6)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_incr_is_atomic_across_processes(self):
+        """Одновременные incr() из нескольких процессов не теряются."""
+        self.cache.set('counter', 0, timeout=None)
+        processes = [
+            multiprocessing.Process(target=increment_many,
+                                    args=(self.path, 50))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+
+    def test_l1_is_bounded(self):
+        """L1 хранит не больше L1_MAX_ENTRIES ключей."""
+        cache = self.make_cache(L1_MAX_ENTRIES=2)
+        for number in range(5):
+            cache.set(f'key{number}', number)
+        self.assertEqual(len(cache.l1), 2)
+        self.assertEqual(cache.get_many(['key0', 'key4']),
+                         {'key0': 0, 'key4': 4})
+
+    def test_cull(self):
+        """L2 прореживается при превышении MAX_ENTRIES."""
+        cache = self.make_cache(MAX_ENTRIES=10, CULL_FREQUENCY=2,
+                                CULL_INTERVAL=1)
+        for number in range(30):
+            cache.set(f'key{number}', number)
+        count = cache._connection().execute(
+            'SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        self.assertLessEqual(count, 11)
+
+    def test_cull_keeps_keys_without_expiry(self):
+        """Бессрочные ключи вытесняются после ключей со сроком."""
+        cache = self.make_cache(MAX_ENTRIES=10, CULL_FREQUENCY=2,
+                                CULL_INTERVAL=1)
+        cache.set('version', 1, None)
+        for number in range(30):
+            cache.set(f'key{number}', number, 300)
+        self.assertEqual(cache.get('version'), 1)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(METRICS_DIR=self.directory,
+                                              METRICS_TOKEN='metrics-token')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Значения прошлых тестов не попадают в новый каталог.
+        metrics.REGISTRY._reset()
+        cache.clear()
+
+    def get_metrics(self):
+        response = self.client.get(reverse('metrics'),
+                                   HTTP_AUTHORIZATION='Bearer metrics-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def test_request_metrics(self):
+        """Время ответа, запросы к БД, шаблоны и кеш видны в /metrics."""
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:index'))
+        text = self.get_metrics()
+        expected = [
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",method="GET",le="+Inf"} 2',
+            'yatube_request_duration_seconds_count'
+            '{view="posts:index",method="GET"} 2',
+            'yatube_requests_total{view="posts:index",status="2xx"} 2',
+            'yatube_db_queries_total{view="posts:index"}',
+            'yatube_db_query_seconds_total{view="posts:index"}',
+            # Второй ответ взят из кеша ленты без отрисовки шаблона.
+            'yatube_template_render_seconds_count'
+            '{template="posts/index.html"} 1',
+            'yatube_cache_requests_total{result="hit_l1"}',
+            '# TYPE yatube_request_duration_seconds histogram',
+        ]
+        for line in expected:
+            with self.subTest(line=line):
+                self.assertIn(line, text)
+
+    def test_processes_are_summed(self):
+        """Значения других процессов складываются с текущими."""
+        metrics.REQUESTS.inc('posts:index', '2xx')
+        process = multiprocessing.Process(target=record_in_other_process)
+        process.start()
+        process.join()
+        text = self.get_metrics()
+        self.assertIn(
+            'yatube_requests_total{view="posts:index",status="2xx"} 4', text)
+        self.assertIn(
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",method="GET",le="10"} 0', text)
+        self.assertIn(
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",method="GET",le="+Inf"} 1', text)
+
+    def test_not_available_from_outside(self):
+        """Страница метрик закрыта для посторонних адресов."""
+        response = self.client.get(reverse('metrics'),
+                                   REMOTE_ADDR='203.0.113.5',
+                                   HTTP_AUTHORIZATION='Bearer metrics-token')
+        self.assertEqual(response.status_code, 404)
+
+    def test_requires_token(self):
+        """Без верного токена страница закрыта и с разрешённого адреса."""
+        for authorization in ('', 'Bearer чужой'):
+            with self.subTest(authorization=authorization):
+                response = self.client.get(
+                    reverse('metrics'), HTTP_AUTHORIZATION=authorization)
+                self.assertEqual(response.status_code, 404)
+        with override_settings(METRICS_TOKEN=''):
+            response = self.client.get(reverse('metrics'),
+                                       HTTP_AUTHORIZATION='Bearer ')
+            self.assertEqual(response.status_code, 404)
+
+
+class QueryBudgetCheckTest(SimpleTestCase):
+    def make_recorder(self, count, duration):
+        return QueryRecorder([
+            RecordedQuery(alias='default', sql='SELECT 1',
+                          duration=duration, call_site='')
+            for _ in range(count)
+        ])
+
+    @override_settings(QUERY_BUDGETS={'posts:index': {'queries': 2,
+                                                      'time': 0.01}})
+    def test_time_is_checked_only_when_enabled(self):
+        slow = self.make_recorder(2, 1.0)
+        self.assertIsNone(check_budget('posts:index', slow))
+        with override_settings(QUERY_BUDGETS_CHECK_TIME=True):
+            self.assertIn('мс в БД', check_budget('posts:index', slow))
+        self.assertIn('3 запросов',
+                      check_budget('posts:index', self.make_recorder(3, 0)))
+
+    @override_settings(
+        QUERY_BUDGETS={'posts:index': {'queries': 2, 'time': 0.01}},
+        QUERY_BUDGETS_SHARDED={'posts:index': {'queries': 3,
+                                               'per_shard': 1}},
+    )
+    def test_sharded_budget_counts_shards(self):
+        recorder = self.make_recorder(5, 0)
+        self.assertIn('5 запросов при бюджете 2',
+                      check_budget('posts:index', recorder))
+        with override_settings(POST_SHARDS=['shard_0', 'shard_1']):
+            self.assertIsNone(check_budget('posts:index', recorder))
+            self.assertIn('6 запросов при бюджете 5',
+                          check_budget('posts:index',
+                                       self.make_recorder(6, 0)))
+
+
+class InlineIncludeTest(SimpleTestCase):
+    def test_renders_included_template_with_context(self):
+        """Встроенный шаблон видит контекст родителя и переменные with."""
+        template = Template(
+            "{% load inline_templates %}{% for item in items %}"
+            "{% inline_include 'includes/post_image.html' "
+            "with post=item %}{% endfor %}"
+        )
+        items = [SimpleNamespace(image=True, thumbnail=''),
+                 SimpleNamespace(image=False)]
+        rendered = template.render(Context({'items': items}))
+        self.assertEqual(rendered.count('bg-light'), 1)
+
+    def test_rejects_variable_name(self):
+        """Имя шаблона должно быть известно при компиляции."""
+        with self.assertRaises(TemplateSyntaxError):
+            Template("{% load inline_templates %}"
+                     "{% inline_include name %}")
+
+
+class SqlitePragmasTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_new_connection_gets_pragmas(self):
+        """Каждое новое соединение SQLite получает PRAGMA из настроек."""
+        default = connections['default']
+        settings_dict = {**default.settings_dict,
+                         'NAME': os.path.join(self.directory, 'db.sqlite3')}
+        new_connection = default.__class__(settings_dict)
+        self.addCleanup(new_connection.close)
+        with new_connection.cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'cache_size',
+                         'temp_store'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1,
+                                   'cache_size': -64 * 1024,
+                                   'temp_store': 2})
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(TransactionTestCase):
+    # Копирование в реплику невозможно внутри транзакции теста.
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        Post.objects.create(author=self.author, text='Пост на реплике')
+        cache.clear()
+        refresh_replica('replica')
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        """Ленты читаются с реплики, запись уходит в primary."""
+        Post.objects.create(author=self.author, text='Ещё не на реплике')
+        response = self.reader_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Пост на реплике')
+        self.assertNotContains(response, 'Ещё не на реплике')
+        refresh_replica('replica')
+        cache.clear()
+        response = self.reader_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Ещё не на реплике')
+
+    def test_author_reads_own_writes(self):
+        """После записи автор читает из primary, остальные - с реплики."""
+        self.author_client.post(reverse('posts:post_create'),
+                                {'text': 'Свежий пост'})
+        self.assertTrue(
+            Post.objects.using('default').filter(text='Свежий пост').exists()
+        )
+        for client, visible in ((self.author_client, True),
+                                (self.reader_client, False)):
+            with self.subTest(visible=visible):
+                response = client.get(reverse('posts:index'))
+                self.assertEqual('Свежий пост' in response.content.decode(),
+                                 visible)
+
+    def test_replica_cached_pages_expire_soon(self):
+        """Страница, построенная по реплике, кешируется ненадолго."""
+        with mock.patch.object(cache, 'set_many',
+                               wraps=cache.set_many) as set_many:
+            self.reader_client.get(reverse('posts:index'))
+        self.assertEqual(set_many.call_args.args[1],
+                         settings.REPLICA_LISTING_CACHE_TIMEOUT)
@@ -1,19 +1,34 @@
 from django.contrib import admin
+from django.db.models.expressions import RawSQL
 
+from . import search
 from .models import Comment, Follow, Group, Post
 
 
-class PostAdmin(admin.ModelAdmin):
+class FullTextSearchMixin:
+    """Поиск в админке по индексу FTS5 вместо LIKE '%...%'."""
+    search_table = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search.build_match(search_term):
+            return queryset, False
+        sql, params = search.match_subquery(self.search_table, search_term)
+        return queryset.filter(id__in=RawSQL(sql, params)), False
+
+
+class PostAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['pk', 'text', 'created', 'author', 'group']
     list_editable = ('group',)
     search_fields = ('text',)
+    search_table = search.POST_TABLE
     list_filter = ('created',)
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['pk', 'text', 'created', 'author']
     search_fields = ('text',)
+    search_table = search.COMMENT_TABLE
     list_filter = ('created',)
     empty_value_display = '-пусто-'
 
@@ -0,0 +1,78 @@
+"""Архив старых постов: горячая и холодная таблицы.
+
+Общие ленты читают только горячую таблицу Post, поэтому она и её
+индексы не растут вместе с историей. Посты старше
+settings.ARCHIVE_AFTER_DAYS вместе с комментариями пачками переносятся
+в ArchivedPost и ArchivedComment той же базы (шарда) с теми же id.
+Страница поста и профиль дочитывают архив, если поста нет в горячей
+таблице или посты автора в ней кончились: архивные посты всегда старше
+горячих.
+
+Архив только для чтения. Поиск и счётчики постов автора учитывают
+архивные посты, ленты подписок - нет.
+"""
+from datetime import datetime
+from typing import Sequence
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import Http404
+
+from . import caching, sharding
+from .models import ArchivedComment, ArchivedPost, Comment, FeedEntry, Post
+
+
+def _copy(model, obj):
+    """Экземпляр model с теми же значениями колонок, что у obj."""
+    return model(**{field.attname: getattr(obj, field.attname)
+                    for field in model._meta.concrete_fields})
+
+
+def archive_posts(using: str, before: datetime, batch_size: int) -> int:
+    """Переносит в архив базы using посты, созданные до before.
+
+    Каждая пачка - отдельная транзакция, самые старые посты первыми.
+    Возвращает число перенесённых постов.
+    """
+    moved = 0
+    while True:
+        with transaction.atomic(using=using):
+            posts = list(
+                Post.objects.using(using).with_related('author', 'group')
+                .filter(created__lt=before)
+                .order_by('created', 'id')[:batch_size]
+            )
+            if not posts:
+                return moved
+            post_ids = [post.pk for post in posts]
+            comments = Comment.objects.using(using).filter(
+                post_id__in=post_ids)
+            ArchivedPost.objects.using(using).bulk_create(
+                [_copy(ArchivedPost, post) for post in posts])
+            ArchivedComment.objects.using(using).bulk_create(
+                [_copy(ArchivedComment, comment) for comment in comments])
+            # Без сигналов удаления: пост не удалён, а перенесён.
+            if using == DEFAULT_DB_ALIAS:
+                FeedEntry.objects.filter(
+                    post_id__in=post_ids)._raw_delete(using)
+            comments._raw_delete(using)
+            Post.objects.using(using).filter(
+                pk__in=post_ids)._raw_delete(using)
+        caching.bump(*{scope for post in posts
+                       for scope in caching.post_scopes(post)})
+        moved += len(posts)
+
+
+def get_post_or_404(post_id: int, related: Sequence[str] = (),
+                    only: Sequence[str] = ()):
+    """Пост из горячей таблицы, а если его там нет - из архива."""
+    for model in (Post, ArchivedPost):
+        queryset = model.objects.all()
+        if related:
+            queryset = queryset.with_related(*related)
+        if only:
+            queryset = queryset.only(*only)
+        try:
+            return sharding.on_post_shard(queryset, post_id).get(pk=post_id)
+        except model.DoesNotExist:
+            pass
+    raise Http404('Пост не найден')
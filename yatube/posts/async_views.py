@@ -0,0 +1,162 @@
+"""Асинхронные версии страниц чтения для ASGI.
+
+Данные выбираются асинхронным API ORM, поэтому медленный клиент
+не занимает поток. Всё, что нужно шаблону, загружается заранее,
+а сам шаблон рендерится в потоке (arender): кеш фрагментов карточек
+читается из SQLite блокирующим вызовом и не должен держать цикл
+событий. Маршруты подключает yatube.urls_async.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from core.routers import use_replica
+
+from . import archive, comment_queue, follows, sharding
+from .caching import cache_listing, post_detail_last_modified
+from .forms import CommentForm
+from .models import PROFILE_FIELDS, FeedEntry, Group, Post, User
+from .utils import acreate_paginator
+
+
+async def aget_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'{queryset.model._meta.object_name} не найден')
+
+
+async def load_user(request):
+    """Загружает request.user, чтобы шаблон не обращался к БД."""
+    await sync_to_async(lambda: request.user.pk)()
+    return request.user
+
+
+async def arender(request, template_name, context=None):
+    """render() в потоке, как и прочие блокирующие вызовы."""
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def paginate(request, object_list,
+                   count=settings.COUNT_OF_VISIBLE_POSTS, **kwargs):
+    return await acreate_paginator(request, object_list, count, **kwargs)
+
+
+def acondition(etag_func, last_modified_func):
+    """Аналог django.views.decorators.http.condition для async-view."""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            etag = await sync_to_async(etag_func)(request, *args, **kwargs)
+            last_modified = await sync_to_async(last_modified_func)(
+                request, *args, **kwargs
+            )
+            etag = quote_etag(etag) if etag else None
+            last_modified = (
+                int(last_modified.timestamp()) if last_modified else None
+            )
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header(
+                        'Last-Modified'):
+                    response['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return wrapper
+    return decorator
+
+
+@use_replica
+@cache_listing('index')
+async def index(request):
+    await load_user(request)
+    page_obj = await paginate(request, Post.objects.for_feed(),
+                              databases=sharding.shards())
+    return await arender(request, 'posts/index.html',
+                         {'page_obj': page_obj})
+
+
+@use_replica
+@cache_listing('group:{slug}')
+async def group_posts(request, slug):
+    await load_user(request)
+    group = await aget_object_or_404(Group.objects.all(), slug=slug)
+    page_obj = await paginate(request, group.posts.for_group(),
+                              databases=sharding.shards())
+    return await arender(request, 'posts/group_list.html',
+                         {'group': group, 'page_obj': page_obj})
+
+
+@use_replica
+@cache_listing('profile:{username}')
+async def profile(request, username):
+    viewer = await load_user(request)
+    user = await aget_object_or_404(
+        User.objects.select_related('stats').only(*PROFILE_FIELDS),
+        username=username
+    )
+    page_obj = await paginate(request, user.posts.for_profile(),
+                              fallback=user.archived_posts.for_profile())
+    return await arender(request, 'posts/profile.html', {
+        'author': user,
+        'page_obj': page_obj,
+        'following': await follows.ais_following(viewer, user),
+    })
+
+
+@use_replica
+@acondition(etag_func=comment_queue.post_detail_etag,
+            last_modified_func=post_detail_last_modified)
+async def post_detail(request, post_id):
+    user = await load_user(request)
+    post = await sync_to_async(archive.get_post_or_404)(
+        post_id, related=('author__stats', 'group')
+    )
+    comments = await paginate(
+        request,
+        post.comments.with_related('author'),
+        settings.COUNT_OF_VISIBLE_COMMENTS
+    )
+    return await arender(
+        request,
+        'posts/post_detail.html',
+        {
+            'post': post,
+            'form': CommentForm(),
+            'comments': comments,
+            'pending_comments': await sync_to_async(comment_queue.pending)(
+                post, user),
+        })
+
+
+@use_replica
+async def follow_index(request):
+    user = await load_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    if sharding.enabled():
+        # Как и в синхронной версии: посты авторов с их шардов.
+        author_ids = await follows.afollowee_ids(user.pk)
+        page_obj = await paginate(
+            request,
+            Post.objects.filter(author_id__in=author_ids).for_feed(),
+            databases=sharding.shards(author_ids)
+        )
+        return await arender(request, 'posts/follow.html',
+                             {'page_obj': page_obj})
+    feed_entries = FeedEntry.objects.filter(user=user).for_feed()
+    page_obj = await paginate(request, feed_entries)
+    page_obj.object_list = [entry.post for entry in page_obj]
+    return await arender(request, 'posts/follow.html',
+                         {'page_obj': page_obj})
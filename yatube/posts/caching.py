@@ -0,0 +1,247 @@
+"""Кеш страниц-лент с версионированными ключами.
+
+Каждая лента зависит от набора «областей» (index, group:<slug>,
+profile:<username>, groups). Сигналы моделей увеличивают версию
+области, поэтому закешированные страницы можно хранить долго:
+после изменения ключ меняется и страница строится заново.
+Перестроение защищено блокировкой от одновременного «набега»
+запросов: пока один запрос строит страницу, остальные получают
+предыдущую версию или ждут результата.
+
+Из тех же версий собирается ETag: клиент, у которого уже есть
+текущая страница, получает 304 без обращения к кешу страниц и БД.
+"""
+import asyncio
+import hashlib
+import time
+from functools import partial, wraps
+from typing import Iterable, List
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from core.routers import reading_from_replica
+
+from . import sharding
+from .models import Comment, Post, UserStats
+
+VERSION_KEY = 'listing-version:{scope}'
+# Область, от которой зависят все ленты: названия групп в карточках.
+GROUPS_SCOPE = 'groups'
+LOCK_POLL_INTERVAL = 0.05
+
+
+def get_versions(scopes: Iterable[str]) -> List[int]:
+    """Текущие версии областей; отсутствующие заводятся заново."""
+    keys = [VERSION_KEY.format(scope=scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes: str) -> None:
+    """Делает устаревшими все страницы, зависящие от областей."""
+    for scope in scopes:
+        key = VERSION_KEY.format(scope=scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Версию вытеснили из кеша: новая не должна совпасть
+            # ни с одной из прежних.
+            cache.set(key, time.time_ns(), None)
+
+
+def post_scopes(post) -> List[str]:
+    """Области, на страницах которых виден пост."""
+    scopes = ['index', f'profile:{post.author.username}']
+    if post.group_id:
+        scopes.append(f'group:{post.group.slug}')
+    return scopes
+
+
+def _post_state(request, post_id):
+    """Одна выборка для ETag и Last-Modified страницы поста."""
+    if not hasattr(request, '_post_state'):
+        last_comment = Comment.objects.filter(
+            post=OuterRef('pk')
+        ).order_by('-created').values('created')[:1]
+        posts = sharding.on_post_shard(Post.objects.filter(pk=post_id),
+                                       post_id)
+        if not sharding.enabled():
+            request._post_state = posts.values(
+                'modified', 'comments_count', 'author__stats__posts_count',
+                last_comment=Subquery(last_comment)
+            ).first()
+            return request._post_state
+        # Счётчики автора лежат в default, а не на шарде поста.
+        state = posts.values(
+            'modified', 'comments_count', 'author_id',
+            last_comment=Subquery(last_comment)
+        ).first()
+        if state is not None:
+            state['author__stats__posts_count'] = (
+                UserStats.objects.filter(user_id=state.pop('author_id'))
+                .values_list('posts_count', flat=True).first()
+            )
+        request._post_state = state
+    return request._post_state
+
+
+def post_detail_etag(request, post_id):
+    """ETag страницы поста: пост, его комментарии, счётчик автора."""
+    state = _post_state(request, post_id)
+    if state is None:
+        return None
+    parts = [request.user.pk or 0, request.get_full_path(),
+             *get_versions([GROUPS_SCOPE]), *state.values()]
+    return hashlib.md5(
+        ':'.join(str(part) for part in parts).encode()
+    ).hexdigest()
+
+
+def post_detail_last_modified(request, post_id):
+    state = _post_state(request, post_id)
+    if state is None:
+        return None
+    return max(filter(None, (state['modified'], state['last_comment'])))
+
+
+def cache_listing(*scope_templates: str):
+    """Кеширует GET-ответ ленты до изменения её областей.
+
+    Шаблоны областей форматируются аргументами view, например
+    cache_listing('group:{slug}'). Ключ учитывает пользователя
+    и полный путь запроса, включая курсор. Ответ получает ETag
+    по версиям областей, If-None-Match с ним даёт 304.
+    Подходит и для async-view.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                key, stale_key, etag = await sync_to_async(_listing_keys)(
+                    request, view, scope_templates, kwargs
+                )
+                not_modified = get_conditional_response(request, etag=etag)
+                if not_modified is not None:
+                    return not_modified
+                response = await _asingle_flight(
+                    key, stale_key, partial(view, request, *args, **kwargs)
+                )
+                if response.status_code == 200:
+                    response['ETag'] = etag
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key, stale_key, etag = _listing_keys(request, view,
+                                                 scope_templates, kwargs)
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
+            response = _single_flight(
+                key=key,
+                stale_key=stale_key,
+                render=lambda: view(request, *args, **kwargs),
+            )
+            if response.status_code == 200:
+                response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
+
+
+def _listing_keys(request, view, scope_templates, kwargs) -> tuple:
+    """Ключ страницы, ключ устаревшей копии и ETag."""
+    scopes = [template.format(**kwargs) for template in scope_templates]
+    scopes.append(GROUPS_SCOPE)
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    base_key = (
+        f'{view.__module__}.{view.__name__}:'
+        f'{request.user.pk or 0}:{path}'
+    )
+    versions = '.'.join(str(v) for v in get_versions(scopes))
+    key = f'listing:{base_key}:{versions}'
+    etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+    return key, f'listing-stale:{base_key}', etag
+
+
+def _listing_timeout() -> int:
+    """Страница с реплики могла отстать, она живёт недолго."""
+    if reading_from_replica():
+        return settings.REPLICA_LISTING_CACHE_TIMEOUT
+    return settings.LISTING_CACHE_TIMEOUT
+
+
+def _single_flight(key: str, stale_key: str, render) -> HttpResponse:
+    cached = cache.get(key)
+    if cached is not None:
+        return _restore(cached)
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, settings.LISTING_CACHE_LOCK_TIMEOUT):
+        try:
+            response = render()
+            if response.status_code == 200:
+                stored = (response.content, response['Content-Type'])
+                cache.set_many({key: stored, stale_key: stored},
+                               _listing_timeout())
+        finally:
+            cache.delete(lock_key)
+        return response
+    stale = cache.get(stale_key)
+    if stale is not None:
+        return _restore(stale)
+    deadline = time.monotonic() + settings.LISTING_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        cached = cache.get(key)
+        if cached is not None:
+            return _restore(cached)
+    return render()
+
+
+async def _asingle_flight(key: str, stale_key: str,
+                          render) -> HttpResponse:
+    """_single_flight для async-view: ожидание не занимает поток."""
+    cached = await cache.aget(key)
+    if cached is not None:
+        return _restore(cached)
+    lock_key = f'{key}:lock'
+    if await cache.aadd(lock_key, 1, settings.LISTING_CACHE_LOCK_TIMEOUT):
+        try:
+            response = await render()
+            if response.status_code == 200:
+                stored = (response.content, response['Content-Type'])
+                await cache.aset_many({key: stored, stale_key: stored},
+                                      _listing_timeout())
+        finally:
+            await cache.adelete(lock_key)
+        return response
+    stale = await cache.aget(stale_key)
+    if stale is not None:
+        return _restore(stale)
+    deadline = time.monotonic() + settings.LISTING_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+        cached = await cache.aget(key)
+        if cached is not None:
+            return _restore(cached)
+    return await render()
+
+
+def _restore(stored) -> HttpResponse:
+    content, content_type = stored
+    return HttpResponse(content, content_type=content_type)
@@ -0,0 +1,333 @@
+"""Отложенная запись комментариев (write-behind).
+
+При settings.COMMENT_WRITE_BEHIND add_comment не пишет в БД и не ждёт
+блокировки записи SQLite: проверенный комментарий сохраняется файлом
+в каталог COMMENT_QUEUE_DIR. Фоновый поток процесса раз
+в COMMENT_FLUSH_INTERVAL секунд забирает до COMMENT_FLUSH_BATCH_SIZE
+файлов и записывает их через bulk_create одной транзакцией на базу
+(шард) вместе с поисковым индексом в default. Сигналы при этом
+не срабатывают, поэтому счётчики, поисковый индекс и кеш лент
+обновляет flush(). Поле created получает время записи в БД, порядок
+комментариев сохраняется. Комментарий к посту, который тем временем
+ушёл в архив, записывается в ArchivedComment.
+
+Файл забирается переименованием, поэтому процессы не делят одну пачку.
+Файлы пачки удаляются сразу после фиксации её транзакции, а если
+пачка базы не записалась, в очередь возвращаются только её файлы.
+Если процесс упал, забранные им файлы через COMMENT_CLAIM_TIMEOUT
+секунд возвращаются в очередь, а если он упал между фиксацией
+транзакции и удалением файлов, комментарии запишутся повторно.
+При COMMENT_FLUSH_INTERVAL = 0 фонового потока нет и очередь
+разбирает команда flush_comments.
+
+Пока комментарий в очереди, автор видит его на странице поста:
+ожидающие записи комментарии лежат в кеше по посту и автору.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core import metrics
+
+from . import caching, counters, search, sharding
+from .models import ArchivedComment, ArchivedPost, Comment, CommentId, Post
+
+PENDING_KEY = 'pending-comments:{post_id}:{user_id}'
+# Сколько хранится список ожидающих комментариев, если поток,
+# который их записал, не успел его почистить.
+PENDING_TIMEOUT = 60 * 5
+CLAIMED_SUFFIX = '.claimed'
+
+logger = logging.getLogger(__name__)
+
+_flusher: Optional[threading.Thread] = None
+_flusher_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return settings.COMMENT_WRITE_BEHIND
+
+
+def enqueue(post: Post, author, text: str) -> None:
+    """Ставит комментарий в очередь на запись."""
+    entry = {
+        'key': uuid.uuid4().hex,
+        'post_id': post.pk,
+        'author_id': author.pk,
+        'text': text,
+        'created': time.time(),
+    }
+    directory = settings.COMMENT_QUEUE_DIR
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+        json.dump(entry, file, ensure_ascii=False)
+        file.flush()
+        os.fsync(file.fileno())
+    # Имя начинается со времени: сортировка имён - порядок очереди.
+    os.replace(temporary, os.path.join(
+        directory, f'{time.time_ns():020d}-{entry["key"]}.json'
+    ))
+    key = PENDING_KEY.format(post_id=post.pk, user_id=author.pk)
+    cache.set(key, (cache.get(key) or []) + [entry], PENDING_TIMEOUT)
+    start_flusher()
+
+
+def pending(post, user) -> list:
+    """Ещё не записанные комментарии user к post, новые первыми."""
+    if not enabled() or not user.is_authenticated:
+        return []
+    entries = cache.get(PENDING_KEY.format(post_id=post.pk,
+                                           user_id=user.pk)) or []
+    # Пост мог уйти в архив, пока комментарий ждёт записи.
+    model = ArchivedComment if isinstance(post, ArchivedPost) else Comment
+    return [
+        model(post=post, author=user, text=entry['text'],
+              created=datetime.fromtimestamp(entry['created'],
+                                             timezone.utc))
+        for entry in reversed(entries)
+    ]
+
+
+def post_detail_etag(request, post_id):
+    """ETag страницы поста с учётом ожидающих комментариев читателя."""
+    etag = caching.post_detail_etag(request, post_id)
+    if etag is None or not enabled() or not request.user.is_authenticated:
+        return etag
+    entries = cache.get(PENDING_KEY.format(post_id=post_id,
+                                           user_id=request.user.pk)) or []
+    if not entries:
+        return etag
+    return hashlib.md5(':'.join(
+        [etag, *(entry['key'] for entry in entries)]
+    ).encode()).hexdigest()
+
+
+def _release_stale(directory: str) -> None:
+    """Возвращает в очередь файлы, забранные и не записанные вовремя."""
+    deadline = time.time() - settings.COMMENT_CLAIM_TIMEOUT
+    for name in os.listdir(directory):
+        if not name.endswith(CLAIMED_SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < deadline:
+                os.replace(path, path[:-len(CLAIMED_SUFFIX)])
+        except OSError:
+            pass
+
+
+def _claim(directory: str, batch_size: int) -> List[str]:
+    """Забирает из очереди до batch_size самых старых файлов."""
+    claimed = []
+    for name in sorted(os.listdir(directory)):
+        if len(claimed) == batch_size:
+            break
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            # Файл мог забрать другой процесс.
+            os.replace(path, path + CLAIMED_SUFFIX)
+            os.utime(path + CLAIMED_SUFFIX)
+        except OSError:
+            continue
+        claimed.append(path + CLAIMED_SUFFIX)
+    return claimed
+
+
+def _group(entries: List[dict]) -> dict:
+    """Комментарии по базам постов: {alias: [(entry, comment), ...]}.
+
+    Если поста уже нет в горячей таблице, комментарий пишется к его
+    архивной копии.
+    """
+    post_ids = list({entry['post_id'] for entry in entries})
+    posts = sharding.in_bulk(Post.objects.with_related('author', 'group'),
+                             post_ids)
+    missing = [post_id for post_id in post_ids if post_id not in posts]
+    if missing:
+        posts.update(sharding.in_bulk(
+            ArchivedPost.objects.with_related('author', 'group'), missing))
+    batches = defaultdict(list)
+    for entry in entries:
+        post = posts.get(entry['post_id'])
+        if post is None:
+            # Пост удалили, пока комментарий ждал записи.
+            logger.warning('Комментарий к посту %s отброшен: поста нет',
+                           entry['post_id'])
+            continue
+        if isinstance(post, ArchivedPost):
+            # Архив не заполняет created сам.
+            comment = ArchivedComment(post=post,
+                                      created=datetime.now(timezone.utc))
+        else:
+            comment = Comment(post=post)
+        comment.author_id = entry['author_id']
+        comment.text = entry['text']
+        batches[post._state.db].append((entry, comment))
+    return batches
+
+
+def _save(alias: str, comments: list) -> None:
+    """Записывает пачку комментариев базы alias.
+
+    Индекс поиска в default фиксируется вместе с пачкой: внешняя
+    транзакция default закрывается после транзакции шарда.
+    """
+    if sharding.enabled():
+        ids = CommentId.objects.bulk_create([CommentId() for _ in comments])
+        for comment, comment_id in zip(comments, ids):
+            comment.pk = comment_id.pk
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        with transaction.atomic(using=alias):
+            for model in (Comment, ArchivedComment):
+                batch = [comment for comment in comments
+                         if isinstance(comment, model)]
+                if batch:
+                    model.objects.using(alias).bulk_create(batch)
+            added = Counter((type(comment.post), comment.post_id)
+                            for comment in comments)
+            for (post_model, post_id), count in added.items():
+                counters.change_comments_count(post_id, count, post_model)
+            for comment in comments:
+                search.index_comment(comment)
+    caching.bump(*{scope for comment in comments
+                   for scope in caching.post_scopes(comment.post)})
+
+
+def _release(paths: List[str]) -> None:
+    """Возвращает забранные файлы в очередь."""
+    for path in paths:
+        os.replace(path, path[:-len(CLAIMED_SUFFIX)])
+
+
+def _forget_pending(entries: List[dict]) -> None:
+    """Убирает записанные комментарии из списков ожидающих."""
+    keys = defaultdict(set)
+    for entry in entries:
+        keys[PENDING_KEY.format(post_id=entry['post_id'],
+                                user_id=entry['author_id'])].add(
+            entry['key'])
+    for key, written in keys.items():
+        left = [entry for entry in cache.get(key) or []
+                if entry['key'] not in written]
+        if left:
+            cache.set(key, left, PENDING_TIMEOUT)
+        else:
+            cache.delete(key)
+
+
+def flush(batch_size: Optional[int] = None) -> int:
+    """Записывает в БД одну пачку из очереди.
+
+    Возвращает число забранных из очереди комментариев.
+    """
+    directory = settings.COMMENT_QUEUE_DIR
+    if not os.path.isdir(directory):
+        return 0
+    _release_stale(directory)
+    claimed = _claim(directory,
+                     batch_size or settings.COMMENT_FLUSH_BATCH_SIZE)
+    if not claimed:
+        return 0
+    entries, paths = [], {}
+    for path in claimed:
+        with open(path, encoding='utf-8') as file:
+            entry = json.load(file)
+        entries.append(entry)
+        paths[entry['key']] = path
+    started = time.perf_counter()
+    try:
+        batches = _group(entries)
+    except Exception:
+        # Вернуть в очередь: запишутся при следующем проходе.
+        _release(claimed)
+        raise
+    grouped = {entry['key'] for batch in batches.values()
+               for entry, _ in batch}
+    for entry in entries:
+        if entry['key'] not in grouped:
+            os.remove(paths[entry['key']])
+    failed = set()
+    error = None
+    for alias, batch in batches.items():
+        keys = [entry['key'] for entry, _ in batch]
+        try:
+            _save(alias, [comment for _, comment in batch])
+        except Exception as exc:
+            # Пачки других баз уже зафиксированы: вернуть только эту.
+            _release([paths[key] for key in keys])
+            failed.update(keys)
+            error = error or exc
+            continue
+        for key in keys:
+            os.remove(paths[key])
+    done = [entry for entry in entries if entry['key'] not in failed]
+    now = time.time()
+    metrics.COMMENT_FLUSH_DURATION.observe(time.perf_counter() - started)
+    metrics.COMMENT_FLUSH_BATCH.observe(len(done))
+    for entry in done:
+        metrics.COMMENT_FLUSH_DELAY.observe(now - entry['created'])
+    _forget_pending(done)
+    if error is not None:
+        raise error
+    return len(entries)
+
+
+def flush_all() -> int:
+    """Разбирает очередь целиком, возвращает число комментариев."""
+    total = 0
+    while True:
+        flushed = flush()
+        if not flushed:
+            return total
+        total += flushed
+
+
+def _run() -> None:
+    while True:
+        time.sleep(settings.COMMENT_FLUSH_INTERVAL)
+        try:
+            flush_all()
+        except Exception:
+            logger.exception('Не удалось записать комментарии из очереди')
+        finally:
+            # Поток живёт долго: не держим открытые соединения с БД.
+            connections.close_all()
+            metrics.REGISTRY.flush()
+
+
+def _flush_at_exit() -> None:
+    try:
+        flush_all()
+    except Exception:
+        logger.exception('Комментарии остались в очереди до перезапуска')
+
+
+def start_flusher() -> None:
+    """Запускает фоновый поток записи, если он ещё не запущен."""
+    global _flusher
+    if not settings.COMMENT_FLUSH_INTERVAL:
+        return
+    with _flusher_lock:
+        if _flusher is not None and _flusher.is_alive():
+            return
+        if _flusher is None:
+            atexit.register(_flush_at_exit)
+        _flusher = threading.Thread(target=_run, name='comment-flusher',
+                                    daemon=True)
+        _flusher.start()
@@ -0,0 +1,86 @@
+"""Денормализованные счётчики постов, комментариев и подписок."""
+from collections import Counter
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import sharding
+from .models import (ArchivedComment, ArchivedPost, Comment, Follow, Post,
+                     User, UserStats)
+
+
+def change_user_stats(user_id: int, **deltas: int) -> None:
+    """Атомарно изменяет счётчики пользователя на deltas."""
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if UserStats.objects.filter(user_id=user_id).update(**updates):
+        return
+    # Строки ещё нет. При уменьшении её не создаём: так бывает,
+    # когда удаляется сам пользователь вместе со своими записями.
+    if all(delta > 0 for delta in deltas.values()):
+        UserStats.objects.get_or_create(user_id=user_id)
+        UserStats.objects.filter(user_id=user_id).update(**updates)
+
+
+def change_comments_count(post_id: int, delta: int, model=Post) -> None:
+    """Атомарно изменяет счётчик комментариев поста (model=ArchivedPost -
+    архивного).
+    """
+    posts = sharding.on_post_shard(model.objects.all(), post_id)
+    posts.filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta
+    )
+
+
+def _count(queryset, field: str) -> Coalesce:
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0
+    )
+
+
+def recount() -> None:
+    """Пересчитывает все счётчики по фактическим данным."""
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id)
+         for user_id in User.objects.filter(stats__isnull=True)
+         .values_list('id', flat=True)],
+        ignore_conflicts=True
+    )
+    counts = {
+        'followers_count': _count(Follow.objects.all(), 'author'),
+        'following_count': _count(Follow.objects.all(), 'user'),
+    }
+    if not sharding.enabled():
+        counts['posts_count'] = (
+            _count(Post.objects.all(), 'author')
+            + _count(ArchivedPost.objects.all(), 'author')
+        )
+    UserStats.objects.update(**counts)
+    if sharding.enabled():
+        _recount_sharded_posts()
+    for alias in sharding.post_databases():
+        Post.objects.using(alias).update(
+            comments_count=_count(Comment.objects.all(), 'post'))
+        ArchivedPost.objects.using(alias).update(
+            comments_count=_count(ArchivedComment.objects.all(), 'post'))
+
+
+def _recount_sharded_posts() -> None:
+    """posts_count по шардам: подзапрос из default их не видит."""
+    totals = Counter()
+    for alias in sharding.post_databases():
+        for model in (Post, ArchivedPost):
+            totals.update(dict(
+                model.objects.using(alias).order_by().values('author_id')
+                .annotate(total=Count('pk')).values_list('author_id', 'total')
+            ))
+    stats = list(UserStats.objects.only('pk'))
+    for row in stats:
+        row.posts_count = totals[row.pk]
+    UserStats.objects.bulk_update(stats, ['posts_count'], batch_size=500)
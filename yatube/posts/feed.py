@@ -0,0 +1,103 @@
+"""Материализованные ленты подписок (fan-out on write).
+
+Лента пользователя хранится в FeedEntry: пост раскладывается в ленты
+подписчиков при публикации, а подписка и отписка добавляют или убирают
+посты автора. Длина ленты ограничена settings.FEED_MAX_LENGTH: при
+публикации ленты не обрезаются (у популярного автора это удаление по
+всем подписчикам на каждый пост), лишние записи пачками удаляет
+команда trim_feeds по расписанию.
+"""
+from typing import Iterable, List
+
+from django.conf import settings
+from django.db.models import Count, OuterRef, Subquery
+
+from .models import FeedEntry, Follow, Post
+
+
+def fan_out(post: Post) -> None:
+    """Раскладывает новый пост в ленты подписчиков автора."""
+    follower_ids = list(
+        Follow.objects.filter(author_id=post.author_id)
+        .values_list('user_id', flat=True)
+    )
+    if not follower_ids:
+        return
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=user_id, post=post, created=post.created)
+         for user_id in follower_ids],
+        ignore_conflicts=True
+    )
+
+
+def backfill(user_id: int, author_id: int) -> None:
+    """Добавляет в ленту последние посты автора после подписки."""
+    posts = (
+        Post.objects.filter(author_id=author_id)
+        .order_by('-created', '-id')
+        .values_list('id', 'created')[:settings.FEED_MAX_LENGTH]
+    )
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=user_id, post_id=post_id, created=created)
+         for post_id, created in posts],
+        ignore_conflicts=True
+    )
+    trim([user_id])
+
+
+def prune(user_id: int, author_id: int) -> None:
+    """Убирает из ленты посты автора после отписки."""
+    FeedEntry.objects.filter(
+        user_id=user_id,
+        post__author_id=author_id
+    ).delete()
+
+
+def trim(user_ids: Iterable[int]) -> None:
+    """Обрезает ленты до settings.FEED_MAX_LENGTH последних записей."""
+    oldest_kept = (
+        FeedEntry.objects.filter(user_id=OuterRef('user_id'))
+        .order_by('-created', '-id')
+        .values('created')[settings.FEED_MAX_LENGTH - 1:
+                           settings.FEED_MAX_LENGTH]
+    )
+    FeedEntry.objects.filter(
+        user_id__in=list(user_ids),
+        created__lt=Subquery(oldest_kept)
+    ).delete()
+
+
+def overflowing_user_ids() -> List[int]:
+    """Пользователи, чьи ленты длиннее settings.FEED_MAX_LENGTH."""
+    return list(
+        FeedEntry.objects.order_by().values('user_id')
+        .annotate(length=Count('id'))
+        .filter(length__gt=settings.FEED_MAX_LENGTH)
+        .values_list('user_id', flat=True)
+    )
+
+
+def trim_all(batch_size: int) -> int:
+    """Обрезает все переполненные ленты, batch_size лент за запрос.
+
+    Возвращает число обрезанных лент.
+    """
+    user_ids = overflowing_user_ids()
+    for start in range(0, len(user_ids), batch_size):
+        trim(user_ids[start:start + batch_size])
+    return len(user_ids)
+
+
+def rebuild(user_id: int) -> int:
+    """Пересобирает ленту пользователя с нуля по его подпискам."""
+    FeedEntry.objects.filter(user_id=user_id).delete()
+    posts = (
+        Post.objects.filter(author__following__user_id=user_id)
+        .order_by('-created', '-id')
+        .values_list('id', 'created')[:settings.FEED_MAX_LENGTH]
+    )
+    entries = FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=user_id, post_id=post_id, created=created)
+         for post_id, created in posts]
+    )
+    return len(entries)
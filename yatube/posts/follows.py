@@ -0,0 +1,80 @@
+"""Граф подписок с кешем множеств авторов.
+
+Множество авторов, на которых подписан пользователь, хранится в кеше
+целиком и сбрасывается сигналами Follow: проверка «подписан ли»
+- вхождение в множество без запроса к БД. Подписка не проверяет
+существование заранее, повтор отсекает ограничение unique_follow.
+"""
+from typing import FrozenSet
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from .models import Follow
+
+FOLLOWEES_KEY = 'followees:{user_id}'
+
+
+def followee_ids(user_id: int) -> FrozenSet[int]:
+    """id авторов, на которых подписан пользователь."""
+    key = FOLLOWEES_KEY.format(user_id=user_id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(
+            Follow.objects.filter(user_id=user_id)
+            .values_list('author_id', flat=True)
+        )
+        cache.set(key, ids, settings.FOLLOW_GRAPH_CACHE_TIMEOUT)
+    return ids
+
+
+async def afollowee_ids(user_id: int) -> FrozenSet[int]:
+    key = FOLLOWEES_KEY.format(user_id=user_id)
+    ids = await cache.aget(key)
+    if ids is None:
+        ids = frozenset([
+            author_id async for author_id in
+            Follow.objects.filter(user_id=user_id)
+            .values_list('author_id', flat=True)
+        ])
+        await cache.aset(key, ids, settings.FOLLOW_GRAPH_CACHE_TIMEOUT)
+    return ids
+
+
+def is_following(user, author) -> bool:
+    return user.is_authenticated and author.pk in followee_ids(user.pk)
+
+
+async def ais_following(user, author) -> bool:
+    return (user.is_authenticated
+            and author.pk in await afollowee_ids(user.pk))
+
+
+def follow(user, author) -> bool:
+    """Подписывает user на author. False, если подписка уже была."""
+    if user.pk == author.pk:
+        return False
+    try:
+        with transaction.atomic():
+            Follow.objects.create(user=user, author=author)
+    except IntegrityError:
+        return False
+    return True
+
+
+def unfollow(user, author) -> bool:
+    """Отписывает user от author. False, если подписки не было."""
+    deleted, _ = Follow.objects.filter(user=user, author=author).delete()
+    return bool(deleted)
+
+
+def invalidate(user_id: int) -> None:
+    """Сбрасывает множество сразу и после фиксации транзакции.
+
+    Повторный сброс нужен, если параллельный запрос успел прочитать
+    из БД и закешировать множество до фиксации.
+    """
+    key = FOLLOWEES_KEY.format(user_id=user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
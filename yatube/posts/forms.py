@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 
 from .models import Comment, Post
 
@@ -12,6 +13,25 @@ class PostForm(forms.ModelForm):
             'group': 'Группа, к которой будет относиться пост',
         }
 
+    def clean_image(self):
+        """Слишком большие картинки отклоняются до сохранения."""
+        image = self.cleaned_data.get('image')
+        # У новой загрузки ImageField уже проверил файл через Pillow.
+        pillow_image = getattr(image, 'image', None)
+        if pillow_image is None:
+            return image
+        width, height = pillow_image.size
+        if max(width, height) > settings.IMAGE_MAX_SIDE:
+            raise forms.ValidationError(
+                f'Сторона картинки не должна превышать '
+                f'{settings.IMAGE_MAX_SIDE} px'
+            )
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            raise forms.ValidationError(
+                'Картинка слишком большая, уменьшите её разрешение'
+            )
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,154 @@
+"""Обработка загруженных картинок постов в пуле процессов.
+
+Оригинал сохраняется перекодированным, из него делаются копии
+нескольких ширин в WebP и JPEG с кадрированием ленты (960x339
+по центру). При перекодировании EXIF, GPS и прочие метаданные
+не переносятся, поворот из EXIF применяется к пикселям, прозрачные
+области копий заливаются белым. Pillow работает в отдельных процессах
+и не отнимает GIL у потоков, которые обслуживают запросы.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+ASPECT_RATIO = 960 / 339
+RENDITIONS_DIR = 'posts/renditions'
+# Формат Pillow, расширение файла и параметры кодирования.
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True,
+                             'progressive': True}),
+}
+# Форматы, в которых остаётся оригинал, остальные сохраняются в PNG.
+ORIGINAL_FORMATS = {
+    'JPEG': ('jpg', {'quality': 95}),
+    'WEBP': ('webp', {'quality': 95}),
+    'PNG': ('png', {'optimize': True}),
+}
+# Сведения Pillow об оригинале, нужные для его пикселей.
+KEPT_INFO = ('icc_profile', 'transparency')
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_PROCESS_WORKERS
+        )
+    return _executor
+
+
+def _run(function, *args):
+    """Вызывает function в пуле процессов, если он включён."""
+    if settings.IMAGE_PROCESS_WORKERS:
+        return get_executor().submit(function, *args).result()
+    return function(*args)
+
+
+def rendition_widths(width: int,
+                     widths: Sequence[int]) -> Sequence[int]:
+    """Ширины копий без увеличения: маленькая картинка даёт одну копию."""
+    return [size for size in widths if size <= width] or [width]
+
+
+def encode_original(data: bytes) -> Tuple[bytes, str]:
+    """Перекодирует оригинал без метаданных.
+
+    Возвращает содержимое и расширение файла.
+    """
+    with Image.open(BytesIO(data)) as original:
+        pil_format = (original.format if original.format in ORIGINAL_FORMATS
+                      else 'PNG')
+        image = ImageOps.exif_transpose(original)
+        # Pillow подставляет при сохранении EXIF и XMP из info.
+        image.info = {key: value for key, value in original.info.items()
+                      if key in KEPT_INFO}
+    extension, options = ORIGINAL_FORMATS[pil_format]
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue(), extension
+
+
+def clean_original(file) -> ContentFile:
+    """Копия загруженной картинки без метаданных для хранилища."""
+    file.seek(0)
+    content, extension = _run(encode_original, file.read())
+    stem = os.path.splitext(os.path.basename(file.name))[0]
+    return ContentFile(content, name=f'{stem}.{extension}')
+
+
+def flatten(image: Image.Image) -> Image.Image:
+    """RGB-копия картинки, прозрачные области залиты белым."""
+    if image.mode not in ('RGBA', 'LA', 'PA') and (
+            'transparency' not in image.info):
+        return image.convert('RGB')
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def encode_renditions(data: bytes,
+                      widths: Sequence[int]) -> Dict[str, Dict[int, bytes]]:
+    """Перекодирует картинку во все форматы и ширины.
+
+    Выполняется в дочернем процессе: не обращается к БД и хранилищу.
+    """
+    encoded = {name: {} for name in FORMATS}
+    with Image.open(BytesIO(data)) as original:
+        image = flatten(ImageOps.exif_transpose(original))
+    for width in rendition_widths(image.width, widths):
+        height = max(1, round(width / ASPECT_RATIO))
+        resized = ImageOps.fit(image, (width, height),
+                               method=Image.Resampling.LANCZOS)
+        for name, (pil_format, _, options) in FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            encoded[name][width] = buffer.getvalue()
+    return encoded
+
+
+def create_renditions(image_name: str) -> Dict[str, Dict[str, str]]:
+    """Создаёт копии картинки и возвращает их имена в хранилище.
+
+    Результат: {'webp': {'480': 'posts/renditions/...webp', ...}, ...}.
+    """
+    with default_storage.open(image_name, 'rb') as source:
+        data = source.read()
+    encoded = _run(encode_renditions, data, settings.IMAGE_RENDITION_WIDTHS)
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    renditions = {}
+    for name, by_width in encoded.items():
+        extension = FORMATS[name][1]
+        renditions[name] = {
+            str(width): default_storage.save(
+                f'{RENDITIONS_DIR}/{stem}-{width}.{extension}',
+                ContentFile(content)
+            )
+            for width, content in by_width.items()
+        }
+    return renditions
+
+
+def delete_renditions(renditions: Dict[str, Dict[str, str]]) -> None:
+    """Удаляет файлы копий из хранилища."""
+    for by_width in renditions.values():
+        for name in by_width.values():
+            default_storage.delete(name)
+
+
+def srcset(renditions: Dict[str, str]) -> str:
+    """Значение атрибута srcset для копий одного формата."""
+    return ', '.join(
+        f'{default_storage.url(name)} {width}w'
+        for width, name in sorted(renditions.items(),
+                                  key=lambda item: int(item[0]))
+    )
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from posts import archive, sharding
+
+
+class Command(BaseCommand):
+    help = ('Переносит старые посты с комментариями в архивные таблицы '
+            '(запускается по расписанию)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Возраст поста в днях для архивации')
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.ARCHIVE_BATCH_SIZE,
+                            help='Постов в одной транзакции')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        total = 0
+        for alias in sharding.shards() or [DEFAULT_DB_ALIAS]:
+            moved = archive.archive_posts(alias, before,
+                                          options['batch_size'])
+            self.stdout.write(f'{alias}: {moved}')
+            total += moved
+        self.stdout.write(
+            self.style.SUCCESS(f'Перенесено в архив постов: {total}')
+        )
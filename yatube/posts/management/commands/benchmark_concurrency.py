@@ -0,0 +1,159 @@
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import (override_settings, setup_databases,
+                               teardown_databases)
+
+from core.benchmark import summarize, write_report
+from core.testing import scratch_environment
+from posts import seeding
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность WSGI (пул потоков, '
+            'синхронные view) и ASGI (async-view) при множестве '
+            'одновременных медленных клиентов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000,
+                            help='Количество постов во временной базе')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Всего запросов на каждый вариант')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Одновременных соединений')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Рабочих потоков WSGI-сервера')
+        parser.add_argument('--client-delay', type=float, default=20,
+                            help='Сколько миллисекунд клиент передаёт '
+                                 'запрос, занимая соединение')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Зерно генератора данных')
+        parser.add_argument('--output', default='bench_concurrency.json',
+                            help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     aliases={'default'})
+        # Как в production: без debug_toolbar, его middleware
+        # синхронный и перевёл бы ASGI-запросы в поток.
+        middleware = [name for name in settings.MIDDLEWARE
+                      if not name.startswith('debug_toolbar')]
+        # Кеш и метрики - временные, как в benchmark_views.
+        production = override_settings(DEBUG=False, MIDDLEWARE=middleware,
+                                       QUERY_BUDGETS_ENABLED=False)
+        try:
+            with scratch_environment(), production:
+                seeding.seed(**seeding.scale_for(options['posts']),
+                             seed_value=options['seed'])
+                reader, urls = seeding.pick_targets()
+                urls = list(itertools.islice(
+                    itertools.cycle(urls.values()), options['requests']
+                ))
+                results = [self.run_wsgi(reader, urls, options)]
+                with override_settings(ROOT_URLCONF=settings.ASGI_URLCONF):
+                    results.append(self.run_asgi(reader, urls, options))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+        for result in results:
+            self.stdout.write(
+                f'{result["server"]:<5} {result["throughput_rps"]:>8} '
+                f'запросов/с  p50 {result["p50_ms"]:>8} ms  '
+                f'p95 {result["p95_ms"]:>8} ms'
+            )
+        write_report(options['output'], 'concurrency', results,
+                     posts=options['posts'],
+                     concurrency=options['concurrency'],
+                     workers=options['workers'],
+                     client_delay_ms=options['client_delay'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Результаты сохранены в {options["output"]}')
+        )
+
+    def run_wsgi(self, reader, urls, options):
+        """Синхронный сервер: медленный клиент держит рабочий поток."""
+        cache.clear()
+        delay = options['client_delay'] / 1000
+        workers = threading.BoundedSemaphore(options['workers'])
+        queue = iter(urls)
+        lock = threading.Lock()
+        latencies = []
+        clients = self.login_clients(Client, reader, options)
+
+        def connection_loop(client):
+            try:
+                while True:
+                    with lock:
+                        url = next(queue, None)
+                    if url is None:
+                        return
+                    started = time.perf_counter()
+                    with workers:
+                        time.sleep(delay)
+                        response = client.get(url)
+                    latencies.append(time.perf_counter() - started)
+                    self.check_response(url, response)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            for future in [pool.submit(connection_loop, client)
+                           for client in clients]:
+                future.result()
+        return self.result('wsgi', latencies,
+                           time.perf_counter() - started)
+
+    def run_asgi(self, reader, urls, options):
+        """Async-сервер: ожидание клиента не занимает поток."""
+        cache.clear()
+        delay = options['client_delay'] / 1000
+        queue = iter(urls)
+        latencies = []
+        clients = self.login_clients(AsyncClient, reader, options)
+
+        async def connection_loop(client):
+            for url in queue:
+                started = time.perf_counter()
+                await asyncio.sleep(delay)
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - started)
+                self.check_response(url, response)
+
+        async def run_all():
+            await asyncio.gather(*(connection_loop(client)
+                                   for client in clients))
+
+        started = time.perf_counter()
+        asyncio.run(run_all())
+        return self.result('asgi', latencies,
+                           time.perf_counter() - started)
+
+    def login_clients(self, client_class, reader, options):
+        """Клиенты входят заранее: запись сессий не мешает замеру."""
+        clients = []
+        for _ in range(options['concurrency']):
+            client = client_class()
+            client.force_login(reader)
+            clients.append(client)
+        return clients
+
+    def check_response(self, url, response):
+        if response.status_code != 200:
+            raise CommandError(f'{url} вернул {response.status_code}')
+
+    def result(self, server, latencies, elapsed):
+        return {
+            'server': server,
+            'requests': len(latencies),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            **summarize(latencies),
+        }
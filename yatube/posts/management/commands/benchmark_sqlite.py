@@ -0,0 +1,200 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections, connections
+from django.test import Client
+from django.test.utils import (override_settings, setup_databases,
+                               teardown_databases)
+
+from core.benchmark import summarize, write_report
+from posts import seeding
+from posts.models import Comment, Post
+
+DUMMY_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+}
+# Настройки SQLite по умолчанию: журнал отката, новое соединение
+# на каждый запрос.
+DEFAULT_PROFILE = {
+    'pragmas': {'journal_mode': 'DELETE'},
+    'conn_max_age': 0,
+}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность чтения SQLite при '
+            'одновременной записи: настройки по умолчанию и production '
+            '(WAL, PRAGMA, постоянные соединения)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000,
+                            help='Количество постов во временной базе')
+        parser.add_argument('--duration', type=float, default=5,
+                            help='Секунд нагрузки на каждый вариант')
+        parser.add_argument('--readers', type=int, default=8,
+                            help='Потоков, читающих страницы')
+        parser.add_argument('--writers', type=int, default=2,
+                            help='Потоков, пишущих посты и комментарии')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Зерно генератора данных')
+        parser.add_argument('--output', default='bench_sqlite.json',
+                            help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        # Блокировки и журнал работают только с файлом, не с базой
+        # в памяти, которую создаёт тестовый раннер по умолчанию.
+        directory = tempfile.mkdtemp()
+        database = connections['default'].settings_dict
+        database['TEST'] = {**database.get('TEST', {}),
+                            'NAME': os.path.join(directory, 'bench.sqlite3')}
+        middleware = [name for name in settings.MIDDLEWARE
+                      if not name.startswith('debug_toolbar')]
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     aliases={'default'})
+        try:
+            with override_settings(DEBUG=False, MIDDLEWARE=middleware,
+                                   CACHES=DUMMY_CACHES,
+                                   QUERY_BUDGETS_ENABLED=False,
+                                   METRICS_ENABLED=False):
+                seeding.seed(**seeding.scale_for(options['posts']),
+                             seed_value=options['seed'])
+                reader, urls = seeding.pick_targets()
+                profiles = {
+                    'default': DEFAULT_PROFILE,
+                    'production': {
+                        'pragmas': settings.SQLITE_PRAGMAS,
+                        'conn_max_age': database['CONN_MAX_AGE'],
+                    },
+                }
+                results = [
+                    self.run_profile(name, profile, reader,
+                                     list(urls.values()), options)
+                    for name, profile in profiles.items()
+                ]
+        finally:
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+            shutil.rmtree(directory, ignore_errors=True)
+        for result in results:
+            self.stdout.write(
+                f'{result["profile"]:<10} чтение '
+                f'{result["reads_per_s"]:>8}/с  p95 {result["p95_ms"]:>8} '
+                f'ms  запись {result["writes_per_s"]:>7}/с  '
+                f'ошибок {result["errors"]}'
+            )
+        write_report(options['output'], 'sqlite', results,
+                     posts=options['posts'], duration_s=options['duration'],
+                     readers=options['readers'], writers=options['writers'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Результаты сохранены в {options["output"]}')
+        )
+
+    def run_profile(self, name, profile, reader, urls, options):
+        connections.close_all()
+        database = connections['default'].settings_dict
+        old_age = database['CONN_MAX_AGE']
+        database['CONN_MAX_AGE'] = profile['conn_max_age']
+        try:
+            with override_settings(SQLITE_PRAGMAS=profile['pragmas']):
+                # Первое соединение переключает режим журнала файла.
+                connections['default'].ensure_connection()
+                result = self.load(reader, urls, options)
+        finally:
+            connections.close_all()
+            database['CONN_MAX_AGE'] = old_age
+        result['profile'] = name
+        return result
+
+    def load(self, reader, urls, options):
+        """Читатели и писатели работают одновременно duration секунд."""
+        deadline = time.perf_counter() + options['duration']
+        latencies = []
+        counts = {'writes': 0, 'errors': 0}
+        lock = threading.Lock()
+        clients = []
+        for _ in range(options['readers']):
+            client = Client()
+            client.force_login(reader)
+            clients.append(client)
+        author_ids = list(Post.objects.values_list('author_id', flat=True)
+                          .distinct()[:50])
+        post_ids = list(Post.objects.values_list('id', flat=True)[:200])
+
+        def request_cycle(work):
+            # Как обработчик запросов: соединение закрывается в конце
+            # запроса, если истёк CONN_MAX_AGE.
+            close_old_connections()
+            try:
+                return work()
+            finally:
+                close_old_connections()
+
+        def read_loop(client):
+            try:
+                while time.perf_counter() < deadline:
+                    url = random.choice(urls)
+                    started = time.perf_counter()
+                    try:
+                        response = request_cycle(lambda: client.get(url))
+                    except DatabaseError:
+                        with lock:
+                            counts['errors'] += 1
+                        continue
+                    latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise CommandError(
+                            f'{url} вернул {response.status_code}')
+            finally:
+                connections.close_all()
+
+        def write_loop(number):
+            generator = random.Random(number)
+            try:
+                while time.perf_counter() < deadline:
+                    try:
+                        request_cycle(lambda: self.write(generator,
+                                                         author_ids,
+                                                         post_ids))
+                    except DatabaseError:
+                        with lock:
+                            counts['errors'] += 1
+                        continue
+                    with lock:
+                        counts['writes'] += 1
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['readers']
+                                + options['writers']) as pool:
+            futures = [pool.submit(read_loop, client) for client in clients]
+            futures += [pool.submit(write_loop, number)
+                        for number in range(options['writers'])]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+        return {
+            'reads': len(latencies),
+            'reads_per_s': round(len(latencies) / elapsed, 1),
+            'writes': counts['writes'],
+            'writes_per_s': round(counts['writes'] / elapsed, 1),
+            'errors': counts['errors'],
+            **summarize(latencies or [0.0]),
+        }
+
+    def write(self, generator, author_ids, post_ids):
+        """Новый пост или комментарий, как post_create и add_comment."""
+        if generator.random() < 0.3:
+            Post.objects.create(author_id=generator.choice(author_ids),
+                                text='Пост под нагрузкой')
+        else:
+            Comment.objects.create(post_id=generator.choice(post_ids),
+                                   author_id=generator.choice(author_ids),
+                                   text='Комментарий под нагрузкой')
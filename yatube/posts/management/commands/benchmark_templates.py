@@ -0,0 +1,158 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.template import Template
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_databases, teardown_databases)
+from django.urls import reverse
+
+from core.benchmark import summarize, write_report
+from posts import seeding
+from posts.models import Post
+from posts.utils import create_paginator
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+@contextmanager
+def template_timings(timings):
+    """Собственное время каждого шаблона без вложенных в него.
+
+    timings[имя] = [число отрисовок, секунды]. Шаблоны, встроенные
+    через inline_include, входят во время родителя, блоки дочернего
+    шаблона - во время base.html.
+    """
+    original = Template._render
+    stack = []
+
+    def timed_render(template, context):
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return original(template, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            entry = timings[template.origin.template_name or '<string>']
+            entry[0] += 1
+            entry[1] += elapsed - children
+
+    with mock.patch.object(Template, '_render', timed_render):
+        yield
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время отрисовки шаблона ленты posts/index.html '
+            'без обращений к БД: с кешированными загрузчиками шаблонов '
+            'и без них, с разбивкой по шаблонам')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=500,
+                            help='Отрисовок на каждый вариант')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Зерно генератора данных')
+        parser.add_argument('--output', default='bench_templates.json',
+                            help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     aliases={'default'})
+        try:
+            # Кеш карточек в памяти: замеряется шаблон, а не хранилище.
+            with override_settings(DEBUG=False, CACHES=LOCAL_CACHES):
+                seeding.seed(**seeding.scale_for(100),
+                             seed_value=options['seed'])
+                context, request = self.page_context()
+                results = [
+                    self.measure(variant, templates, context, request,
+                                 options)
+                    for variant, templates in self.variants().items()
+                ]
+        finally:
+            teardown_databases(old_config, verbosity=0)
+        for result in results:
+            self.stdout.write(
+                f'{result["variant"]:<9} p50 {result["p50_ms"]:>8} ms  '
+                f'p95 {result["p95_ms"]:>8} ms'
+            )
+            for name, cost in result['templates'].items():
+                self.stdout.write(
+                    f'    {name:<32} {cost["self_ms"]:>8} ms  '
+                    f'x{cost["renders"]}'
+                )
+        write_report(options['output'], 'templates', results,
+                     repeat=options['repeat'],
+                     posts_per_page=settings.COUNT_OF_VISIBLE_POSTS)
+        self.stdout.write(
+            self.style.SUCCESS(f'Результаты сохранены в {options["output"]}')
+        )
+
+    def page_context(self):
+        """Контекст первой страницы ленты, все данные уже загружены."""
+        reader, _ = seeding.pick_targets()
+        request = RequestFactory().get(reverse('posts:index'))
+        request.user = reader
+        page_obj = create_paginator(
+            request, Post.objects.select_related('author', 'group'),
+            cursor=True
+        )
+        page_obj.object_list = list(page_obj.object_list)
+        return {'page_obj': page_obj}, request
+
+    def variants(self):
+        """Настройки TEMPLATES: как в settings и без кеша загрузчика."""
+        cached = settings.TEMPLATES
+        uncached = [{
+            **engine,
+            'OPTIONS': {
+                **engine['OPTIONS'],
+                'loaders': [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ],
+            },
+        } for engine in cached]
+        return {'cached': cached, 'uncached': uncached}
+
+    def measure(self, variant, templates, context, request, options):
+        samples = []
+        timings = defaultdict(lambda: [0, 0.0])
+        with override_settings(TEMPLATES=templates):
+            render_to_string('posts/index.html', context, request)
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    render_to_string('posts/index.html', context, request)
+                    samples.append(time.perf_counter() - started)
+                with template_timings(timings):
+                    for _ in range(options['repeat']):
+                        render_to_string('posts/index.html', context,
+                                         request)
+        if queries.captured_queries:
+            raise CommandError(
+                f'Шаблон обратился к БД {len(queries.captured_queries)} раз'
+            )
+        repeat = options['repeat']
+        return {
+            'variant': variant,
+            **summarize(samples),
+            'templates': {
+                name: {
+                    'renders': renders // repeat,
+                    'self_ms': round(seconds / repeat * 1000, 3),
+                }
+                for name, (renders, seconds) in sorted(
+                    timings.items(), key=lambda item: -item[1][1])
+            },
+        }
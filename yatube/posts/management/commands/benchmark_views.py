@@ -0,0 +1,84 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_databases, teardown_databases)
+
+from core.benchmark import stopwatch, summarize, write_report
+from core.testing import scratch_environment
+from posts import seeding
+
+
+class Command(BaseCommand):
+    help = ('Замеряет p50/p95 задержки и число SQL-запросов страниц '
+            'постов на временной базе разного объёма')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000',
+                            help='Количества постов через запятую')
+        parser.add_argument('--repeat', type=int, default=30,
+                            help='Запросов на каждую страницу')
+        parser.add_argument('--warm', action='store_true',
+                            help='Не сбрасывать кеш между запросами')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Зерно генератора данных')
+        parser.add_argument('--output', default='bench_views.json',
+                            help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     aliases={'default'})
+        try:
+            # Как в production: без debug_toolbar и отладочных страниц.
+            # Кеш и метрики - временные: замер сбрасывает кеш и не должен
+            # задевать работающий сервер.
+            with scratch_environment(), override_settings(DEBUG=False):
+                results = self.run(sizes, options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+        write_report(options['output'], 'views', results,
+                     repeat=options['repeat'], warm=options['warm'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Результаты сохранены в {options["output"]}')
+        )
+
+    def run(self, sizes, options):
+        results = []
+        seeded = {name: 0 for name in seeding.scale_for(0)}
+        for size in sizes:
+            volumes = seeding.scale_for(size)
+            seeding.seed(
+                **{name: volumes[name] - seeded[name] for name in volumes},
+                seed_value=options['seed'] + size
+            )
+            seeded = volumes
+            reader, urls = seeding.pick_targets()
+            client = Client()
+            client.force_login(reader)
+            for view_name, url in urls.items():
+                result = self.measure(client, url, options)
+                result.update(size=size, view=view_name)
+                results.append(result)
+                self.stdout.write(
+                    f'{size:>8} {view_name:<14} p50 {result["p50_ms"]:>8} '
+                    f'ms  p95 {result["p95_ms"]:>8} ms  '
+                    f'запросов {result["queries"]}'
+                )
+        return results
+
+    def measure(self, client, url, options):
+        client.get(url)
+        samples = []
+        queries = []
+        for _ in range(options['repeat']):
+            if not options['warm']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                with stopwatch(samples):
+                    response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url} вернул {response.status_code}')
+            queries.append(len(captured.captured_queries))
+        return {**summarize(samples), 'queries': max(queries)}
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts import comment_queue
+
+
+class Command(BaseCommand):
+    help = ('Записывает в БД комментарии из очереди отложенной записи '
+            '(COMMENT_WRITE_BEHIND)')
+
+    def handle(self, *args, **options):
+        total = comment_queue.flush_all()
+        self.stdout.write(
+            self.style.SUCCESS(f'Записано комментариев: {total}')
+        )
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие миниатюры картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.THUMBNAIL_WORKERS,
+            help='Количество параллельных потоков'
+        )
+
+    def handle(self, *args, **options):
+        post_ids = list(
+            Post.objects.exclude(image='').filter(thumbnail='')
+            .values_list('id', flat=True)
+        )
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            names = pool.map(thumbnails.run_in_worker, post_ids)
+            created = sum(1 for name in names if name)
+        self.stdout.write(
+            self.style.SUCCESS(f'Создано миниатюр: {created}')
+        )
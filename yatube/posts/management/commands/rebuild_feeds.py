@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts import feed
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames',
+            nargs='*',
+            help='Пользователи, чьи ленты нужно пересобрать (по умолчанию все)'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        total = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            total += feed.rebuild(user_id)
+        self.stdout.write(
+            self.style.SUCCESS(f'Лент пересобрано, записей: {total}')
+        )
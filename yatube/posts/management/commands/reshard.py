@@ -0,0 +1,111 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from posts import sharding
+from posts.models import (ArchivedComment, ArchivedPost, Comment, CommentId,
+                          FeedEntry, Post, PostLocation)
+
+# Таблицы постов и их комментариев: горячие и архивные.
+TABLES = ((Post, Comment), (ArchivedPost, ArchivedComment))
+
+
+class Command(BaseCommand):
+    help = ('Переносит посты и их комментарии туда, где они должны лежать '
+            'по settings.POST_SHARDS: на шарды после включения '
+            'шардирования или изменения числа шардов, в default - после '
+            'выключения')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Постов в одной транзакции')
+
+    def handle(self, *args, **options):
+        sources = [alias for alias in connections
+                   if alias == DEFAULT_DB_ALIAS or sharding.is_shard(alias)]
+        total = 0
+        for source in sources:
+            for post_model, comment_model in TABLES:
+                misplaced = self.misplaced(post_model, source)
+                for target, author_ids in misplaced.items():
+                    moved = self.drain(post_model, comment_model, source,
+                                       target, author_ids,
+                                       options['batch_size'])
+                    self.stdout.write(
+                        f'{post_model._meta.verbose_name_plural}: '
+                        f'{source} -> {target}: {moved}'
+                    )
+                    total += moved
+        if total and not sharding.enabled():
+            self.stdout.write('Ленты подписок пересобирает rebuild_feeds')
+        self.stdout.write(self.style.SUCCESS(f'Перенесено постов: {total}'))
+
+    def misplaced(self, post_model, source: str) -> dict:
+        """Авторы, чьи посты лежат не на своём шарде, по шардам."""
+        authors = defaultdict(list)
+        author_ids = post_model.objects.using(source).values_list(
+            'author_id', flat=True).distinct()
+        for author_id in author_ids:
+            target = sharding.shard_for(author_id)
+            if target != source:
+                authors[target].append(author_id)
+        return authors
+
+    def drain(self, post_model, comment_model, source: str, target: str,
+              author_ids: list, batch_size: int) -> int:
+        moved = 0
+        while True:
+            post_ids = list(
+                post_model.objects.using(source)
+                .filter(author_id__in=author_ids)
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not post_ids:
+                return moved
+            self.move(post_model, comment_model, source, target, post_ids)
+            moved += len(post_ids)
+
+    def move(self, post_model, comment_model, source: str, target: str,
+             post_ids: list) -> None:
+        """Копирует посты на target и удаляет их из source.
+
+        Сначала фиксируется копия, потом удаление: после сбоя между
+        ними повторный запуск заменит недоделанную копию. Посты
+        и комментарии сохраняют id, поисковый индекс не меняется.
+        """
+        posts = list(
+            post_model.objects.using(source).filter(pk__in=post_ids))
+        comments = list(
+            comment_model.objects.using(source).filter(post_id__in=post_ids)
+        )
+        with transaction.atomic(using=source):
+            with transaction.atomic(using=target):
+                comment_model.objects.using(target).filter(
+                    post_id__in=post_ids)._raw_delete(target)
+                post_model.objects.using(target).filter(
+                    pk__in=post_ids)._raw_delete(target)
+                if sharding.enabled():
+                    PostLocation.objects.bulk_create(
+                        [PostLocation(pk=post.pk, author_id=post.author_id)
+                         for post in posts],
+                        ignore_conflicts=True
+                    )
+                    # Каталоги выдают новые id после перенесённых.
+                    CommentId.objects.bulk_create(
+                        [CommentId(pk=comment.pk) for comment in comments],
+                        ignore_conflicts=True
+                    )
+                # raw=True: без сигналов и без замены created/modified.
+                for post in posts:
+                    post.save_base(using=target, raw=True, force_insert=True)
+                for comment in comments:
+                    comment.save_base(using=target, raw=True,
+                                      force_insert=True)
+            if source == DEFAULT_DB_ALIAS:
+                FeedEntry.objects.filter(
+                    post_id__in=post_ids)._raw_delete(source)
+            comment_model.objects.using(source).filter(
+                post_id__in=post_ids)._raw_delete(source)
+            post_model.objects.using(source).filter(
+                pk__in=post_ids)._raw_delete(source)
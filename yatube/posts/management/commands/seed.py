@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from posts import seeding
+
+
+class Command(BaseCommand):
+    help = 'Наполняет базу пользователями, группами, постами и подписками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000,
+                            help='Количество постов')
+        for name in ('users', 'groups', 'comments', 'follows'):
+            parser.add_argument(
+                f'--{name}', type=int, default=None,
+                help='По умолчанию соразмерно количеству постов'
+            )
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Зерно генератора для повторяемости')
+
+    def handle(self, *args, **options):
+        volumes = seeding.scale_for(options['posts'])
+        for name in volumes:
+            if options.get(name) is not None:
+                volumes[name] = options[name]
+        created = seeding.seed(**volumes, seed_value=options['seed'])
+        self.stdout.write(self.style.SUCCESS(
+            'Создано: ' + ', '.join(
+                f'{name} {count}' for name, count in created.items()
+            )
+        ))
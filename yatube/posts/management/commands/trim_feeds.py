@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import feed
+
+
+class Command(BaseCommand):
+    help = ('Обрезает ленты подписок до settings.FEED_MAX_LENGTH '
+            'последних записей (запускается по расписанию)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.FEED_TRIM_BATCH_SIZE,
+                            help='Лент в одном запросе удаления')
+
+    def handle(self, *args, **options):
+        trimmed = feed.trim_all(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Лент обрезано: {trimmed}'))
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.25 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0023_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentId',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'Номер комментария',
+                'verbose_name_plural': 'Номера комментариев',
+            },
+        ),
+    ]
@@ -1,10 +1,13 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.db import models
 
 from core.models import CreatedModel
 
+from . import images
+
 User = get_user_model()
 
 
@@ -29,14 +32,137 @@ class Group(models.Model):
         return self.title
 
 
-class Post(CreatedModel):
+# Колонки, которые выводит карточка поста в лентах (includes/post.html).
+POST_CARD_FIELDS = ('text', 'created', 'modified', 'image', 'thumbnail',
+                    'renditions', 'comments_count', 'author', 'group')
+CARD_AUTHOR_FIELDS = ('author__username', 'author__first_name',
+                      'author__last_name')
+CARD_GROUP_FIELDS = ('group__title', 'group__slug')
+# Колонки автора для шапки профиля (posts/profile.html).
+PROFILE_FIELDS = ('username', 'first_name', 'last_name',
+                  'stats__posts_count', 'stats__followers_count',
+                  'stats__following_count')
+
+
+def card_fields(prefix: str = '', author: bool = False,
+                group: bool = False) -> list:
+    """Аргументы only() для карточки поста, при необходимости
+    с колонками автора и группы из select_related.
+    """
+    fields = list(POST_CARD_FIELDS)
+    if author:
+        fields += CARD_AUTHOR_FIELDS
+    if group:
+        fields += CARD_GROUP_FIELDS
+    return [prefix + field for field in fields]
+
+
+class ShardedQuerySet(models.QuerySet):
+    """Выборки моделей, которые могут лежать на шардах (posts.sharding)."""
+
+    def create(self, **kwargs):
+        """Без using() шард выбирается роутером по самому объекту:
+        QuerySet.create передаёт базу без подсказки instance.
+        """
+        if self._db is not None or not settings.POST_SHARDS:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+    def with_related(self, *fields):
+        """select_related, а при шардировании - prefetch_related:
+        пользователи и группы лежат в default, join между базами
+        невозможен. Дальше первой связи всё лежит в default, поэтому
+        'author__stats' догружается одним запросом с join.
+        """
+        if not settings.POST_SHARDS:
+            return self.select_related(*fields)
+        nested = {}
+        for field in fields:
+            name, _, rest = field.partition('__')
+            nested.setdefault(name, [])
+            if rest:
+                nested[name].append(rest)
+        lookups = []
+        for name, rest in nested.items():
+            queryset = self.model._meta.get_field(
+                name).related_model._default_manager.all()
+            if rest:
+                queryset = queryset.select_related(*rest)
+            lookups.append(models.Prefetch(name, queryset))
+        return self.prefetch_related(*lookups)
+
+
+class PostQuerySet(ShardedQuerySet):
+    """Выборки постов для лент: страница - один запрос без лишних
+    колонок (в том числе без пароля автора).
+    """
+
+    def for_feed(self):
+        """Общие ленты: автор и группа в том же запросе."""
+        return self._cards(author=True, group=True)
+
+    def for_profile(self):
+        """Для author.posts: автора подставляет связанный менеджер."""
+        return self._cards(group=True)
+
+    def for_group(self):
+        """Для group.posts: группу подставляет связанный менеджер."""
+        return self._cards(author=True)
+
+    def _cards(self, author: bool = False, group: bool = False):
+        if not settings.POST_SHARDS:
+            related = [name for name, wanted in (('author', author),
+                                                 ('group', group))
+                       if wanted]
+            return self.select_related(*related).only(
+                *card_fields(author=author, group=group))
+        # На шардах автор и группа догружаются отдельными запросами.
+        lookups = []
+        if author:
+            lookups.append(models.Prefetch(
+                'author', User.objects.only(
+                    *(field.split('__')[1] for field in CARD_AUTHOR_FIELDS))
+            ))
+        if group:
+            lookups.append(models.Prefetch(
+                'group', Group.objects.only(
+                    *(field.split('__')[1] for field in CARD_GROUP_FIELDS))
+            ))
+        return self.only(*card_fields()).prefetch_related(*lookups)
+
+
+class PostImageMixin:
+    """Адреса копий картинки поста для шаблонов."""
+
+    @property
+    def thumbnail_url(self):
+        """Адрес готовой миниатюры или пустая строка."""
+        if not self.thumbnail:
+            return ''
+        return default_storage.url(self.thumbnail)
+
+    @property
+    def webp_srcset(self):
+        return images.srcset(self.renditions.get('webp', {}))
+
+    @property
+    def jpeg_srcset(self):
+        return images.srcset(self.renditions.get('jpeg', {}))
+
+
+class Post(PostImageMixin, CreatedModel):
     text = models.TextField(
         verbose_name='Текст поста',
         help_text='Введите текст поста'
     )
+    # Без ограничений в БД: при шардировании пост лежит на шарде,
+    # а автор и группа - в default.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_constraint=False,
         related_name='posts',
         verbose_name='Автор поста'
     )
@@ -45,6 +171,7 @@ class Post(CreatedModel):
         blank=True,
         null=True,
         on_delete=models.SET_NULL,
+        db_constraint=False,
         related_name='posts',
         verbose_name='Название группы',
         help_text='Группа, к которой будет относиться пост'
@@ -54,11 +181,42 @@ class Post(CreatedModel):
         upload_to='posts/',
         blank=True
     )
+    thumbnail = models.CharField(
+        'Миниатюра',
+        max_length=255,
+        blank=True,
+        editable=False
+    )
+    renditions = models.JSONField(
+        'Копии картинки',
+        default=dict,
+        blank=True,
+        editable=False
+    )
+    modified = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True
+    )
+    comments_count = models.IntegerField(
+        'Количество комментариев',
+        default=0,
+        editable=False
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created',)
         verbose_name_plural = 'Посты'
         verbose_name = 'Пост'
+        indexes = [
+            models.Index(fields=['-created', '-id'],
+                         name='post_created_idx'),
+            models.Index(fields=['author', '-created', '-id'],
+                         name='post_author_created_idx'),
+            models.Index(fields=['group', '-created', '-id'],
+                         name='post_group_created_idx'),
+        ]
 
     def __str__(self):
         return self.text[:settings.COUNT_LETTERS_MODEL_POST]
@@ -77,9 +235,11 @@ class Comment(CreatedModel):
         related_name='comments',
         verbose_name='Комментарий'
     )
+    # Комментарий лежит на шарде поста, автор - в default.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_constraint=False,
         related_name='comments',
         verbose_name='Комментарий'
     )
@@ -88,10 +248,16 @@ class Comment(CreatedModel):
         help_text='Введите комментарий'
     )
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created',)
         verbose_name_plural = 'Комментарии'
         verbose_name = 'Комментарий'
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'],
+                         name='comment_post_created_idx'),
+        ]
 
     def __str__(self):
         return self.text
@@ -126,3 +292,193 @@ class Follow(models.Model):
                 name='user_cannot_follow_himself'
             ),
         ]
+        indexes = [
+            models.Index(fields=['user', 'author'],
+                         name='follow_user_author_idx'),
+        ]
+
+
+class ArchivedPost(PostImageMixin, models.Model):
+    """Пост старше settings.ARCHIVE_AFTER_DAYS (posts.archive).
+
+    Те же колонки и id, что у Post, но таблица не участвует в общих
+    лентах и несёт только индекс для профиля автора. Архив только
+    для чтения: created и modified переносятся как есть.
+    """
+    is_archived = True
+
+    text = models.TextField('Текст поста')
+    created = models.DateTimeField('Дата создания')
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='archived_posts',
+        verbose_name='Автор поста'
+    )
+    group = models.ForeignKey(
+        Group,
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        db_constraint=False,
+        related_name='archived_posts',
+        verbose_name='Название группы'
+    )
+    image = models.ImageField('Картинка', upload_to='posts/', blank=True)
+    thumbnail = models.CharField('Миниатюра', max_length=255, blank=True)
+    renditions = models.JSONField('Копии картинки', default=dict,
+                                  blank=True)
+    modified = models.DateTimeField('Дата изменения')
+    comments_count = models.IntegerField('Количество комментариев',
+                                         default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-created',)
+        verbose_name_plural = 'Архивные посты'
+        verbose_name = 'Архивный пост'
+        indexes = [
+            models.Index(fields=['author', '-created', '-id'],
+                         name='archived_author_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.text[:settings.COUNT_LETTERS_MODEL_POST]
+
+
+class ArchivedComment(models.Model):
+    """Комментарий архивного поста, id сохраняется."""
+    post = models.ForeignKey(
+        ArchivedPost,
+        on_delete=models.CASCADE,
+        related_name='comments',
+        verbose_name='Комментарий'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='archived_comments',
+        verbose_name='Комментарий'
+    )
+    text = models.TextField('Текст комментария')
+    created = models.DateTimeField('Дата создания')
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-created',)
+        verbose_name_plural = 'Архивные комментарии'
+        verbose_name = 'Архивный комментарий'
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'],
+                         name='archived_comment_post_idx'),
+        ]
+
+    def __str__(self):
+        return self.text
+
+
+class PostLocation(models.Model):
+    """Каталог постов при шардировании (posts.sharding).
+
+    Выдаёт новому посту id, уникальный на всех шардах, и по id поста
+    находит автора, а по автору - шард.
+    """
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+
+    class Meta:
+        verbose_name_plural = 'Размещение постов'
+        verbose_name = 'Размещение поста'
+
+
+class CommentId(models.Model):
+    """Выдаёт комментариям при шардировании id, уникальные на всех
+    шардах: по id комментария ключуется поисковый индекс в default.
+    """
+
+    class Meta:
+        verbose_name_plural = 'Номера комментариев'
+        verbose_name = 'Номер комментария'
+
+
+class FeedEntryQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Записи ленты с карточками постов одним запросом."""
+        return self.select_related('post__author', 'post__group').only(
+            'created', 'post',
+            *card_fields('post__', author=True, group=True))
+
+
+class FeedEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя.
+
+    Заполняется при публикации поста (fan-out on write), поэтому
+    лента читается одним диапазонным поиском по индексу.
+    """
+    # Без ограничения в БД: пустая таблица лент есть и на шардах,
+    # где нет пользователей, а удаление поста её очищает.
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='feed_entries'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    # Копия post.created: сортировка ленты без join с постами.
+    created = models.DateTimeField('Дата создания поста')
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-created', '-id')
+        verbose_name_plural = 'Записи лент'
+        verbose_name = 'Запись ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_feed_entry'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created', '-id'],
+                name='feed_user_created_idx'
+            ),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя.
+
+    Обновляются сигналами через F()-выражения, чтобы страницы
+    не выполняли COUNT при чтении. Расхождения исправляет
+    команда recount.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    posts_count = models.IntegerField('Количество постов', default=0)
+    followers_count = models.IntegerField('Количество подписчиков',
+                                          default=0)
+    following_count = models.IntegerField('Количество подписок', default=0)
+
+    class Meta:
+        verbose_name_plural = 'Счётчики пользователей'
+        verbose_name = 'Счётчики пользователя'
+
+    def __str__(self):
+        return f'Счётчики {self.user_id}'
@@ -0,0 +1,181 @@
+"""Полнотекстовый поиск по постам и комментариям на SQLite FTS5.
+
+Индекс хранится в виртуальных таблицах posts_post_fts (rowid = id поста)
+и posts_comment_fts (rowid = id комментария, post_id - пост). Таблицы
+создаёт миграция, синхронизируют сигналы, восстанавливает команда
+rebuild_search_index. Токенизатор unicode61 приводит кириллицу
+к нижнему регистру и убирает латинскую диакритику, букву ё заменяем на е
+сами. Каждое слово запроса ищется как префикс, чтобы находились разные
+формы слова.
+"""
+import re
+from itertools import islice
+from typing import Optional
+
+from django.db import connection, connections, router, transaction
+
+from . import sharding
+from .models import ArchivedComment, ArchivedPost, Comment, Post
+from .utils import CursorPage, decode_cursor, encode_cursor
+
+POST_TABLE = 'posts_post_fts'
+COMMENT_TABLE = 'posts_comment_fts'
+# Совпадение в комментарии весит меньше совпадения в тексте поста.
+COMMENT_WEIGHT = 0.5
+WORD_RE = re.compile(r'\w+')
+NORMALIZED_TEXT = "REPLACE(REPLACE(text, 'ё', 'е'), 'Ё', 'Е')"
+# Строк с шарда в одном INSERT при перестройке индекса.
+REBUILD_BATCH_SIZE = 1000
+
+SEARCH_SQL = f'''
+    SELECT post_id, MIN(score) AS score FROM (
+        SELECT rowid AS post_id, bm25({POST_TABLE}) AS score
+        FROM {POST_TABLE} WHERE {POST_TABLE} MATCH %s
+        UNION ALL
+        SELECT post_id, bm25({COMMENT_TABLE}) * {COMMENT_WEIGHT} AS score
+        FROM {COMMENT_TABLE} WHERE {COMMENT_TABLE} MATCH %s
+    )
+    GROUP BY post_id
+    {{having}}
+    ORDER BY score, post_id
+    LIMIT %s
+'''
+
+
+def normalize(text: str) -> str:
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def build_match(query: str) -> str:
+    """Запрос пользователя в синтаксисе FTS5: все слова как префиксы."""
+    words = WORD_RE.findall(normalize(query.lower()))
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_posts(query: str, per_page: int,
+                 after: Optional[str] = None) -> CursorPage:
+    """Страница найденных постов по релевантности (bm25).
+
+    Продолжение выдачи строится по курсору (score, post_id),
+    без OFFSET. Выдача листается только вперёд.
+    """
+    match = build_match(query)
+    if not match:
+        return CursorPage([])
+    params = [match, match]
+    having = ''
+    key = decode_cursor(after, 2) if after else None
+    if key is not None:
+        having = ('HAVING MIN(score) > %s '
+                  'OR (MIN(score) = %s AND post_id > %s)')
+        params += [key[0], key[0], key[1]]
+    params.append(per_page + 1)
+    # Сырой SQL не проходит через роутер: база выбирается явно.
+    with connections[router.db_for_read(Post)].cursor() as cursor:
+        cursor.execute(SEARCH_SQL.format(having=having), params)
+        rows = cursor.fetchall()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    post_ids = [post_id for post_id, _ in rows]
+    posts = sharding.in_bulk(Post.objects.for_feed(), post_ids)
+    archived_ids = [post_id for post_id in post_ids if post_id not in posts]
+    if archived_ids:
+        posts.update(sharding.in_bulk(ArchivedPost.objects.for_feed(),
+                                      archived_ids))
+    return CursorPage(
+        [posts[post_id] for post_id, _ in rows if post_id in posts],
+        next_cursor=encode_cursor(rows[-1][::-1]) if has_next else None,
+    )
+
+
+def match_subquery(table: str, query: str) -> tuple:
+    """SQL и параметры для id__in=RawSQL(...) по индексу table."""
+    return (f'SELECT rowid FROM {table} WHERE {table} MATCH %s',
+            [build_match(query)])
+
+
+def index_post(post: Post) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {POST_TABLE} WHERE rowid = %s',
+                       [post.pk])
+        cursor.execute(
+            f'INSERT INTO {POST_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, normalize(post.text)]
+        )
+
+
+def unindex_post(post_id: int) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {POST_TABLE} WHERE rowid = %s',
+                       [post_id])
+
+
+def index_comment(comment: Comment) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {COMMENT_TABLE} WHERE rowid = %s',
+                       [comment.pk])
+        cursor.execute(
+            f'INSERT INTO {COMMENT_TABLE} (rowid, text, post_id) '
+            f'VALUES (%s, %s, %s)',
+            [comment.pk, normalize(comment.text), comment.post_id]
+        )
+
+
+def unindex_comment(comment_id: int) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {COMMENT_TABLE} WHERE rowid = %s',
+                       [comment_id])
+
+
+def rebuild() -> None:
+    """Заново заполняет индекс из таблиц постов и комментариев,
+    горячих и архивных, на всех шардах.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {POST_TABLE}')
+        cursor.execute(f'DELETE FROM {COMMENT_TABLE}')
+        if sharding.enabled():
+            _copy_from_shards(cursor)
+        else:
+            for model in (Post, ArchivedPost):
+                cursor.execute(
+                    f'INSERT INTO {POST_TABLE} (rowid, text) '
+                    f'SELECT id, {NORMALIZED_TEXT} '
+                    f'FROM {model._meta.db_table}'
+                )
+            for model in (Comment, ArchivedComment):
+                cursor.execute(
+                    f'INSERT INTO {COMMENT_TABLE} (rowid, text, post_id) '
+                    f'SELECT id, {NORMALIZED_TEXT}, post_id '
+                    f'FROM {model._meta.db_table}'
+                )
+        for table in (POST_TABLE, COMMENT_TABLE):
+            cursor.execute(
+                f"INSERT INTO {table} ({table}) VALUES ('optimize')"
+            )
+
+
+def _copy_from_shards(cursor) -> None:
+    """Переносит тексты с шардов в индекс default пачками."""
+    for alias in sharding.post_databases():
+        for model in (Post, ArchivedPost):
+            rows = model.objects.using(alias).values_list('id', 'text')
+            _insert(cursor,
+                    f'INSERT INTO {POST_TABLE} (rowid, text) VALUES (%s, %s)',
+                    ((pk, normalize(text)) for pk, text in rows.iterator()))
+        for model in (Comment, ArchivedComment):
+            rows = model.objects.using(alias).values_list('id', 'text',
+                                                          'post_id')
+            _insert(cursor,
+                    f'INSERT INTO {COMMENT_TABLE} (rowid, text, post_id) '
+                    f'VALUES (%s, %s, %s)',
+                    ((pk, normalize(text), post_id)
+                     for pk, text, post_id in rows.iterator()))
+
+
+def _insert(cursor, sql: str, rows) -> None:
+    while True:
+        batch = list(islice(rows, REBUILD_BATCH_SIZE))
+        if not batch:
+            return
+        cursor.executemany(sql, batch)
@@ -0,0 +1,180 @@
+"""Наполнение базы тестовыми данными для нагрузочных замеров."""
+import random
+from collections import defaultdict
+from contextlib import ExitStack
+from typing import Dict, List, Optional
+
+from django.contrib.auth.hashers import make_password
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count
+from django.urls import reverse
+from faker import Faker
+
+from . import counters, feed, search, sharding
+from .models import Comment, CommentId, Follow, Group, Post, PostLocation, User
+
+BATCH_SIZE = 500
+
+
+def scale_for(posts: int) -> Dict[str, int]:
+    """Объёмы остальных сущностей, соразмерные количеству постов."""
+    users = max(10, posts // 20)
+    return {
+        'users': users,
+        'groups': max(3, posts // 500),
+        'posts': posts,
+        'comments': posts * 2,
+        'follows': users * 10,
+    }
+
+
+def _create_posts(posts: List[Post]) -> None:
+    """bulk_create постов. При шардировании id выдаёт каталог,
+    а посты пишутся на шарды авторов.
+    """
+    if not sharding.enabled():
+        Post.objects.bulk_create(posts, batch_size=BATCH_SIZE)
+        return
+    locations = PostLocation.objects.bulk_create(
+        [PostLocation(author_id=post.author_id) for post in posts],
+        batch_size=BATCH_SIZE
+    )
+    by_shard = defaultdict(list)
+    for post, location in zip(posts, locations):
+        post.pk = location.pk
+        by_shard[sharding.shard_for(post.author_id)].append(post)
+    for alias, shard_posts in by_shard.items():
+        Post.objects.using(alias).bulk_create(shard_posts,
+                                              batch_size=BATCH_SIZE)
+
+
+def _create_comments(comments: List[Comment],
+                     post_authors: Dict[int, int]) -> None:
+    """bulk_create комментариев. При шардировании id выдаёт CommentId,
+    а комментарии пишутся на шарды своих постов.
+    """
+    if not sharding.enabled():
+        Comment.objects.bulk_create(comments, batch_size=BATCH_SIZE)
+        return
+    ids = CommentId.objects.bulk_create(
+        [CommentId() for _ in comments], batch_size=BATCH_SIZE)
+    by_shard = defaultdict(list)
+    for comment, comment_id in zip(comments, ids):
+        comment.pk = comment_id.pk
+        by_shard[sharding.shard_for(
+            post_authors[comment.post_id])].append(comment)
+    for alias, shard_comments in by_shard.items():
+        Comment.objects.using(alias).bulk_create(shard_comments,
+                                                 batch_size=BATCH_SIZE)
+
+
+def seed(users: int = 0, groups: int = 0, posts: int = 0,
+         comments: int = 0, follows: int = 0,
+         seed_value: Optional[int] = None) -> Dict[str, int]:
+    """Добавляет в базу указанное количество записей каждого вида.
+
+    Записи создаются через bulk_create, поэтому сигналы не срабатывают:
+    счётчики и ленты подписок пересчитываются в конце. При шардировании
+    id постов и комментариев выдают каталоги, как и при save().
+    """
+    with ExitStack() as stack:
+        for alias in sorted({DEFAULT_DB_ALIAS, *sharding.post_databases()}):
+            stack.enter_context(transaction.atomic(using=alias))
+        return _seed(users, groups, posts, comments, follows, seed_value)
+
+
+def _seed(users: int, groups: int, posts: int, comments: int,
+          follows: int, seed_value: Optional[int]) -> Dict[str, int]:
+    rng = random.Random(seed_value)
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed_value)
+    password = make_password(None)
+
+    first_user = User.objects.count()
+    User.objects.bulk_create(
+        [User(username=f'{fake.user_name()}_{first_user + number}',
+              first_name=fake.first_name(),
+              last_name=fake.last_name(),
+              password=password)
+         for number in range(users)],
+        batch_size=BATCH_SIZE
+    )
+    first_group = Group.objects.count()
+    Group.objects.bulk_create(
+        [Group(title=fake.sentence(nb_words=3)[:200],
+               slug=f'group-{first_group + number}',
+               description=fake.paragraph())
+         for number in range(groups)],
+        batch_size=BATCH_SIZE
+    )
+
+    user_ids = list(User.objects.values_list('id', flat=True))
+    group_ids = list(Group.objects.values_list('id', flat=True)) + [None]
+    _create_posts(
+        [Post(author_id=rng.choice(user_ids),
+              group_id=rng.choice(group_ids),
+              text=fake.paragraph(nb_sentences=rng.randint(1, 8)))
+         for _ in range(posts)]
+    )
+    post_authors = {
+        post_id: author_id
+        for alias in sharding.post_databases()
+        for post_id, author_id in Post.objects.using(alias).values_list(
+            'id', 'author_id')
+    }
+    post_ids = sorted(post_authors)
+    if post_ids:
+        # Немного «вирусных» постов собирают большую часть комментариев.
+        hot_posts = rng.sample(post_ids, k=max(1, len(post_ids) // 100))
+        _create_comments(
+            [Comment(post_id=(rng.choice(hot_posts) if rng.random() < 0.5
+                              else rng.choice(post_ids)),
+                     author_id=rng.choice(user_ids),
+                     text=fake.sentence())
+             for _ in range(comments)],
+            post_authors
+        )
+    pairs = set()
+    follows = min(follows, len(user_ids) * (len(user_ids) - 1))
+    while len(pairs) < follows:
+        user_id, author_id = rng.sample(user_ids, k=2)
+        pairs.add((user_id, author_id))
+    Follow.objects.bulk_create(
+        [Follow(user_id=user_id, author_id=author_id)
+         for user_id, author_id in pairs],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+    counters.recount()
+    # При шардировании лент нет: follow_index собирает их с шардов.
+    if not sharding.enabled():
+        for user_id in {user_id for user_id, _ in pairs}:
+            feed.rebuild(user_id)
+    search.rebuild()
+    return {
+        'users': users,
+        'groups': groups,
+        'posts': posts,
+        'comments': comments,
+        'follows': len(pairs),
+    }
+
+
+def pick_targets():
+    """Самые тяжёлые объекты текущего набора данных для каждой страницы."""
+    group = Group.objects.annotate(
+        total=Count('posts')).order_by('-total').first()
+    author = User.objects.order_by('-stats__posts_count').first()
+    post = Post.objects.order_by('-comments_count').first()
+    reader = User.objects.order_by('-stats__following_count').first()
+    return reader, {
+        'index': reverse('posts:index'),
+        'group_posts': reverse('posts:group_pages',
+                               kwargs={'slug': group.slug}),
+        'profile': reverse('posts:profile',
+                           kwargs={'username': author.username}),
+        'post_detail': reverse('posts:post_detail',
+                               kwargs={'post_id': post.pk}),
+        'follow_index': reverse('posts:follow_index'),
+    }
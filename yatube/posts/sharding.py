@@ -0,0 +1,199 @@
+"""Шардирование постов и комментариев по автору.
+
+Посты автора лежат на шарде settings.POST_SHARDS[author_id % N],
+комментарии - на шарде своего поста, поэтому профиль и страница поста
+читают один шард. Общие ленты собираются слиянием окон со всех шардов
+(utils.ScatterGatherPaginator). Пользователи, группы, подписки,
+счётчики и поисковый индекс остаются в default, связи с ними
+догружаются prefetch_related.
+
+Автоинкремент уникален только внутри шарда, поэтому id нового поста
+выдаёт каталог PostLocation в default. По нему же страница поста
+находит автора, а по автору - шард. id комментариев выдаёт CommentId.
+
+Пустой POST_SHARDS - шардирование выключено, всё лежит в default.
+Асинхронные страницы, JSON API, recount и rebuild_search_index читают
+шарды, админка - только default. После изменения POST_SHARDS данные
+переносит команда reshard.
+"""
+from collections import defaultdict
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.models import QuerySet, prefetch_related_objects
+
+from .models import (ArchivedComment, ArchivedPost, Comment, CommentId, Post,
+                     PostLocation, User)
+
+POST_AUTHOR_KEY = 'post-author:{post_id}'
+SHARDED_MODELS = {'posts.post', 'posts.comment', 'posts.archivedpost',
+                  'posts.archivedcomment'}
+POST_MODELS = (Post, ArchivedPost)
+COMMENT_MODELS = (Comment, ArchivedComment)
+# Таблицы на шардах. Ленты подписок на шардах пусты, но к ним
+# обращается каскадное удаление поста.
+SHARD_TABLES = SHARDED_MODELS | {'posts.feedentry'}
+
+
+def enabled() -> bool:
+    return bool(settings.POST_SHARDS)
+
+
+def is_shard(alias: str) -> bool:
+    return bool(connections[alias].settings_dict.get('POST_SHARD'))
+
+
+def shard_for(author_id: int) -> str:
+    """Алиас базы с постами автора."""
+    if not settings.POST_SHARDS:
+        return DEFAULT_DB_ALIAS
+    return settings.POST_SHARDS[author_id % len(settings.POST_SHARDS)]
+
+
+def shards(author_ids: Optional[Iterable[int]] = None
+           ) -> Optional[List[str]]:
+    """Шарды для ScatterGatherPaginator: все или только шарды авторов.
+
+    None - шардирование выключено, ленты читаются обычным запросом.
+    """
+    if not enabled():
+        return None
+    if author_ids is None:
+        return list(settings.POST_SHARDS)
+    return sorted({shard_for(author_id) for author_id in author_ids})
+
+
+def post_databases() -> List[str]:
+    """Базы, где лежат посты: все шарды или только default."""
+    return list(settings.POST_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def post_author_id(post_id: int) -> Optional[int]:
+    """Автор поста по каталогу. Автор поста не меняется, поэтому
+    значение кешируется без срока.
+    """
+    key = POST_AUTHOR_KEY.format(post_id=post_id)
+    author_id = cache.get(key)
+    if author_id is None:
+        author_id = PostLocation.objects.filter(pk=post_id).values_list(
+            'author_id', flat=True).first()
+        if author_id is not None:
+            cache.set(key, author_id, None)
+    return author_id
+
+
+def on_post_shard(queryset: QuerySet, post_id: int) -> QuerySet:
+    """queryset на шарде поста post_id (пустой, если поста нет)."""
+    if not enabled():
+        return queryset
+    author_id = post_author_id(post_id)
+    if author_id is None:
+        return queryset.none()
+    return queryset.using(shard_for(author_id))
+
+
+def on_author_shard(queryset: QuerySet, author_id: int) -> QuerySet:
+    """queryset на шарде постов автора author_id."""
+    if not enabled():
+        return queryset
+    return queryset.using(shard_for(author_id))
+
+
+def delete_author_rows(author_id: int) -> None:
+    """Удаляет с шардов посты и комментарии пользователя.
+
+    Каскад удаления пользователя идёт только по default. Удаление
+    через ORM, поэтому сигналы обновляют счётчики, поиск и кеш лент.
+    """
+    for alias in settings.POST_SHARDS:
+        for model in COMMENT_MODELS:
+            model.objects.using(alias).filter(author_id=author_id).delete()
+    for model in POST_MODELS:
+        model.objects.using(shard_for(author_id)).filter(
+            author_id=author_id).delete()
+
+
+def detach_group(group_id: int) -> None:
+    """on_delete=SET_NULL для постов группы на шардах."""
+    for alias in settings.POST_SHARDS:
+        for model in POST_MODELS:
+            model.objects.using(alias).filter(group_id=group_id).update(
+                group=None)
+
+
+def allocate_post_id(post: Post) -> None:
+    """Выдаёт новому посту id из каталога."""
+    post.pk = PostLocation.objects.create(author_id=post.author_id).pk
+
+
+def allocate_comment_id(comment: Comment) -> None:
+    comment.pk = CommentId.objects.create().pk
+
+
+def in_bulk(queryset: QuerySet, post_ids: List[int]) -> dict:
+    """queryset.in_bulk(post_ids) с постами на разных шардах.
+
+    prefetch_related выполняется один раз для всех найденных постов.
+    """
+    if not enabled():
+        return queryset.in_bulk(post_ids)
+    by_shard = defaultdict(list)
+    for post_id, author_id in PostLocation.objects.filter(
+            pk__in=post_ids).values_list('id', 'author_id'):
+        by_shard[shard_for(author_id)].append(post_id)
+    lookups = queryset._prefetch_related_lookups
+    queryset = queryset.prefetch_related(None)
+    posts = {}
+    for alias, ids in by_shard.items():
+        posts.update(queryset.using(alias).in_bulk(ids))
+    prefetch_related_objects(list(posts.values()), *lookups)
+    return posts
+
+
+class AuthorShardRouter:
+    """Посты и комментарии - на шард автора поста.
+
+    Шард определяется по подсказке instance: сам пост или комментарий,
+    автор для user.posts, пост для post.comments. Без подсказки
+    и для остальных моделей решают следующие роутеры.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not enabled():
+            return None
+        instance = hints.get('instance')
+        if model._meta.label_lower in SHARDED_MODELS:
+            return self._shard(model, instance)
+        if (instance is not None and instance._state.db
+                and is_shard(instance._state.db)):
+            # Автор или группа поста с шарда лежат не на шарде.
+            return router.db_for_read(model)
+        return None
+
+    def db_for_write(self, model, **hints):
+        if enabled() and model._meta.label_lower in SHARDED_MODELS:
+            return self._shard(model, hints.get('instance'))
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if is_shard(db):
+            return f'{app_label}.{model_name}' in SHARD_TABLES
+        return None
+
+    def _shard(self, model, instance) -> Optional[str]:
+        if (isinstance(instance, POST_MODELS + COMMENT_MODELS)
+                and instance._state.db and is_shard(instance._state.db)):
+            return instance._state.db
+        if (isinstance(instance, POST_MODELS)
+                and instance.author_id is not None):
+            return shard_for(instance.author_id)
+        if isinstance(instance, COMMENT_MODELS):
+            if type(instance).post.is_cached(instance):
+                return self._shard(model, instance.post)
+            author_id = post_author_id(instance.post_id)
+            return shard_for(author_id) if author_id is not None else None
+        if model in POST_MODELS and isinstance(instance, User):
+            return shard_for(instance.pk)
+        return None
@@ -0,0 +1,246 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import (caching, counters, feed, follows, images, search, sharding,
+               thumbnails)
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+# Поля, от которых зависят ленты поста и его копии картинки.
+OLD_POST_FIELDS = {'author', 'author_id', 'group', 'group_id', 'image'}
+
+
+@receiver(post_save, sender=Post)
+def post_fan_out(sender, instance, created, raw=False, **kwargs):
+    """Новый пост попадает в ленты подписчиков автора.
+
+    При шардировании лент нет: follow_index собирает их с шардов.
+    """
+    if created and not raw and not sharding.enabled():
+        feed.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_backfill(sender, instance, created, raw=False, **kwargs):
+    """После подписки в ленту добавляются последние посты автора."""
+    if created and not raw and not sharding.enabled():
+        feed.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_prune(sender, instance, **kwargs):
+    """После отписки посты автора убираются из ленты."""
+    if not sharding.enabled():
+        feed.prune(instance.user_id, instance.author_id)
+
+
+def _deleted_with_post(origin) -> bool:
+    """Комментарий удаляется каскадом вместе со своим постом."""
+    if origin is None:
+        return False
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, Post)
+
+
+def _comment_post(comment: Comment):
+    """Пост комментария с автором и группой для post_scopes."""
+    if Comment.post.is_cached(comment):
+        return comment.post
+    return sharding.on_post_shard(
+        Post.objects.with_related('author', 'group'), comment.post_id
+    ).filter(pk=comment.post_id).first()
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_post(sender, instance, raw=False, using=None,
+                      update_fields=None, **kwargs):
+    """Запоминает ленты, где пост был виден до редактирования,
+    и сбрасывает миниатюру и копии при замене картинки.
+    Файлы старых копий удаляются после фиксации транзакции.
+
+    Старые автор и группа загружаются, только если они изменились.
+    """
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not OLD_POST_FIELDS & set(update_fields):
+        return
+    old = Post.objects.using(using).filter(pk=instance.pk).values(
+        'author_id', 'group_id', 'image', 'renditions').first()
+    if old is None:
+        return
+    if (old['author_id'], old['group_id']) != (instance.author_id,
+                                               instance.group_id):
+        instance._old_scopes = caching.post_scopes(
+            Post(author_id=old['author_id'], group_id=old['group_id']))
+    if old['image'] != instance.image.name:
+        instance.thumbnail = ''
+        instance.renditions = {}
+        if old['renditions']:
+            transaction.on_commit(
+                partial(images.delete_renditions, old['renditions']),
+                using=using
+            )
+
+
+@receiver(pre_save, sender=Post)
+def strip_image_metadata(sender, instance, raw=False, **kwargs):
+    """Новая картинка сохраняется перекодированной, без EXIF и GPS."""
+    if not raw and instance.image and not instance.image._committed:
+        instance.image = images.clean_original(instance.image)
+
+
+@receiver(pre_save, sender=Post)
+def allocate_post_id(sender, instance, raw=False, **kwargs):
+    """При шардировании id нового поста выдаёт каталог в default."""
+    if not raw and instance.pk is None and sharding.enabled():
+        sharding.allocate_post_id(instance)
+
+
+@receiver(pre_save, sender=Comment)
+def allocate_comment_id(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is None and sharding.enabled():
+        sharding.allocate_comment_id(instance)
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_rows(sender, instance, **kwargs):
+    """Каскад в default не видит шарды: посты и комментарии
+    пользователя удаляются там, пока он ещё есть в default.
+    """
+    if sharding.enabled():
+        sharding.delete_author_rows(instance.pk)
+
+
+@receiver(pre_delete, sender=Group)
+def detach_sharded_group(sender, instance, **kwargs):
+    if sharding.enabled():
+        sharding.detach_group(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def schedule_thumbnail(sender, instance, raw=False, **kwargs):
+    """Миниатюра создаётся в фоне сразу после сохранения поста."""
+    if not raw and instance.image and not instance.thumbnail:
+        thumbnails.schedule(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_listings(sender, instance, raw=False, **kwargs):
+    """Изменение поста сбрасывает кеш лент, где он виден."""
+    if raw:
+        return
+    scopes = caching.post_scopes(instance)
+    scopes += getattr(instance, '_old_scopes', [])
+    caching.bump(*set(scopes))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_listings(sender, instance, raw=False, origin=None,
+                                **kwargs):
+    """Комментарии меняют карточку поста в лентах. При удалении поста
+    ленты сбрасывает сам пост, а не каждый его комментарий.
+    """
+    if raw or _deleted_with_post(origin):
+        return
+    post = _comment_post(instance)
+    if post is not None:
+        caching.bump(*caching.post_scopes(post))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_listings(sender, instance, raw=False, **kwargs):
+    """Название группы выводится во всех лентах."""
+    if not raw:
+        caching.bump(caching.GROUPS_SCOPE)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_listings(sender, instance, raw=False, **kwargs):
+    """Кнопка подписки и число подписчиков на странице автора,
+    число подписок на странице подписчика.
+    """
+    if not raw:
+        caching.bump(f'profile:{instance.author.username}',
+                     f'profile:{instance.user.username}')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_followees(sender, instance, raw=False, **kwargs):
+    """Множество подписок пользователя в кеше больше не верно."""
+    if not raw:
+        follows.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    """У каждого нового пользователя есть строка счётчиков."""
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_user_stats(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change_user_stats(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_comments_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_post(origin):
+        counters.change_comments_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_user_stats(instance.author_id, followers_count=1)
+        counters.change_user_stats(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.change_user_stats(instance.author_id, followers_count=-1)
+    counters.change_user_stats(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    """Пост попадает в полнотекстовый индекс при каждом сохранении."""
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.unindex_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.unindex_comment(instance.pk)
@@ -0,0 +1,151 @@
+import asyncio
+import shutil
+import tempfile
+from datetime import timedelta
+from http import HTTPStatus
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.shortcuts import render as django_render
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import async_views, comment_queue
+from posts.models import Comment, Follow, Group, Post, User
+
+
+@override_settings(ROOT_URLCONF=settings.ASGI_URLCONF)
+class AsyncViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='async-group',
+                                         description='Описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.posts = [
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Асинхронный пост #{number}')
+            for number in range(settings.COUNT_OF_VISIBLE_POSTS + 2)
+        ]
+        Comment.objects.create(post=cls.posts[-1], author=cls.reader,
+                               text='Асинхронный комментарий')
+
+    def setUp(self):
+        self.guest_client = AsyncClient()
+        self.reader_client = AsyncClient()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+
+    async def test_read_pages_use_async_views(self):
+        """Страницы чтения обслуживают async-view с прежними шаблонами."""
+        last_post = self.posts[-1]
+        pages = {
+            reverse('posts:index'): (async_views.index,
+                                     'posts/index.html'),
+            reverse('posts:group_pages', kwargs={'slug': self.group.slug}): (
+                async_views.group_posts, 'posts/group_list.html'),
+            reverse('posts:profile', kwargs={'username': 'author'}): (
+                async_views.profile, 'posts/profile.html'),
+            reverse('posts:post_detail', kwargs={'post_id': last_post.pk}): (
+                async_views.post_detail, 'posts/post_detail.html'),
+            reverse('posts:follow_index'): (async_views.follow_index,
+                                            'posts/follow.html'),
+        }
+        for url, (view, template) in pages.items():
+            with self.subTest(url=url):
+                response = await self.reader_client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(response.resolver_match.func, view)
+                self.assertTemplateUsed(response, template)
+                self.assertContains(response, last_post.text)
+
+    async def test_templates_render_off_event_loop(self):
+        """Шаблон с кешем фрагментов рендерится не в цикле событий."""
+        loops = []
+
+        def render(*args, **kwargs):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return django_render(*args, **kwargs)
+
+        with mock.patch.object(async_views, 'render', render):
+            response = await self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(loops, [None])
+
+    async def test_cursor_pages(self):
+        """Курсор ведёт на следующую страницу ленты."""
+        first = await self.guest_client.get(reverse('posts:index'))
+        second = await self.guest_client.get(
+            reverse('posts:index'),
+            {'after': first.context['page_obj'].next_cursor}
+        )
+        self.assertEqual(list(second.context['page_obj']),
+                         self.posts[1::-1])
+
+    async def test_post_detail_not_modified(self):
+        """Async-страница поста отвечает 304 на свой ETag."""
+        url = reverse('posts:post_detail',
+                      kwargs={'post_id': self.posts[-1].pk})
+        first = await self.guest_client.get(url)
+        self.assertContains(first, 'Асинхронный комментарий')
+        response = await self.guest_client.get(
+            url, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    async def test_post_detail_shows_queued_comment(self):
+        """Автор видит свой комментарий из очереди, ETag меняется."""
+        post = self.posts[-1]
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        queue_dir = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, queue_dir, ignore_errors=True)
+        with self.settings(COMMENT_WRITE_BEHIND=True,
+                           COMMENT_QUEUE_DIR=queue_dir,
+                           COMMENT_FLUSH_INTERVAL=0):
+            first = await self.reader_client.get(url)
+            await sync_to_async(comment_queue.enqueue)(
+                post, self.reader, 'Ждёт записи')
+            response = await self.reader_client.get(
+                url, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Ждёт записи')
+
+    async def test_queued_comment_on_archived_post(self):
+        """Комментарий из очереди к посту, ушедшему в архив."""
+        post = self.posts[0]
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        queue_dir = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, queue_dir, ignore_errors=True)
+        with self.settings(COMMENT_WRITE_BEHIND=True,
+                           COMMENT_QUEUE_DIR=queue_dir,
+                           COMMENT_FLUSH_INTERVAL=0):
+            await sync_to_async(comment_queue.enqueue)(
+                post, self.reader, 'Ждёт архива')
+            await Post.objects.filter(pk=post.pk).aupdate(
+                created=timezone.now() - timedelta(
+                    days=settings.ARCHIVE_AFTER_DAYS + 1))
+            await sync_to_async(call_command)('archive_posts',
+                                              stdout=StringIO())
+            response = await self.reader_client.get(url)
+        self.assertContains(response, 'Ждёт архива')
+
+    async def test_not_found_and_login(self):
+        """404 для неизвестной группы, гость уходит на страницу входа."""
+        response = await self.guest_client.get(
+            reverse('posts:group_pages', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        response = await self.guest_client.get(reverse('posts:follow_index'))
+        self.assertRedirects(
+            response,
+            f'{reverse("auth:login")}?next={reverse("posts:follow_index")}',
+            fetch_redirect_response=False
+        )
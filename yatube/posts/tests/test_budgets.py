@@ -0,0 +1,128 @@
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from core.testing import QueryBudgetTestMixin
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class QueryBudgetTest(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.posts = [
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Тестовый пост #{number}')
+            for number in range(12)
+        ]
+        for number in range(25):
+            Comment.objects.create(post=cls.posts[0], author=cls.reader,
+                                   text=f'Комментарий #{number}')
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def get_budget_requests(self):
+        author = self.login(self.author)
+        reader = self.login(self.reader)
+        post_id = self.posts[0].pk
+        uidb64 = urlsafe_base64_encode(force_bytes(self.reader.pk))
+        return {
+            'posts:index': (reverse('posts:index'), reader),
+            'posts:group_pages': (
+                reverse('posts:group_pages',
+                        kwargs={'slug': self.group.slug}),
+                reader
+            ),
+            'posts:profile': (
+                reverse('posts:profile', kwargs={'username': 'author'}),
+                reader
+            ),
+            'posts:post_detail': (
+                reverse('posts:post_detail', kwargs={'post_id': post_id}),
+                reader
+            ),
+            'posts:post_comments': (
+                reverse('posts:post_comments', kwargs={'post_id': post_id}),
+                Client()
+            ),
+            'posts:search': (reverse('posts:search') + '?q=тестовый',
+                             reader),
+            'posts:post_create': (reverse('posts:post_create'), author),
+            'posts:post_edit': (
+                reverse('posts:post_edit', kwargs={'post_id': post_id}),
+                author
+            ),
+            'posts:add_comment': (
+                reverse('posts:add_comment', kwargs={'post_id': post_id}),
+                reader
+            ),
+            'posts:follow_index': (reverse('posts:follow_index'), reader),
+            'posts:profile_follow': (
+                reverse('posts:profile_follow',
+                        kwargs={'username': 'reader'}),
+                author
+            ),
+            'posts:profile_unfollow': (
+                reverse('posts:profile_unfollow',
+                        kwargs={'username': 'reader'}),
+                author
+            ),
+            'api:index': (reverse('api:index'), reader),
+            'api:group_posts': (
+                reverse('api:group_posts', kwargs={'slug': self.group.slug}),
+                reader
+            ),
+            'api:profile': (
+                reverse('api:profile', kwargs={'username': 'author'}),
+                reader
+            ),
+            'api:post_detail': (
+                reverse('api:post_detail', kwargs={'post_id': post_id}),
+                reader
+            ),
+            'api:follow_index': (reverse('api:follow_index'), reader),
+            'auth:logout': (reverse('auth:logout'),
+                            self.login(self.reader)),
+            'auth:signup': (reverse('auth:signup'), Client()),
+            'auth:login': (reverse('auth:login'), Client()),
+            'auth:password_change': (reverse('auth:password_change'),
+                                     reader),
+            'auth:password_change_done': (
+                reverse('auth:password_change_done'), reader
+            ),
+            'auth:password_reset': (reverse('auth:password_reset'),
+                                    Client()),
+            'auth:password_reset_done': (
+                reverse('auth:password_reset_done'), Client()
+            ),
+            'auth:password_reset_confirm': (
+                reverse('auth:password_reset_confirm',
+                        kwargs={'uidb64': uidb64, 'token': 'bad-token'}),
+                Client()
+            ),
+            'auth:password_reset_complete': (
+                reverse('auth:password_reset_complete'), Client()
+            ),
+        }
+
+
+@override_settings(POST_SHARDS=['shard_0', 'shard_1'])
+class ShardedQueryBudgetTest(QueryBudgetTest):
+    """Те же страницы при шардировании, бюджет - QUERY_BUDGETS_SHARDED."""
+    databases = {'default', 'shard_0', 'shard_1'}
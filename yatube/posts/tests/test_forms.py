@@ -73,6 +73,30 @@ class PostsCreateFormTest(TestCase):
         self.assertTrue(latest_post.image)
         self.assertEqual(Post.objects.count(), posts_count + 1)
 
+    @override_settings(IMAGE_MAX_SIDE=1)
+    def test_oversized_image_is_rejected(self):
+        """Картинка больше допустимого размера не сохраняется."""
+        posts_count = Post.objects.count()
+        uploaded = SimpleUploadedFile(
+            name='wide.gif',
+            content=(
+                b'\x47\x49\x46\x38\x39\x61\x02\x00'
+                b'\x01\x00\x80\x00\x00\x00\x00\x00'
+                b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+                b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+                b'\x0A\x00\x3B'
+            ),
+            content_type='image/gif'
+        )
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Широкая картинка', 'image': uploaded}
+        )
+        self.assertFormError(response.context['form'], 'image',
+                             'Сторона картинки не должна превышать 1 px')
+        self.assertEqual(Post.objects.count(), posts_count)
+
     def test_edit_form_change_record_in_database(self):
         """Проверка изменения записи в БД, при изменении её пользователем."""
         new_post = Post.objects.create(
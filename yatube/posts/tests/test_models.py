@@ -1,7 +1,15 @@
+from io import StringIO
+from unittest import mock
+
 from django.conf import settings
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-from posts.models import Group, Post, User
+from posts import caching, sharding
+from posts.models import (Comment, CommentId, Follow, Group, Post,
+                          PostLocation, User, UserStats)
 
 
 class PostModelTest(TestCase):
@@ -56,3 +64,135 @@ class PostModelTest(TestCase):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expectede_value
                 )
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_creation_and_deletion(self):
+        """Счётчики меняются при создании и удалении записей."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(post=post, author=self.reader,
+                                         text='Коммент')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+        self.assertEqual(post.comments_count, 1)
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+        post.delete()
+        self.assertEqual(self.stats(self.author).posts_count, 0)
+
+    def test_recount_repairs_drift(self):
+        """Команда recount исправляет разошедшиеся счётчики."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Да')
+        UserStats.objects.update(posts_count=42)
+        Post.objects.update(comments_count=0)
+        call_command('recount', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(post.comments_count, 1)
+
+
+class PostSignalsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='signals',
+                                         description='Описание')
+
+    def test_post_delete_bumps_listings_once(self):
+        """Каскадное удаление комментариев не сбрасывает ленты
+        и не ищет пост для каждого комментария.
+        """
+        post = Post.objects.create(author=self.author, text='Пост')
+        for number in range(5):
+            Comment.objects.create(post=post, author=self.author,
+                                   text=f'Комментарий #{number}')
+        post = Post.objects.get(pk=post.pk)
+        with mock.patch.object(caching, 'bump') as bump:
+            with CaptureQueriesContext(connection) as queries:
+                post.delete()
+        self.assertEqual(bump.call_count, 1)
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith('SELECT')
+                          and '"posts_post"' in query['sql']])
+
+    def test_save_reads_old_post_only_when_needed(self):
+        """Старый пост читается, только если могли смениться его ленты."""
+        post = Post.objects.create(author=self.author, group=self.group,
+                                   text='Пост')
+        with CaptureQueriesContext(connection) as queries:
+            post.text = 'Правка'
+            post.save(update_fields=['text', 'modified'])
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith('SELECT')])
+        post.group = None
+        with mock.patch.object(caching, 'bump') as bump:
+            post.save()
+        self.assertIn(f'group:{self.group.slug}', bump.call_args.args)
+
+
+class SeedCommandTest(TestCase):
+    def test_seed_creates_requested_volumes(self):
+        """Команда seed создаёт записи и пересчитывает счётчики."""
+        call_command('seed', posts=30, users=5, groups=2, comments=10,
+                     follows=4, seed=1, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 30)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Follow.objects.count(), 4)
+        self.assertEqual(
+            sum(UserStats.objects.values_list('posts_count', flat=True)), 30
+        )
+        self.assertEqual(
+            sum(Post.objects.values_list('comments_count', flat=True)), 10
+        )
+
+
+@override_settings(POST_SHARDS=['shard_0', 'shard_1'])
+class ShardedSeedCommandTest(TestCase):
+    databases = {'default', 'shard_0', 'shard_1'}
+
+    def test_seed_routes_rows_to_shards(self):
+        """При шардировании id выдают каталоги, записи лежат на шардах."""
+        call_command('seed', posts=30, users=5, groups=2, comments=10,
+                     follows=4, seed=1, stdout=StringIO())
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+        locations = dict(PostLocation.objects.values_list('id', 'author_id'))
+        self.assertEqual(len(locations), 30)
+        comment_ids = set()
+        for alias in ('shard_0', 'shard_1'):
+            for post_id, author_id in Post.objects.using(
+                    alias).values_list('id', 'author_id'):
+                self.assertEqual(locations[post_id], author_id)
+                self.assertEqual(sharding.shard_for(author_id), alias)
+            for comment_id, post_id in Comment.objects.using(
+                    alias).values_list('id', 'post_id'):
+                self.assertEqual(
+                    sharding.shard_for(locations[post_id]), alias)
+                comment_ids.add(comment_id)
+        self.assertEqual(
+            comment_ids, set(CommentId.objects.values_list('id', flat=True)))
+        self.assertEqual(
+            sum(UserStats.objects.values_list('posts_count', flat=True)), 30
+        )
+        self.assertEqual(sum(
+            sum(Post.objects.using(alias).values_list('comments_count',
+                                                      flat=True))
+            for alias in ('shard_0', 'shard_1')
+        ), 10)
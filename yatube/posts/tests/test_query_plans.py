@@ -0,0 +1,84 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+
+# Признаки плохого плана в выводе EXPLAIN QUERY PLAN SQLite.
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+def bad_plan_steps(sql):
+    """Шаги плана запроса с полным сканированием или сортировкой."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        steps = [row[-1] for row in cursor.fetchall()]
+    return [
+        step for step in steps
+        if TEMP_SORT in step
+        or (step.startswith('SCAN ') and ' USING ' not in step)
+    ]
+
+
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.posts = [
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Тестовый пост #{number}')
+            for number in range(15)
+        ]
+        Comment.objects.create(post=cls.posts[0], author=cls.reader,
+                               text='Комментарий')
+        cls.views_names = (
+            reverse('posts:index'),
+            reverse('posts:group_pages', kwargs={'slug': cls.group.slug}),
+            reverse('posts:profile', kwargs={'username': cls.author}),
+            reverse('posts:post_detail',
+                    kwargs={'post_id': cls.posts[0].pk}),
+            reverse('posts:follow_index'),
+        )
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+        cache.clear()
+
+    def assert_good_plans(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(url, params)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            with self.subTest(url=url, sql=sql):
+                self.assertEqual(bad_plan_steps(sql), [])
+        return response
+
+    def test_views_use_indexes(self):
+        """Запросы страниц не сканируют таблицы целиком
+        и не сортируют во временном B-дереве.
+        """
+        for url in self.views_names:
+            self.assert_good_plans(url)
+
+    def test_cursor_pages_use_indexes(self):
+        """Вторая страница ленты - тоже поиск по индексу."""
+        for url in self.views_names:
+            response = self.authorized_client.get(url)
+            page_obj = response.context.get('page_obj')
+            if page_obj is None or not page_obj.has_next():
+                continue
+            cache.clear()
+            self.assert_good_plans(url, {'after': page_obj.next_cursor})
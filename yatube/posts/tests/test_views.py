@@ -1,15 +1,30 @@
+import os
 import shutil
 import tempfile
+from datetime import timedelta
+from http import HTTPStatus
+from io import BytesIO, StringIO
+from unittest import mock
 
+from asgiref.sync import sync_to_async
 from django import forms
 from django.conf import settings
 from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.db.utils import IntegrityError
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.utils import DatabaseError, IntegrityError
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 
-from posts.models import Follow, Group, Post, User
+from core import metrics
+from posts import caching, comment_queue, follows, thumbnails
+from posts.models import (ArchivedComment, ArchivedPost, Comment, FeedEntry,
+                          Follow, Group, Post, PostLocation, User, UserStats)
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -169,9 +184,6 @@ class PaginatorViewsTest(TestCase):
                 kwargs={'username': 'auth'}
             )
         )
-        cls.second_views_names = (
-            elem + '?page=2' for elem in cls.first_views_names
-        )
 
     def setUp(self):
         self.guest_client = Client()
@@ -188,15 +200,21 @@ class PaginatorViewsTest(TestCase):
                     len(response.context['page_obj']),
                     settings.COUNT_OF_VISIBLE_POSTS)
 
+    def get_second_page(self, reverse_name):
+        cache.clear()
+        first_page = self.guest_client.get(reverse_name)
+        next_cursor = first_page.context['page_obj'].next_cursor
+        return self.guest_client.get(reverse_name, {'after': next_cursor})
+
     def test_second_page_contains_remains(self):
         """Проверяем, что вторая страница содержит количество постов,
         оставшееся после отображения на первой странице.
         """
         no_group = self.COUNT_POSTS_WITH_GROUP
         all_posts = settings.COUNT_OF_VISIBLE_POSTS
-        for reverse_name in self.second_views_names:
+        for reverse_name in self.first_views_names:
             with self.subTest(reverse_name=reverse_name):
-                response = self.guest_client.get(reverse_name)
+                response = self.get_second_page(reverse_name)
                 if 'group' in reverse_name:
                     self.assertEqual(
                         len(response.context['page_obj']),
@@ -208,6 +226,36 @@ class PaginatorViewsTest(TestCase):
                     self.COUNT_POSTS_ALL - settings.COUNT_OF_VISIBLE_POSTS
                 )
 
+    def test_cursor_pages_do_not_overlap(self):
+        """Курсор ?after= продолжает ленту без пропусков и повторов,
+        а ?before= возвращает на предыдущую страницу.
+        """
+        reverse_name = reverse('posts:index')
+        first_page = self.guest_client.get(reverse_name).context['page_obj']
+        second_page = self.get_second_page(reverse_name).context['page_obj']
+        self.assertFalse(first_page.has_previous())
+        self.assertFalse(second_page.has_next())
+        self.assertEqual(
+            [post.id for post in first_page] + [post.id for post in
+                                                second_page],
+            list(Post.objects.order_by('-created', '-id')
+                 .values_list('id', flat=True))
+        )
+        back_page = self.guest_client.get(
+            reverse_name, {'before': second_page.previous_cursor}
+        ).context['page_obj']
+        self.assertEqual(list(back_page), list(first_page))
+
+    def test_broken_cursor_returns_first_page(self):
+        """Испорченный курсор открывает первую страницу."""
+        reverse_name = reverse('posts:index')
+        response = self.guest_client.get(reverse_name, {'after': 'broken'})
+        self.assertEqual(
+            len(response.context['page_obj']),
+            settings.COUNT_OF_VISIBLE_POSTS
+        )
+        self.assertFalse(response.context['page_obj'].has_previous())
+
 
 class CheckCreationTest(TestCase):
     @classmethod
@@ -294,10 +342,11 @@ class CacheTest(TestCase):
         cache.clear()
 
     def test_cache_index_page(self):
-        """Проверяем работу кеша через удаление записи."""
+        """Повторный запрос ленты отдаётся из кеша."""
         responce_with_post = self.guest_client.get(
             self.views).content.decode("utf-8")
-        Post.objects.latest('id').delete()
+        # update() не отправляет сигналы и не сбрасывает версию кеша.
+        Post.objects.filter(pk=self.post.pk).update(text='Изменено тихо')
         responce_with_cache = self.guest_client.get(
             self.views).content.decode("utf-8")
         self.assertEqual(responce_with_post, responce_with_cache)
@@ -306,6 +355,459 @@ class CacheTest(TestCase):
             self.views).content.decode("utf-8")
         self.assertNotEqual(responce_with_cache, responce_no_cache)
 
+    def test_post_changes_invalidate_cache(self):
+        """Создание и удаление поста сразу видны в закешированных лентах."""
+        pages = (
+            self.views,
+            reverse('posts:profile', kwargs={'username': self.user}),
+        )
+        for page in pages:
+            self.guest_client.get(page)
+        new_post = Post.objects.create(author=self.user,
+                                       text='Свежий пост')
+        for page in pages:
+            with self.subTest(page=page):
+                self.assertContains(self.guest_client.get(page),
+                                    new_post.text)
+        new_post.delete()
+        for page in pages:
+            with self.subTest(page=page):
+                self.assertNotContains(self.guest_client.get(page),
+                                       new_post.text)
+
+    def test_group_rename_invalidates_cache(self):
+        """Переименование группы сбрасывает кеш лент."""
+        group = Group.objects.create(title='Старое название',
+                                     slug='renamed-group',
+                                     description='Описание')
+        Post.objects.filter(pk=self.post.pk).update(group=group)
+        self.assertContains(self.guest_client.get(self.views), group.title)
+        group.title = 'Новое название'
+        group.save()
+        self.assertContains(self.guest_client.get(self.views), group.title)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(title='Группа', slug='etag-group',
+                                         description='Описание')
+        cls.post = Post.objects.create(author=cls.user, group=cls.group,
+                                       text='Пост для условных запросов')
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def test_listings_answer_not_modified(self):
+        """Повторный запрос с If-None-Match получает 304 без шаблона."""
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:group_pages', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for page in pages:
+            with self.subTest(page=page):
+                etag = self.guest_client.get(page)['ETag']
+                response = self.guest_client.get(
+                    page, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+                self.assertEqual(response.templates, [])
+
+    def test_listing_etag_changes_with_posts(self):
+        """Новый пост меняет ETag ленты."""
+        etag = self.guest_client.get(reverse('posts:index'))['ETag']
+        Post.objects.create(author=self.user, text='Свежий пост')
+        response = self.guest_client.get(reverse('posts:index'),
+                                         HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_listing_etag_depends_on_user(self):
+        """Гость и пользователь получают разные ETag одной ленты."""
+        etag = self.guest_client.get(reverse('posts:index'))['ETag']
+        authorized_client = Client()
+        authorized_client.force_login(self.user)
+        response = authorized_client.get(reverse('posts:index'),
+                                         HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_detail_validators_follow_comments(self):
+        """Комментарий меняет ETag и Last-Modified страницы поста."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        first = self.guest_client.get(url)
+        self.assertIn('Last-Modified', first)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.guest_client.get(
+                url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(len(queries.captured_queries), 1)
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='Новый комментарий')
+        response = self.guest_client.get(url,
+                                         HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Новый комментарий')
+
+    def test_missing_post_is_not_found(self):
+        """Для несуществующего поста валидаторов нет, ответ 404."""
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': 10 ** 6}),
+            HTTP_IF_NONE_MATCH='*'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class CountersOnPagesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def test_pages_do_not_run_aggregate_queries(self):
+        """Страницы поста и профиля не выполняют COUNT при чтении."""
+        pages = (
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+        )
+        for page in pages:
+            with self.subTest(page=page):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.guest_client.get(page)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertFalse(
+                    [query['sql'] for query in queries.captured_queries
+                     if 'COUNT(' in query['sql'].upper()]
+                )
+
+    def test_follow_refreshes_follower_profile(self):
+        """Подписка сразу меняет число подписок в профиле подписчика."""
+        follower = User.objects.create_user(username='follower')
+        url = reverse('posts:profile', kwargs={'username': 'follower'})
+        self.assertContains(self.guest_client.get(url), 'подписок: 0')
+        Follow.objects.create(user=follower, author=self.user)
+        self.assertContains(self.guest_client.get(url), 'подписок: 1')
+
+
+class CommentsPaginationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Вирусный')
+        cls.COUNT_COMMENTS = settings.COUNT_OF_VISIBLE_COMMENTS + 5
+        commentators = User.objects.bulk_create(
+            [User(username=f'commentator{number}')
+             for number in range(cls.COUNT_COMMENTS)]
+        )
+        Comment.objects.bulk_create(
+            [Comment(post=cls.post, author=commentator,
+                     text=f'Комментарий #{number}')
+             for number, commentator in enumerate(commentators)]
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_detail_shows_first_comments_page(self):
+        """На странице поста одна порция комментариев, авторы
+        загружаются тем же запросом.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.guest_client.get(
+                reverse('posts:post_detail',
+                        kwargs={'post_id': self.post.pk})
+            )
+        comments = response.context['comments']
+        self.assertEqual(len(comments),
+                         settings.COUNT_OF_VISIBLE_COMMENTS)
+        self.assertTrue(comments.has_next())
+        self.assertLess(len(queries.captured_queries), 5)
+
+    def test_load_more_returns_remaining_comments(self):
+        """Фрагмент «Показать ещё» отдаёт следующую порцию."""
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        fragment = self.guest_client.get(
+            reverse('posts:post_comments',
+                    kwargs={'post_id': self.post.pk}),
+            {'after': response.context['comments'].next_cursor}
+        )
+        self.assertTemplateUsed(fragment, 'includes/comments.html')
+        self.assertEqual(
+            len(fragment.context['comments']),
+            self.COUNT_COMMENTS - settings.COUNT_OF_VISIBLE_COMMENTS
+        )
+        self.assertFalse(fragment.context['comments'].has_next())
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.relevant = Post.objects.create(
+            author=cls.author, text='Ёжик ёжик ёжик в тумане')
+        cls.mentioned = Post.objects.create(
+            author=cls.author, text='Туман над рекой, и где-то ёжики')
+        cls.commented = Post.objects.create(
+            author=cls.author, text='Просто пост')
+        Comment.objects.create(post=cls.commented, author=cls.author,
+                               text='Напомнило про ежа')
+        cls.other = Post.objects.create(author=cls.author, text='Про котов')
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def search(self, query, **params):
+        response = self.guest_client.get(reverse('posts:search'),
+                                         {'q': query, **params})
+        return response.context['page_obj']
+
+    def test_search_ranks_by_relevance(self):
+        """Пост с частым словом выше поста с одним упоминанием."""
+        self.assertEqual(list(self.search('ёжик')),
+                         [self.relevant, self.mentioned])
+
+    def test_search_is_case_and_prefix_insensitive(self):
+        """Регистр и ё не важны, слово ищется по началу."""
+        self.assertIn(self.mentioned, self.search('ЕЖИК'))
+        self.assertIn(self.mentioned, self.search('туман'))
+
+    def test_search_matches_comments(self):
+        """Пост находится по тексту комментария."""
+        self.assertEqual(list(self.search('ежа')), [self.commented])
+
+    def test_index_follows_edit_and_delete(self):
+        """Сигналы обновляют индекс при правке и удалении поста."""
+        self.other.text = 'Про собак'
+        self.other.save()
+        self.assertEqual(list(self.search('котов')), [])
+        self.assertEqual(list(self.search('собак')), [self.other])
+        self.other.delete()
+        self.assertEqual(list(self.search('собак')), [])
+
+    @override_settings(COUNT_OF_VISIBLE_POSTS=1)
+    def test_second_page_by_cursor(self):
+        """Вторая страница выдачи продолжает первую по курсору."""
+        first = self.search('ёжик')
+        second = self.search('ёжик', after=first.next_cursor)
+        self.assertEqual(list(first), [self.relevant])
+        self.assertEqual(list(second), [self.mentioned])
+        self.assertFalse(second.has_next())
+
+    def test_empty_query(self):
+        """Пустой запрос не обращается к индексу."""
+        self.assertEqual(list(self.search('  ')), [])
+
+    def test_rebuild_command(self):
+        """Команда восстанавливает индекс для записей без сигналов."""
+        Post.objects.bulk_create(
+            [Post(author=self.author, text='Массовая загрузка')]
+        )
+        self.assertEqual(len(self.search('массовая')), 0)
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.search('массовая')), 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def create_post(self):
+        uploaded = SimpleUploadedFile(
+            name='thumb.gif',
+            content=PostsPagesTests.small_gif,
+            content_type='image/gif'
+        )
+        return Post.objects.create(author=self.user, text='С картинкой',
+                                   image=uploaded)
+
+    def test_thumbnail_is_scheduled_after_commit(self):
+        """Генерация миниатюры ставится в очередь после коммита."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = self.create_post()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(post.thumbnail, '')
+
+    def test_placeholder_until_thumbnail_is_ready(self):
+        """Пока миниатюры нет, выводится заглушка, потом - картинка."""
+        post = self.create_post()
+        detail_url = reverse('posts:post_detail',
+                             kwargs={'post_id': post.pk})
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'aspect-ratio')
+        thumbnails.generate(post.pk)
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnail)
+        for url in (reverse('posts:index'), detail_url):
+            with self.subTest(url=url):
+                self.assertContains(self.guest_client.get(url),
+                                    post.thumbnail_url)
+
+    def create_photo(self, size):
+        """JPEG с EXIF, как с телефона."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Телефон'
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG', exif=exif)
+        uploaded = SimpleUploadedFile(name='photo.jpg',
+                                      content=buffer.getvalue(),
+                                      content_type='image/jpeg')
+        return Post.objects.create(author=self.user, text='Фото',
+                                   image=uploaded)
+
+    def test_renditions_in_every_format_and_width(self):
+        """Копии создаются в WebP и JPEG без увеличения и без EXIF."""
+        post = self.create_photo((1000, 800))
+        thumbnails.generate(post.pk)
+        post.refresh_from_db()
+        for name in ('webp', 'jpeg'):
+            with self.subTest(format=name):
+                self.assertEqual(set(post.renditions[name]), {'480', '960'})
+                with default_storage.open(
+                        post.renditions[name]['960']) as stored:
+                    with Image.open(stored) as image:
+                        self.assertEqual(image.size, (960, 339))
+                        self.assertFalse(image.getexif())
+        self.assertEqual(post.thumbnail, post.renditions['jpeg']['960'])
+
+    def test_original_is_stored_without_metadata(self):
+        """Оригинал в хранилище перекодирован без EXIF."""
+        post = self.create_photo((1000, 800))
+        with default_storage.open(post.image.name) as stored:
+            with Image.open(stored) as image:
+                self.assertEqual(image.size, (1000, 800))
+                self.assertFalse(image.getexif())
+
+    def test_transparent_image_is_flattened_onto_white(self):
+        """Прозрачные области копий заливаются белым, а не чёрным."""
+        buffer = BytesIO()
+        Image.new('RGBA', (600, 400), (0, 0, 0, 0)).save(buffer, 'PNG')
+        uploaded = SimpleUploadedFile(name='logo.png',
+                                      content=buffer.getvalue(),
+                                      content_type='image/png')
+        post = Post.objects.create(author=self.user, text='Логотип',
+                                   image=uploaded)
+        thumbnails.generate(post.pk)
+        post.refresh_from_db()
+        for name in ('webp', 'jpeg'):
+            with self.subTest(format=name):
+                with default_storage.open(
+                        post.renditions[name]['480']) as stored:
+                    with Image.open(stored) as image:
+                        red, green, blue = image.convert('RGB').getpixel(
+                            (10, 10))
+                        self.assertGreater(min(red, green, blue), 245)
+
+    def test_replaced_image_deletes_old_renditions(self):
+        """При замене картинки файлы старых копий удаляются."""
+        post = self.create_photo((1000, 800))
+        thumbnails.generate(post.pk)
+        post.refresh_from_db()
+        old = [name for by_width in post.renditions.values()
+               for name in by_width.values()]
+        post.image = SimpleUploadedFile(
+            name='other.gif', content=PostsPagesTests.small_gif,
+            content_type='image/gif')
+        with mock.patch('posts.thumbnails.schedule'):
+            with self.captureOnCommitCallbacks(execute=True):
+                post.save()
+        self.assertEqual(post.renditions, {})
+        for name in old:
+            with self.subTest(name=name):
+                self.assertFalse(default_storage.exists(name))
+
+    def test_page_has_srcset(self):
+        """Карточка поста отдаёт браузеру srcset с WebP."""
+        post = self.create_photo((1000, 800))
+        thumbnails.generate(post.pk)
+        post.refresh_from_db()
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, post.webp_srcset)
+        self.assertContains(response, post.jpeg_srcset)
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(
+            author=cls.author,
+            text='Текст карточки',
+        )
+        cls.views = reverse('posts:index')
+
+    def setUp(self):
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+
+    def test_card_is_cached_until_post_is_modified(self):
+        """Карточка берётся из кеша, пока пост не изменён."""
+        self.reader_client.get(self.views)
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
+        caching.bump('index')
+        self.assertContains(self.reader_client.get(self.views),
+                            'Текст карточки')
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Честная правка'
+        post.save()
+        self.assertContains(self.reader_client.get(self.views),
+                            'Честная правка')
+
+    def test_card_follows_author_and_group_renames(self):
+        """Имя автора и ссылка на группу в карточке не устаревают."""
+        group = Group.objects.create(title='Группа', slug='old-slug',
+                                     description='Описание')
+        Post.objects.filter(pk=self.post.pk).update(group=group)
+        caching.bump('index')
+        self.reader_client.get(self.views)
+        User.objects.filter(pk=self.author.pk).update(
+            username='renamed', first_name='Новое', last_name='Имя')
+        Group.objects.filter(pk=group.pk).update(slug='new-slug')
+        caching.bump('index')
+        response = self.reader_client.get(self.views)
+        self.assertContains(response, 'Новое Имя')
+        self.assertContains(response, reverse('posts:profile',
+                                              kwargs={'username': 'renamed'}))
+        self.assertContains(response, reverse('posts:group_pages',
+                                              kwargs={'slug': 'new-slug'}))
+
+    def test_edit_link_is_not_cached_in_card(self):
+        """Ссылка на редактирование видна только автору поста."""
+        edit_url = reverse('posts:post_edit',
+                           kwargs={'post_id': self.post.pk})
+        self.assertContains(self.author_client.get(self.views), edit_url)
+        self.assertNotContains(self.reader_client.get(self.views), edit_url)
+
 
 class FollowTest(TestCase):
     @classmethod
@@ -325,6 +827,7 @@ class FollowTest(TestCase):
         self.authorized_client.force_login(self.second_user)
         self.not_follow_user = Client()
         self.not_follow_user.force_login(self.third_user)
+        cache.clear()
 
     def test_follow_users(self):
         """Авторизованный пользователь может подписываться на авторов
@@ -377,3 +880,704 @@ class FollowTest(TestCase):
             raise IntegrityError('Пользователь подписался на себя же.')
         except IntegrityError:
             pass
+
+    def test_follow_backfills_and_unfollow_prunes_feed(self):
+        """Подписка добавляет в ленту старые посты автора,
+        отписка убирает их.
+        """
+        self.authorized_client.get(
+            reverse('posts:profile_follow',
+                    kwargs={'username': self.first_user.username})
+        )
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow',
+                    kwargs={'username': self.first_user.username})
+        )
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertFalse(len(response.context['page_obj']))
+        self.assertFalse(
+            FeedEntry.objects.filter(user=self.second_user).exists()
+        )
+
+    def test_profile_shows_following_only_for_followed_author(self):
+        """Кнопка подписки зависит от подписки на этого автора,
+        а не от наличия постов у авторов из подписок.
+        """
+        Follow.objects.create(user=self.second_user,
+                              author=self.third_user)
+        pages = {self.first_user: False, self.third_user: True}
+        for author, following in pages.items():
+            with self.subTest(author=author.username):
+                response = self.authorized_client.get(
+                    reverse('posts:profile',
+                            kwargs={'username': author.username})
+                )
+                self.assertEqual(response.context['following'], following)
+
+    def test_follow_twice_keeps_one_row(self):
+        """Повторная подписка и подписка на себя не создают записей."""
+        self.assertTrue(follows.follow(self.second_user, self.first_user))
+        self.assertFalse(follows.follow(self.second_user, self.first_user))
+        self.assertFalse(follows.follow(self.second_user, self.second_user))
+        self.authorized_client.get(
+            reverse('posts:profile_follow',
+                    kwargs={'username': self.first_user.username})
+        )
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertTrue(follows.unfollow(self.second_user, self.first_user))
+        self.assertFalse(follows.unfollow(self.second_user, self.first_user))
+
+    def test_is_following_is_cached_until_follow_changes(self):
+        """Проверка подписки берёт множество из кеша, подписка
+        и отписка его сбрасывают.
+        """
+        self.assertFalse(
+            follows.is_following(self.second_user, self.first_user))
+        with self.assertNumQueries(0):
+            follows.is_following(self.second_user, self.first_user)
+        follows.follow(self.second_user, self.first_user)
+        self.assertTrue(
+            follows.is_following(self.second_user, self.first_user))
+        follows.unfollow(self.second_user, self.first_user)
+        self.assertFalse(
+            follows.is_following(self.second_user, self.first_user))
+
+    @override_settings(FEED_MAX_LENGTH=2)
+    def test_feed_length_is_bounded(self):
+        """trim_feeds оставляет FEED_MAX_LENGTH последних постов,
+        публикация поста ленты не обрезает.
+        """
+        Follow.objects.create(user=self.second_user,
+                              author=self.first_user)
+        new_posts = [
+            Post.objects.create(author=self.first_user,
+                                text=f'Пост #{number}')
+            for number in range(3)
+        ]
+        self.assertGreater(
+            FeedEntry.objects.filter(user=self.second_user).count(), 2)
+        call_command('trim_feeds', stdout=StringIO())
+        self.assertEqual(
+            list(FeedEntry.objects.filter(user=self.second_user)
+                 .values_list('post_id', flat=True)),
+            [new_posts[2].id, new_posts[1].id]
+        )
+
+    def test_rebuild_feeds_command(self):
+        """Команда rebuild_feeds восстанавливает потерянные записи ленты."""
+        Follow.objects.create(user=self.second_user,
+                              author=self.first_user)
+        FeedEntry.objects.all().delete()
+        call_command('rebuild_feeds', self.second_user.username,
+                     stdout=StringIO())
+        self.assertEqual(
+            list(FeedEntry.objects.values_list('user_id', 'post_id')),
+            [(self.second_user.id, self.post.id)]
+        )
+
+
+class FeedQueriesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author',
+                                              first_name='Лев')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='lean-feed',
+                                         description='Описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for number in range(settings.COUNT_OF_VISIBLE_POSTS + 1):
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Пост ленты #{number}')
+        cls.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_pages', kwargs={'slug': cls.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:follow_index'),
+            reverse('posts:search') + '?q=ленты',
+        )
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def test_feed_page_is_one_query_without_passwords(self):
+        """Страница ленты - один запрос к постам, карточки не догружают
+        авторов и группы, пароли авторов не выбираются.
+        """
+        for url in self.urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertContains(response, 'Пост ленты #1')
+                sql = [query['sql'] for query in queries.captured_queries
+                       if '"posts_post"."text"' in query['sql']]
+                self.assertEqual(len(sql), 1)
+                self.assertNotIn('password', sql[0])
+                self.assertNotIn('"auth_user"."email"', sql[0])
+                self.assertEqual(
+                    sum('password' in query['sql']
+                        for query in queries.captured_queries),
+                    1,
+                    'пароль выбирается только для request.user'
+                )
+
+
+@override_settings(POST_SHARDS=['shard_0', 'shard_1'])
+class ShardingTest(TestCase):
+    databases = {'default', 'shard_0', 'shard_1'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title='Группа', slug='shards',
+                                         description='Описание')
+        # id 1 и 2 лежат на разных шардах.
+        cls.first = User.objects.create_user(username='first', id=1)
+        cls.second = User.objects.create_user(username='second', id=2)
+        cls.reader = User.objects.create_user(username='reader', id=4)
+        cls.posts = [
+            Post.objects.create(
+                author=(cls.first, cls.second)[number % 2],
+                group=cls.group,
+                text=f'Пост на шарде #{number}'
+            )
+            for number in range(settings.COUNT_OF_VISIBLE_POSTS + 3)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def test_posts_are_stored_on_author_shard(self):
+        self.assertFalse(Post.objects.using('default').exists())
+        self.assertEqual(
+            set(Post.objects.using('shard_1').values_list('author_id',
+                                                          flat=True)),
+            {self.first.pk}
+        )
+        self.assertEqual(
+            set(Post.objects.using('shard_0').values_list('author_id',
+                                                          flat=True)),
+            {self.second.pk}
+        )
+        self.assertEqual(len({post.pk for post in self.posts}),
+                         len(self.posts))
+
+    def test_listings_merge_shards(self):
+        """Лента и группа собираются со всех шардов по -created
+        и листаются курсором без пропусков и повторов.
+        """
+        expected = [post.pk for post in reversed(self.posts)]
+        for url in (reverse('posts:index'),
+                    reverse('posts:group_pages',
+                            kwargs={'slug': self.group.slug})):
+            with self.subTest(url=url):
+                first_page = self.client.get(url).context['page_obj']
+                second_page = self.client.get(
+                    url, {'after': first_page.next_cursor}
+                ).context['page_obj']
+                self.assertEqual(
+                    [post.pk for post in [*first_page, *second_page]],
+                    expected
+                )
+                self.assertEqual(first_page[0].author.username,
+                                 self.posts[-1].author.username)
+                self.assertEqual(first_page[0].group.slug, self.group.slug)
+
+    def test_profile_and_post_detail_read_one_shard(self):
+        post = self.posts[0]
+        urls = (
+            reverse('posts:profile', kwargs={'username': 'first'}),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connections['shard_0']) as other:
+                    response = self.client.get(url)
+                self.assertContains(response, post.text)
+                self.assertEqual(other.captured_queries, [])
+
+    def test_comment_is_stored_on_post_shard(self):
+        post = self.posts[1]
+        self.client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+            {'text': 'Комментарий на шарде'}
+        )
+        comment = Comment.objects.using('shard_0').get()
+        self.assertEqual(comment.post_id, post.pk)
+        other = Comment.objects.create(post=self.posts[0],
+                                       author=self.reader, text='Другой')
+        self.assertEqual(other._state.db, 'shard_1')
+        self.assertNotEqual(other.pk, comment.pk)
+        self.assertEqual(
+            Post.objects.using('shard_0').get(pk=post.pk).comments_count, 1
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}))
+        self.assertContains(response, 'Комментарий на шарде')
+
+    def test_write_behind_comments_go_to_post_shards(self):
+        queue_dir = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, queue_dir, ignore_errors=True)
+        with self.settings(COMMENT_WRITE_BEHIND=True,
+                           COMMENT_QUEUE_DIR=queue_dir,
+                           COMMENT_FLUSH_INTERVAL=0):
+            for post in self.posts[:2]:
+                self.client.post(
+                    reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+                    {'text': f'Отложенный к {post.pk}'}
+                )
+            self.assertEqual(comment_queue.flush(), 2)
+        first = Comment.objects.using('shard_1').get()
+        second = Comment.objects.using('shard_0').get()
+        self.assertEqual(first.post_id, self.posts[0].pk)
+        self.assertEqual(second.post_id, self.posts[1].pk)
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertEqual(
+            Post.objects.using('shard_0').get(
+                pk=self.posts[1].pk).comments_count,
+            1
+        )
+
+    def test_failed_shard_batch_is_requeued_alone(self):
+        """Если пачка одного шарда не записалась, в очередь
+        возвращаются только её комментарии.
+        """
+        queue_dir = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, queue_dir, ignore_errors=True)
+        save = comment_queue._save
+
+        def failing_save(alias, comments):
+            if alias == 'shard_0':
+                raise DatabaseError('шард недоступен')
+            save(alias, comments)
+
+        with self.settings(COMMENT_WRITE_BEHIND=True,
+                           COMMENT_QUEUE_DIR=queue_dir,
+                           COMMENT_FLUSH_INTERVAL=0):
+            for post in self.posts[:2]:
+                self.client.post(
+                    reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+                    {'text': f'Отложенный к {post.pk}'}
+                )
+            with mock.patch.object(comment_queue, '_save', failing_save):
+                with self.assertRaises(DatabaseError):
+                    comment_queue.flush()
+            self.assertEqual(len(os.listdir(queue_dir)), 1)
+            self.assertEqual(comment_queue.flush(), 1)
+        self.assertEqual(
+            Comment.objects.using('shard_1').get().post_id, self.posts[0].pk)
+        self.assertEqual(
+            Comment.objects.using('shard_0').get().post_id, self.posts[1].pk)
+
+    def test_follow_index_reads_followed_authors_shards(self):
+        Follow.objects.create(user=self.reader, author=self.second)
+        page = self.client.get(reverse('posts:follow_index')).context[
+            'page_obj']
+        self.assertTrue(page)
+        self.assertEqual({post.author_id for post in page},
+                         {self.second.pk})
+        self.assertFalse(FeedEntry.objects.exists())
+
+    def test_missing_post_is_not_found(self):
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': 999}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_deleting_user_cleans_shards(self):
+        """Удаление пользователя удаляет его посты и комментарии
+        на всех шардах.
+        """
+        first_post, second_post = self.posts[:2]
+        Comment.objects.create(post=first_post, author=self.second,
+                               text='Комментарий второго')
+        Comment.objects.create(post=second_post, author=self.reader,
+                               text='Комментарий к посту второго')
+        self.second.delete()
+        for alias in ('shard_0', 'shard_1'):
+            with self.subTest(alias=alias):
+                self.assertFalse(Post.objects.using(alias).filter(
+                    author_id=self.second.pk).exists())
+                self.assertFalse(Comment.objects.using(alias).filter(
+                    author_id=self.second.pk).exists())
+        self.assertFalse(Comment.objects.using('shard_0').exists())
+        self.assertFalse(PostLocation.objects.filter(
+            author_id=self.second.pk).exists())
+        self.assertEqual(
+            Post.objects.using('shard_1').get(pk=first_post.pk)
+            .comments_count,
+            0
+        )
+        self.assertEqual(UserStats.objects.get(user=self.first).posts_count,
+                         len(self.posts[::2]))
+
+    def test_deleting_group_detaches_sharded_posts(self):
+        self.group.delete()
+        for alias in ('shard_0', 'shard_1'):
+            with self.subTest(alias=alias):
+                self.assertFalse(Post.objects.using(alias).filter(
+                    group__isnull=False).exists())
+
+    def test_repair_commands_read_shards(self):
+        """recount и rebuild_search_index не обнуляют данные шардов."""
+        post = self.posts[1]
+        Comment.objects.create(post=post, author=self.reader,
+                               text='Неповторимый комментарий')
+        UserStats.objects.update(posts_count=0)
+        Post.objects.using('shard_0').update(comments_count=7)
+        call_command('recount', stdout=StringIO())
+        self.assertEqual(
+            UserStats.objects.get(user=self.second).posts_count,
+            len(self.posts[1::2])
+        )
+        self.assertEqual(
+            dict(Post.objects.using('shard_0').filter(comments_count__gt=0)
+                 .values_list('pk', 'comments_count')),
+            {post.pk: 1}
+        )
+        call_command('rebuild_search_index', stdout=StringIO())
+        for query in ('неповторимый', post.text):
+            with self.subTest(query=query):
+                response = self.client.get(reverse('posts:search'),
+                                           {'q': query})
+                self.assertIn(post.pk, [found.pk for found in
+                                        response.context['page_obj']])
+
+    async def test_async_views_read_shards(self):
+        """ASGI-страницы собирают ленты со всех шардов."""
+        await Follow.objects.acreate(user=self.reader, author=self.second)
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.reader)
+        post = self.posts[1]
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_pages', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'second'}),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+            reverse('posts:follow_index'),
+        )
+        with self.settings(ROOT_URLCONF=settings.ASGI_URLCONF):
+            for url in urls:
+                with self.subTest(url=url):
+                    response = await client.get(url)
+                    self.assertContains(response, post.text)
+                    if url == reverse('posts:index'):
+                        self.assertEqual(
+                            [item.pk for item in response.context['page_obj']],
+                            [item.pk for item in reversed(self.posts)][
+                                :settings.COUNT_OF_VISIBLE_POSTS]
+                        )
+
+    def test_api_reads_shards(self):
+        """JSON API собирает ленты со всех шардов и догружает имена."""
+        Follow.objects.create(user=self.reader, author=self.second)
+        post = self.posts[1]
+        data = self.client.get(reverse('api:index')).json()
+        self.assertEqual([row['id'] for row in data['results']],
+                         [item.pk for item in reversed(self.posts)][
+                             :settings.COUNT_OF_VISIBLE_POSTS])
+        self.assertEqual(data['results'][0]['author'],
+                         self.posts[-1].author.username)
+        self.assertEqual(data['results'][0]['group'], self.group.slug)
+        for url in (reverse('api:profile', kwargs={'username': 'second'}),
+                    reverse('api:follow_index')):
+            with self.subTest(url=url):
+                results = self.client.get(url).json()['results']
+                self.assertEqual({row['author'] for row in results},
+                                 {'second'})
+        Comment.objects.create(post=post, author=self.reader,
+                               text='Комментарий на шарде')
+        data = self.client.get(
+            reverse('api:post_detail', kwargs={'post_id': post.pk})).json()
+        self.assertEqual(data['post']['author'], 'second')
+        self.assertEqual([row['author']
+                          for row in data['comments']['results']],
+                         ['reader'])
+
+
+class ReshardTest(TestCase):
+    databases = {'default', 'shard_0', 'shard_1'}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reshard_moves_posts_and_comments(self):
+        author = User.objects.create_user(username='author', id=1)
+        post = Post.objects.create(author=author, text='Старый пост')
+        comment = Comment.objects.create(post=post, author=author,
+                                         text='Старый комментарий')
+        with override_settings(POST_SHARDS=['shard_0', 'shard_1']):
+            call_command('reshard', stdout=StringIO())
+            self.assertFalse(Post.objects.using('default').exists())
+            moved = Post.objects.using('shard_1').get()
+            self.assertEqual((moved.pk, moved.created),
+                             (post.pk, post.created))
+            self.assertEqual(
+                Comment.objects.using('shard_1').get().pk, comment.pk
+            )
+            response = self.client.get(
+                reverse('posts:post_detail', kwargs={'post_id': post.pk}))
+            self.assertContains(response, 'Старый комментарий')
+            response = self.client.get(reverse('posts:search'),
+                                       {'q': 'комментарий'})
+            self.assertContains(response, 'Старый пост')
+            call_command('reshard', stdout=StringIO())
+            self.assertEqual(Post.objects.using('shard_1').count(), 1)
+        call_command('reshard', stdout=StringIO())
+        self.assertEqual(Post.objects.using('default').get().pk, post.pk)
+        self.assertFalse(Comment.objects.using('shard_1').exists())
+
+
+class ArchiveTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='archive',
+                                         description='Описание')
+        cls.posts = [
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Пост #{number}')
+            for number in range(settings.COUNT_OF_VISIBLE_POSTS + 3)
+        ]
+        cls.old_posts = cls.posts[:5]
+        Post.objects.filter(pk__in=[post.pk for post in cls.old_posts]).update(
+            created=timezone.now() - timedelta(
+                days=settings.ARCHIVE_AFTER_DAYS + 1)
+        )
+        Comment.objects.create(post=cls.old_posts[0], author=cls.author,
+                               text='Комментарий в архиве')
+        call_command('archive_posts', stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def test_old_posts_and_comments_move_to_archive(self):
+        old_ids = {post.pk for post in self.old_posts}
+        self.assertFalse(Post.objects.filter(pk__in=old_ids).exists())
+        self.assertEqual(
+            set(ArchivedPost.objects.values_list('pk', flat=True)), old_ids
+        )
+        self.assertEqual(ArchivedComment.objects.get().post_id,
+                         self.old_posts[0].pk)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_feeds_read_only_hot_posts(self):
+        for url in (reverse('posts:index'),
+                    reverse('posts:group_pages',
+                            kwargs={'slug': self.group.slug})):
+            with self.subTest(url=url):
+                page = self.client.get(url).context['page_obj']
+                second = self.client.get(
+                    url, {'after': page.next_cursor}
+                ).context['page_obj'] if page.has_next() else []
+                self.assertEqual(
+                    len(page) + len(second),
+                    len(self.posts) - len(self.old_posts)
+                )
+
+    def test_profile_falls_through_to_archive(self):
+        url = reverse('posts:profile', kwargs={'username': 'author'})
+        first = self.client.get(url).context['page_obj']
+        second = self.client.get(
+            url, {'after': first.next_cursor}).context['page_obj']
+        self.assertEqual([post.pk for post in [*first, *second]],
+                         [post.pk for post in reversed(self.posts)])
+        self.assertFalse(second.has_next())
+        back = self.client.get(
+            url, {'before': second.previous_cursor}).context['page_obj']
+        self.assertEqual([post.pk for post in back],
+                         [post.pk for post in first])
+
+    def test_post_detail_falls_through_to_archive(self):
+        self.client.force_login(self.author)
+        response = self.client.get(
+            reverse('posts:post_detail',
+                    kwargs={'post_id': self.old_posts[0].pk})
+        )
+        self.assertContains(response, 'Комментарий в архиве')
+        self.assertNotContains(response, 'Добавить комментарий')
+        response = self.client.get(reverse('posts:search'),
+                                   {'q': 'архиве'})
+        self.assertContains(response, self.old_posts[0].text)
+
+    def test_recount_repairs_archived_comments_count(self):
+        ArchivedPost.objects.update(comments_count=5)
+        call_command('recount', stdout=StringIO())
+        self.assertEqual(
+            dict(ArchivedPost.objects.values_list('pk', 'comments_count')),
+            {post.pk: int(post == self.old_posts[0])
+             for post in self.old_posts}
+        )
+
+    def test_rebuilt_search_index_keeps_archive(self):
+        call_command('rebuild_search_index', stdout=StringIO())
+        cases = {'архиве': self.old_posts[0],
+                 self.old_posts[4].text: self.old_posts[4]}
+        for query, post in cases.items():
+            with self.subTest(query=query):
+                response = self.client.get(reverse('posts:search'),
+                                           {'q': query})
+                self.assertEqual(
+                    [found.pk for found in response.context['page_obj']],
+                    [post.pk]
+                )
+
+    async def test_async_views_fall_through_to_archive(self):
+        """ASGI-страницы поста и профиля дочитывают архив."""
+        post = self.old_posts[0]
+        client = AsyncClient()
+        with self.settings(ROOT_URLCONF=settings.ASGI_URLCONF):
+            response = await client.get(
+                reverse('posts:post_detail', kwargs={'post_id': post.pk}))
+            self.assertContains(response, 'Комментарий в архиве')
+            url = reverse('posts:profile', kwargs={'username': 'author'})
+            first = (await client.get(url)).context['page_obj']
+            second = (await client.get(
+                url, {'after': first.next_cursor})).context['page_obj']
+        self.assertEqual([item.pk for item in [*first, *second]],
+                         [item.pk for item in reversed(self.posts)])
+
+    def test_api_falls_through_to_archive(self):
+        """JSON API отдаёт архивный пост и дочитывает архив в профиле."""
+        post = self.old_posts[0]
+        data = self.client.get(
+            reverse('api:post_detail', kwargs={'post_id': post.pk})).json()
+        self.assertEqual(data['post']['text'], post.text)
+        self.assertEqual(data['post']['group'], self.group.slug)
+        self.assertEqual([row['text']
+                          for row in data['comments']['results']],
+                         ['Комментарий в архиве'])
+        url = reverse('api:profile', kwargs={'username': 'author'})
+        first = self.client.get(url).json()
+        second = self.client.get(url, {'after': first['next']}).json()
+        self.assertEqual(
+            [row['id'] for row in [*first['results'], *second['results']]],
+            [item.pk for item in reversed(self.posts)]
+        )
+        self.assertIsNone(second['next'])
+
+
+class CommentWriteBehindTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='commentator')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='queue',
+                                         description='Описание')
+        cls.post = Post.objects.create(author=cls.reader, group=cls.group,
+                                       text='Пост для комментариев')
+
+    def setUp(self):
+        self.queue_dir = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, self.queue_dir, ignore_errors=True)
+        overridden = self.settings(COMMENT_WRITE_BEHIND=True,
+                                   COMMENT_QUEUE_DIR=self.queue_dir,
+                                   COMMENT_FLUSH_INTERVAL=0)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.detail_url = reverse('posts:post_detail',
+                                  kwargs={'post_id': self.post.pk})
+
+    def comment(self, text):
+        return self.author_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': text}
+        )
+
+    def test_comment_is_queued_and_visible_to_author(self):
+        response = self.comment('Ждёт записи')
+        self.assertRedirects(response, self.detail_url)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(len(os.listdir(self.queue_dir)), 1)
+        response = self.author_client.get(self.detail_url)
+        self.assertContains(response, 'Ждёт записи')
+        self.assertContains(response, 'отправляется')
+        self.assertNotContains(self.reader_client.get(self.detail_url),
+                               'Ждёт записи')
+
+    def test_invalid_comment_is_not_queued(self):
+        self.comment('   ')
+        self.assertFalse(os.listdir(self.queue_dir))
+
+    def test_queued_comment_changes_etag(self):
+        response = self.author_client.get(self.detail_url)
+        self.comment('Новый')
+        response = self.author_client.get(
+            self.detail_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Новый')
+
+    def test_flush_writes_batch_with_side_effects(self):
+        scopes = caching.post_scopes(self.post)
+        versions = caching.get_versions(scopes)
+        for number in range(3):
+            self.comment(f'Пачка #{number}')
+        batches = metrics.REGISTRY._series(metrics.COMMENT_FLUSH_BATCH.name)
+        observed = sum(state[-1] for state in batches.values())
+        self.assertEqual(comment_queue.flush(batch_size=2), 2)
+        self.assertEqual(comment_queue.flush_all(), 1)
+        self.assertEqual(
+            list(self.post.comments.values_list('text', flat=True)),
+            ['Пачка #2', 'Пачка #1', 'Пачка #0']
+        )
+        self.assertEqual(os.listdir(self.queue_dir), [])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 3)
+        self.assertNotEqual(caching.get_versions(scopes), versions)
+        self.assertEqual(sum(state[-1] for state in batches.values()),
+                         observed + 3)
+        response = self.author_client.get(self.detail_url)
+        self.assertContains(response, 'Пачка #0')
+        self.assertNotContains(response, 'отправляется')
+        response = self.reader_client.get(reverse('posts:search'),
+                                          {'q': 'пачка'})
+        self.assertContains(response, self.post.text)
+
+    def test_comment_to_deleted_post_is_dropped(self):
+        self.comment('К удалённому')
+        Post.objects.filter(pk=self.post.pk).delete()
+        self.assertEqual(comment_queue.flush(), 1)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(os.listdir(self.queue_dir), [])
+
+    def test_comment_to_archived_post_goes_to_archive(self):
+        self.comment('К архивному')
+        Post.objects.filter(pk=self.post.pk).update(
+            created=timezone.now() - timedelta(
+                days=settings.ARCHIVE_AFTER_DAYS + 1))
+        call_command('archive_posts', stdout=StringIO())
+        self.assertEqual(comment_queue.flush(), 1)
+        comment = ArchivedComment.objects.get()
+        self.assertEqual((comment.post_id, comment.text),
+                         (self.post.pk, 'К архивному'))
+        self.assertEqual(
+            ArchivedPost.objects.get(pk=self.post.pk).comments_count, 1)
+        response = self.reader_client.get(reverse('posts:search'),
+                                          {'q': 'архивному'})
+        self.assertContains(response, self.post.text)
+
+    def test_author_sees_queued_comment_on_archived_post(self):
+        self.comment('Ждёт архива')
+        Post.objects.filter(pk=self.post.pk).update(
+            created=timezone.now() - timedelta(
+                days=settings.ARCHIVE_AFTER_DAYS + 1))
+        call_command('archive_posts', stdout=StringIO())
+        response = self.author_client.get(self.detail_url)
+        self.assertContains(response, 'Ждёт архива')
+        self.assertContains(response, 'отправляется')
+
+    def test_stale_claim_returns_to_queue(self):
+        self.comment('Забран упавшим процессом')
+        [path] = comment_queue._claim(self.queue_dir, 10)
+        self.assertEqual(comment_queue.flush(), 0)
+        os.utime(path, (0, 0))
+        self.assertEqual(comment_queue.flush(), 1)
+        self.assertTrue(Comment.objects.filter(
+            text='Забран упавшим процессом').exists())
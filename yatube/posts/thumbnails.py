@@ -0,0 +1,81 @@
+"""Фоновая генерация миниатюр для Post.image.
+
+Копии картинки (см. posts.images) создаются после сохранения поста:
+поток из пула читает оригинал, отдаёт перекодирование пулу процессов
+и записывает результат. Пока копий нет, шаблоны показывают заглушку.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import caching, images, sharding
+from .models import Post
+
+# Ширина копии, которая идёт в src и в Post.thumbnail.
+THUMBNAIL_WIDTH = 960
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Пул потоков миниатюр, отдельный от обработки запросов."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails'
+        )
+    return _executor
+
+
+def schedule(post_id: int) -> None:
+    """Ставит генерацию миниатюры в очередь после фиксации транзакции."""
+    transaction.on_commit(
+        lambda: get_executor().submit(run_in_worker, post_id)
+    )
+
+
+def generate(post_id: int) -> Optional[str]:
+    """Создаёт копии картинки поста.
+
+    Имена копий сохраняются в Post.renditions, JPEG шириной не больше
+    THUMBNAIL_WIDTH - в Post.thumbnail.
+    """
+    posts = sharding.on_post_shard(Post.objects.all(), post_id)
+    post = (
+        posts.with_related('author', 'group')
+        .filter(pk=post_id).first()
+    )
+    if post is None or not post.image:
+        return None
+    renditions = images.create_renditions(post.image.name)
+    jpeg = renditions['jpeg']
+    widths = sorted(int(width) for width in jpeg)
+    fitting = [width for width in widths if width <= THUMBNAIL_WIDTH]
+    thumbnail = jpeg[str(fitting[-1] if fitting else widths[0])]
+    # Картинку могли заменить, пока шла генерация.
+    updated = posts.filter(pk=post_id, image=post.image.name).update(
+        thumbnail=thumbnail, renditions=renditions
+    )
+    if not updated:
+        images.delete_renditions(renditions)
+        return None
+    caching.bump(*caching.post_scopes(post))
+    return thumbnail
+
+
+def run_in_worker(post_id: int) -> Optional[str]:
+    """generate() для вызова из пула потоков."""
+    try:
+        return generate(post_id)
+    except Exception:
+        logger.exception('Не удалось создать миниатюру поста %s', post_id)
+        return None
+    finally:
+        # Поток живёт долго: не держим открытое соединение с БД.
+        connection.close()
@@ -1,15 +1,338 @@
+import binascii
+import heapq
+import json
+from itertools import islice
+from typing import Optional, Sequence
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
+from django.db.models import Q
 from django.db.models import QuerySet as QS
+from django.db.models import prefetch_related_objects
 from django.http import HttpRequest
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+CURSOR_ORDERING = ('-created', '-id')
 
 
 def create_paginator(request: HttpRequest,
                      object_list: QS,
-                     count_posts: int = settings.COUNT_OF_VISIBLE_POSTS) -> QS:
-    """Возвращает пагинатор с заданным количеством постов"""
+                     count_posts: int = settings.COUNT_OF_VISIBLE_POSTS,
+                     cursor: bool = False,
+                     databases: Optional[Sequence[str]] = None,
+                     fallback: Optional[QS] = None) -> QS:
+    """Возвращает пагинатор с заданным количеством постов.
+
+    При cursor=True страница строится по курсору ?after=/?before=
+    без COUNT(*) и OFFSET. Если заданы databases, курсорная страница
+    собирается из нескольких баз (шардов). Если задан fallback,
+    страница дочитывается из него, когда object_list кончился (архив).
+    """
+    if cursor or databases is not None or fallback is not None:
+        return cursor_paginator(object_list, count_posts, databases,
+                                fallback).get_page(
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
     paginator = Paginator(object_list, count_posts)
 
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     return page_obj
+
+
+async def acreate_paginator(request: HttpRequest,
+                            object_list: QS,
+                            count_posts: int = settings.COUNT_OF_VISIBLE_POSTS,
+                            databases: Optional[Sequence[str]] = None,
+                            fallback: Optional[QS] = None) -> 'CursorPage':
+    """Курсорная страница create_paginator для async-view."""
+    return await cursor_paginator(object_list, count_posts, databases,
+                                  fallback).aget_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+
+
+def cursor_paginator(object_list: QS, per_page: int,
+                     databases: Optional[Sequence[str]] = None,
+                     fallback: Optional[QS] = None) -> 'CursorPaginator':
+    """Курсорный пагинатор: по нескольким базам, с дочитыванием
+    из fallback или обычный.
+    """
+    if databases is not None:
+        return ScatterGatherPaginator(object_list, per_page, databases)
+    if fallback is not None:
+        return FallThroughPaginator([object_list, fallback], per_page)
+    return CursorPaginator(object_list, per_page)
+
+
+class CursorPage:
+    """Страница курсорного пагинатора.
+
+    Повторяет ту часть интерфейса django.core.paginator.Page,
+    которой пользуются шаблоны.
+    """
+
+    def __init__(self, object_list: list,
+                 next_cursor: Optional[str] = None,
+                 previous_cursor: Optional[str] = None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage: {len(self)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Keyset-пагинация по упорядоченным полям (по умолчанию created, id).
+
+    Каждая страница - это поиск по индексу от значения курсора
+    и LIMIT per_page + 1, поэтому её стоимость не зависит от глубины.
+    """
+
+    def __init__(self, object_list: QS, per_page: int,
+                 ordering: Sequence[str] = CURSOR_ORDERING):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    def get_page(self, after: Optional[str] = None,
+                 before: Optional[str] = None) -> CursorPage:
+        """Возвращает страницу после курсора after или перед before.
+
+        Испорченный курсор, как и в Paginator.get_page, ведёт
+        на первую страницу.
+        """
+        after_key = self.decode_cursor(after) if after else None
+        before_key = self.decode_cursor(before) if before else None
+        if before_key is not None:
+            rows = self._fetch(before_key, forward=False)
+            if len(rows) > self.per_page:
+                rows = rows[1:]
+                return self._page(rows, has_previous=True, has_next=True)
+            # Дошли до начала ленты - отдаём первую страницу целиком.
+        elif after_key is not None:
+            rows = self._fetch(after_key, forward=True)
+            return self._page(rows[:self.per_page],
+                              has_previous=True,
+                              has_next=len(rows) > self.per_page)
+        rows = self._fetch(None, forward=True)
+        return self._page(rows[:self.per_page],
+                          has_previous=False,
+                          has_next=len(rows) > self.per_page)
+
+    async def aget_page(self, after: Optional[str] = None,
+                        before: Optional[str] = None) -> CursorPage:
+        """Асинхронная версия get_page для async-view."""
+        after_key = self.decode_cursor(after) if after else None
+        before_key = self.decode_cursor(before) if before else None
+        if before_key is not None:
+            rows = await self._afetch(before_key, forward=False)
+            if len(rows) > self.per_page:
+                rows = rows[1:]
+                return self._page(rows, has_previous=True, has_next=True)
+        elif after_key is not None:
+            rows = await self._afetch(after_key, forward=True)
+            return self._page(rows[:self.per_page],
+                              has_previous=True,
+                              has_next=len(rows) > self.per_page)
+        rows = await self._afetch(None, forward=True)
+        return self._page(rows[:self.per_page],
+                          has_previous=False,
+                          has_next=len(rows) > self.per_page)
+
+    def _fetch(self, key: Optional[list], forward: bool) -> list:
+        rows = list(self._window(key, forward))
+        if not forward:
+            rows.reverse()
+        return rows
+
+    async def _afetch(self, key: Optional[list], forward: bool) -> list:
+        rows = [row async for row in self._window(key, forward)]
+        if not forward:
+            rows.reverse()
+        return rows
+
+    def _window(self, key: Optional[list], forward: bool,
+                object_list: Optional[QS] = None) -> QS:
+        """per_page + 1 строк после ключа в порядке обхода."""
+        queryset = self.object_list if object_list is None else object_list
+        if key is not None:
+            queryset = queryset.filter(self._keyset_filter(key, forward))
+        if forward:
+            ordering = self.ordering
+        else:
+            ordering = tuple(_invert(field) for field in self.ordering)
+        return queryset.order_by(*ordering)[:self.per_page + 1]
+
+    def _keyset_filter(self, key: list, forward: bool) -> Q:
+        """Условие «строго после ключа» в порядке обхода.
+
+        Для ('-created', '-id') вперёд получается
+        created <= c AND (created < c OR (created = c AND id < i)),
+        первое слагаемое даёт планировщику границу для поиска по индексу.
+        """
+        names = [field.lstrip('-') for field in self.ordering]
+        lookups = [
+            'lt' if field.startswith('-') == forward else 'gt'
+            for field in self.ordering
+        ]
+        condition = Q()
+        for position, name in enumerate(names):
+            step = Q(**{f'{name}__{lookups[position]}': key[position]})
+            for prev_name, prev_value in zip(names[:position],
+                                             key[:position]):
+                step &= Q(**{prev_name: prev_value})
+            condition |= step
+        bound = Q(**{f'{names[0]}__{lookups[0]}e': key[0]})
+        return bound & condition
+
+    def _page(self, rows: list, has_previous: bool,
+              has_next: bool) -> CursorPage:
+        if not rows:
+            return CursorPage(rows)
+        return CursorPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if has_next else None,
+            previous_cursor=(
+                self.encode_cursor(rows[0]) if has_previous else None
+            ),
+        )
+
+    def encode_cursor(self, obj) -> str:
+        """Непрозрачный курсор из значений полей сортировки объекта."""
+        return encode_cursor(self._key(obj))
+
+    def _key(self, obj) -> list:
+        return [
+            obj[name] if isinstance(obj, dict) else getattr(obj, name)
+            for name in (field.lstrip('-') for field in self.ordering)
+        ]
+
+    def decode_cursor(self, cursor: str) -> Optional[list]:
+        """Значения ключа из курсора или None, если курсор испорчен."""
+        opts = self.object_list.model._meta
+        values = decode_cursor(cursor, len(self.ordering))
+        if values is None:
+            return None
+        try:
+            return [
+                _get_field(opts, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValidationError):
+            return None
+
+
+class ScatterGatherPaginator(CursorPaginator):
+    """Курсорная пагинация по нескольким базам (шардам).
+
+    Из каждой базы выбирается окно per_page + 1 строк после курсора,
+    окна сливаются heapq.merge по ключу сортировки. prefetch_related
+    выполняется один раз для страницы, а не для каждого окна.
+    Все поля сортировки должны идти в одном направлении.
+    """
+
+    def __init__(self, object_list: QS, per_page: int,
+                 databases: Sequence[str],
+                 ordering: Sequence[str] = CURSOR_ORDERING):
+        super().__init__(object_list.prefetch_related(None), per_page,
+                         ordering)
+        self.databases = list(databases)
+        self.prefetch_lookups = object_list._prefetch_related_lookups
+
+    def _fetch(self, key: Optional[list], forward: bool) -> list:
+        windows = [self._window(key, forward).using(alias)
+                   for alias in self.databases]
+        descending = self.ordering[0].startswith('-') == forward
+        rows = list(islice(
+            heapq.merge(*windows, key=self._key, reverse=descending),
+            self.per_page + 1
+        ))
+        if self.prefetch_lookups:
+            prefetch_related_objects(rows, *self.prefetch_lookups)
+        if not forward:
+            rows.reverse()
+        return rows
+
+    async def _afetch(self, key: Optional[list], forward: bool) -> list:
+        # Окна из разных баз сливаются синхронно в потоке.
+        return await sync_to_async(self._fetch)(key, forward)
+
+
+class FallThroughPaginator(CursorPaginator):
+    """Курсорная пагинация по выборкам, разделённым ключом сортировки:
+    все строки следующей выборки идут после строк предыдущей (горячие
+    посты, затем архив). Следующая выборка читается, только если
+    предыдущей не хватило на страницу.
+    """
+
+    def __init__(self, object_lists: Sequence[QS], per_page: int,
+                 ordering: Sequence[str] = CURSOR_ORDERING):
+        super().__init__(object_lists[0], per_page, ordering)
+        self.object_lists = list(object_lists)
+
+    def _fetch(self, key: Optional[list], forward: bool) -> list:
+        sources = self.object_lists if forward else self.object_lists[::-1]
+        rows = []
+        for object_list in sources:
+            rows += self._window(key, forward, object_list)
+            if len(rows) > self.per_page:
+                break
+        rows = rows[:self.per_page + 1]
+        if not forward:
+            rows.reverse()
+        return rows
+
+    async def _afetch(self, key: Optional[list], forward: bool) -> list:
+        return await sync_to_async(self._fetch)(key, forward)
+
+
+def encode_cursor(values: list) -> str:
+    """Упаковывает значения ключа сортировки в непрозрачную строку."""
+    values = [
+        value.isoformat() if hasattr(value, 'isoformat') else value
+        for value in values
+    ]
+    return urlsafe_base64_encode(json.dumps(values).encode())
+
+
+def decode_cursor(cursor: str, length: int) -> Optional[list]:
+    """Значения из курсора или None, если курсор испорчен."""
+    try:
+        values = json.loads(urlsafe_base64_decode(cursor))
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def _invert(field: str) -> str:
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def _get_field(opts, name: str):
+    return opts.pk if name == 'pk' else opts.get_field(name)
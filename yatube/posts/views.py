@@ -1,55 +1,108 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.utils.http import urlencode
+from django.views.decorators.http import condition
 
+from core.routers import pin_to_primary, use_replica
+
+from . import archive, comment_queue, follows, search, sharding
+from .caching import cache_listing, post_detail_last_modified
 from .forms import CommentForm, PostForm
-from .models import Comment, Follow, Group, Post, User
+from .models import PROFILE_FIELDS, FeedEntry, Group, Post, User
 from .utils import create_paginator
 
 
-@cache_page(20)
+@use_replica
+@cache_listing('index')
 def index(request):
-    posts = Post.objects.prefetch_related('author', 'group')
-    page_obj = create_paginator(request, posts)
+    page_obj = create_paginator(request, Post.objects.for_feed(),
+                                cursor=True, databases=sharding.shards())
     return render(request, 'posts/index.html', {'page_obj': page_obj})
 
 
+@use_replica
+@cache_listing('group:{slug}')
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.prefetch_related('author')
-    page_obj = create_paginator(request, posts)
+    page_obj = create_paginator(request, group.posts.for_group(),
+                                cursor=True, databases=sharding.shards())
     return render(request, 'posts/group_list.html', {'group': group,
                                                      'page_obj': page_obj})
 
 
+@use_replica
+@cache_listing('profile:{username}')
 def profile(request, username):
-    user = get_object_or_404(User, username=username)
-    user_posts = user.posts.prefetch_related('group')
-    page_obj = create_paginator(request, user_posts)
-    post_follow = (
-        request.user.is_authenticated
-        and Post.objects.filter(
-            author__following__user=request.user).exists()
+    user = get_object_or_404(
+        User.objects.select_related('stats').only(*PROFILE_FIELDS),
+        username=username
+    )
+    page_obj = create_paginator(
+        request, user.posts.for_profile(), cursor=True,
+        fallback=user.archived_posts.for_profile()
     )
-    return render(request, 'posts/profile.html', {'author': user,
-                                                  'page_obj': page_obj,
-                                                  'following': post_follow})
+    return render(request, 'posts/profile.html', {
+        'author': user,
+        'page_obj': page_obj,
+        'following': follows.is_following(request.user, user),
+    })
 
 
+@use_replica
+@condition(etag_func=comment_queue.post_detail_etag,
+           last_modified_func=post_detail_last_modified)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = archive.get_post_or_404(post_id,
+                                   related=('author__stats', 'group'))
     form = CommentForm()
-    comments = Comment.objects.prefetch_related('post').filter(post=post_id)
+    comments = create_paginator(
+        request,
+        post.comments.with_related('author'),
+        settings.COUNT_OF_VISIBLE_COMMENTS,
+        cursor=True
+    )
     return render(
         request,
         'posts/post_detail.html',
         {
             'post': post,
             'form': form,
-            'comments': comments
+            'comments': comments,
+            'pending_comments': comment_queue.pending(post, request.user),
         })
 
 
+@use_replica
+def post_comments(request, post_id):
+    """Следующая порция комментариев для кнопки «Показать ещё»."""
+    post = archive.get_post_or_404(post_id, only=('id',))
+    comments = create_paginator(
+        request,
+        post.comments.with_related('author'),
+        settings.COUNT_OF_VISIBLE_COMMENTS,
+        cursor=True
+    )
+    return render(request, 'includes/comments.html', {'post': post,
+                                                      'comments': comments})
+
+
+@use_replica
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = search.search_posts(
+        query,
+        settings.COUNT_OF_VISIBLE_POSTS,
+        after=request.GET.get('after')
+    )
+    return render(request, 'posts/search.html', {
+        'query': query,
+        'page_obj': page_obj,
+        'extra_query': urlencode({'q': query}),
+    })
+
+
+@pin_to_primary
 @login_required
 def post_create(request):
     form = PostForm(
@@ -64,10 +117,13 @@ def post_create(request):
     return render(request, 'posts/create_post.html', {'form': form})
 
 
+@pin_to_primary
 @login_required
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    if post.author != request.user:
+    post = get_object_or_404(
+        sharding.on_post_shard(Post.objects.all(), post_id), pk=post_id
+    )
+    if post.author_id != request.user.pk:
         return redirect('posts:post_detail', post.pk)
     form = PostForm(
         request.POST or None,
@@ -84,11 +140,17 @@ def post_edit(request, post_id):
                                                       'post': post})
 
 
+@pin_to_primary
 @login_required
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        sharding.on_post_shard(Post.objects.all(), post_id), pk=post_id
+    )
     form = CommentForm(request.POST or None)
-    if form.is_valid():
+    if form.is_valid() and comment_queue.enabled():
+        # Запись в БД - в фоне, пачкой с другими комментариями.
+        comment_queue.enqueue(post, request.user, form.cleaned_data['text'])
+    elif form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
@@ -96,32 +158,37 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@use_replica
 @login_required
 def follow_index(request):
-    post_follow = Post.objects.filter(
-        author__following__user=request.user
-    )
-    page_obj = create_paginator(request, post_follow)
+    if sharding.enabled():
+        # Материализованных лент нет: посты авторов собираются
+        # с их шардов.
+        author_ids = follows.followee_ids(request.user.pk)
+        page_obj = create_paginator(
+            request,
+            Post.objects.filter(author_id__in=author_ids).for_feed(),
+            cursor=True,
+            databases=sharding.shards(author_ids)
+        )
+        return render(request, 'posts/follow.html', {'page_obj': page_obj})
+    feed_entries = FeedEntry.objects.filter(user=request.user).for_feed()
+    page_obj = create_paginator(request, feed_entries, cursor=True)
+    page_obj.object_list = [entry.post for entry in page_obj]
     return render(request, 'posts/follow.html', {'page_obj': page_obj})
 
 
+@pin_to_primary
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-    is_following = Follow.objects.filter(
-        user=request.user,
-        author=author
-    ).exists()
-    if request.user != author and not is_following:
-        Follow.objects.create(user=request.user,
-                              author=author)
+    follows.follow(request.user, author)
     return redirect('posts:profile', username=username)
 
 
+@pin_to_primary
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    if request.user != author:
-        Follow.objects.filter(user=request.user,
-                              author=author).delete()
+    follows.unfollow(request.user, author)
     return redirect('posts:profile', username=username)
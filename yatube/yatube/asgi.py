@@ -0,0 +1,33 @@
+"""
+ASGI config for yatube project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Read views are served by their async versions (see yatube.urls_async).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+
+class AsyncViewsHandler(ASGIHandler):
+    """ASGI-обработчик, который направляет запросы в ASGI_URLCONF."""
+
+    async def get_response_async(self, request):
+        request.urlconf = settings.ASGI_URLCONF
+        return await super().get_response_async(request)
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return AsyncViewsHandler()
+
+
+application = get_asgi_application()
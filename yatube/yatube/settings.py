@@ -13,7 +13,12 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 import os
 
 COUNT_OF_VISIBLE_POSTS = 10
+COUNT_OF_VISIBLE_COMMENTS = 20
 COUNT_LETTERS_MODEL_POST = 15
+# Максимальная длина материализованной ленты подписок: до неё ленты
+# обрезает команда trim_feeds, FEED_TRIM_BATCH_SIZE лент за запрос
+FEED_MAX_LENGTH = 1000
+FEED_TRIM_BATCH_SIZE = 500
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -49,30 +54,49 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'core.apps.CoreConfig',
     'about.apps.AboutConfig',
+    'api.apps.ApiConfig',
     'sorl.thumbnail',
-    'debug_toolbar',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# debug_toolbar замедляет каждый запрос - только для разработки,
+# в production время ответа видно в метриках (/metrics)
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+    # Проверка не видит app_directories внутри кешированного загрузчика
+    SILENCED_SYSTEM_CHECKS = ['debug_toolbar.W006']
+
 ROOT_URLCONF = 'yatube.urls'
 
+# Маршруты ASGI-приложения: страницы чтения в async-версиях
+ASGI_URLCONF = 'yatube.urls_async'
+
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backends.InstrumentedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Скомпилированные шаблоны хранятся в памяти процесса
+            # независимо от DEBUG; runserver сбрасывает их при правке.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -94,9 +118,59 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Соединение живёт между запросами потока, а не открывается
+        # на каждый запрос; перед использованием оно проверяется.
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Сколько секунд ждать снятия блокировки записи (busy timeout)
+            'timeout': 5,
+        },
     }
 }
 
+# Реплика только для чтения (core.routers): 'REPLICA_OF' - алиас primary,
+# миграции на неё не применяются. С SQLite её заменяет копия файла
+# primary, которую обновляет команда refresh_replica.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+    'REPLICA_OF': 'default',
+}
+# Шарды постов и комментариев по автору (posts.sharding): 'POST_SHARD' -
+# на базу применяются только миграции таблиц постов. Таблицы создаёт
+# migrate --database shard_N, данные переносит команда reshard.
+for number in range(2):
+    DATABASES[f'shard_{number}'] = {
+        **DATABASES['default'],
+        'NAME': os.path.join(BASE_DIR, f'db.shard_{number}.sqlite3'),
+        'POST_SHARD': True,
+    }
+# Шарды, по которым раскладываются посты, например
+# ['shard_0', 'shard_1']. Пусто - посты лежат в default.
+POST_SHARDS = []
+DATABASE_ROUTERS = [
+    'posts.sharding.AuthorShardRouter',
+    'core.routers.PrimaryReplicaRouter',
+]
+# Реплики, на которые идёт чтение лент и страниц постов. Пусто - всё
+# читается из default.
+DATABASE_REPLICAS = []
+# Сколько секунд после записи пользователь читает только из primary
+REPLICA_STICKINESS_SECONDS = 10
+
+# PRAGMA для каждого нового соединения SQLite (core.signals).
+# В режиме WAL читатели не ждут писателей, synchronous=NORMAL в WAL
+# не теряет согласованность при сбое процесса.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Отрицательное значение - размер в КиБ: 64 МиБ на соединение
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -159,23 +233,134 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Тесты идут с настройками для тестов (core.testing.TestRunner)
+TEST_RUNNER = 'core.testing.TestRunner'
+
 # csrf константа
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 # Настройки для пользовательских картинок
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-
-
-# Настройки кеша
+# Потоки фоновой генерации миниатюр
+THUMBNAIL_WORKERS = 2
+# Процессы перекодирования картинок (0 - в том же процессе)
+IMAGE_PROCESS_WORKERS = 2
+# Ширины копий картинки поста в WebP и JPEG
+IMAGE_RENDITION_WIDTHS = (480, 960, 1440)
+# Наибольшая сторона и площадь загружаемой картинки
+IMAGE_MAX_SIDE = 8000
+IMAGE_MAX_PIXELS = 40_000_000
+
+
+# Настройки кеша: LRU в памяти процесса перед общим для всех воркеров
+# SQLite-файлом (core.cache.TwoTierCache)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 512,
+            # Запись другого воркера видна в L1 не позже чем через 0.5 с
+            'GENERATION_TTL': 0.5,
+            'MAX_ENTRIES': 100_000,
+        },
     }
 }
 
+# Время жизни кеша лент: он сбрасывается сигналами при изменениях
+LISTING_CACHE_TIMEOUT = 60 * 60 * 24
+# Страницы, построенные по реплике, кешируются ненадолго: реплика
+# могла отставать от primary
+REPLICA_LISTING_CACHE_TIMEOUT = 60
+# Посты старше стольких дней команда archive_posts переносит в архив
+# (posts.archive), общие ленты их больше не показывают
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 500
+# Отложенная запись комментариев (posts.comment_queue): add_comment
+# кладёт комментарий в каталог-очередь, фоновый поток раз
+# в COMMENT_FLUSH_INTERVAL секунд пишет пачки в БД (0 - потока нет,
+# очередь разбирает команда flush_comments)
+COMMENT_WRITE_BEHIND = False
+COMMENT_QUEUE_DIR = os.path.join(BASE_DIR, 'comment_queue')
+COMMENT_FLUSH_INTERVAL = 1
+COMMENT_FLUSH_BATCH_SIZE = 500
+# Через сколько секунд пачку, забранную упавшим процессом, можно
+# забрать снова
+COMMENT_CLAIM_TIMEOUT = 60
+# Время жизни множеств подписок в кеше: сбрасываются сигналами Follow
+FOLLOW_GRAPH_CACHE_TIMEOUT = 60 * 60 * 24
+# Сколько секунд ждать, пока другой запрос перестраивает ленту
+LISTING_CACHE_LOCK_TIMEOUT = 10
+
+# Бюджеты SQL-запросов страниц при GET: число запросов и время в БД
+# (секунды). Проверяются core.middleware.QueryBudgetMiddleware и тестами.
+QUERY_BUDGETS_ENABLED = DEBUG
+QUERY_BUDGETS_STRICT = False
+# Проверять ли время в БД; тестовый раннер выключает проверку
+QUERY_BUDGETS_CHECK_TIME = True
+QUERY_BUDGETS = {
+    'posts:index': {'queries': 3, 'time': 0.05},
+    'posts:group_pages': {'queries': 4, 'time': 0.05},
+    # Профиль, страница поста и поиск дочитывают архив одним запросом.
+    'posts:profile': {'queries': 6, 'time': 0.05},
+    'posts:post_detail': {'queries': 6, 'time': 0.05},
+    'posts:post_comments': {'queries': 3, 'time': 0.05},
+    'posts:search': {'queries': 5, 'time': 0.05},
+    'posts:post_create': {'queries': 3, 'time': 0.05},
+    'posts:post_edit': {'queries': 4, 'time': 0.05},
+    'posts:add_comment': {'queries': 3, 'time': 0.05},
+    'posts:follow_index': {'queries': 3, 'time': 0.05},
+    'posts:profile_follow': {'queries': 11, 'time': 0.1},
+    'posts:profile_unfollow': {'queries': 10, 'time': 0.1},
+    'api:index': {'queries': 3, 'time': 0.05},
+    'api:group_posts': {'queries': 4, 'time': 0.05},
+    'api:profile': {'queries': 4, 'time': 0.05},
+    'api:post_detail': {'queries': 5, 'time': 0.05},
+    'api:follow_index': {'queries': 4, 'time': 0.05},
+    'auth:logout': {'queries': 4, 'time': 0.05},
+    'auth:signup': {'queries': 2, 'time': 0.05},
+    'auth:login': {'queries': 2, 'time': 0.05},
+    'auth:password_change': {'queries': 2, 'time': 0.05},
+    'auth:password_change_done': {'queries': 2, 'time': 0.05},
+    'auth:password_reset': {'queries': 2, 'time': 0.05},
+    'auth:password_reset_done': {'queries': 2, 'time': 0.05},
+    'auth:password_reset_confirm': {'queries': 2, 'time': 0.05},
+    'auth:password_reset_complete': {'queries': 2, 'time': 0.05},
+}
+# Число запросов при POST_SHARDS: queries плюс per_shard на каждый шард.
+# Ленты читают окно с каждого шарда, авторов и группы догружают
+# из default. Страница поста ищет шард в каталоге PostLocation, если
+# его нет в кеше. Остальные страницы проверяются по QUERY_BUDGETS.
+QUERY_BUDGETS_SHARDED = {
+    'posts:index': {'queries': 4, 'per_shard': 1},
+    'posts:group_pages': {'queries': 4, 'per_shard': 1},
+    'posts:profile': {'queries': 8},
+    'posts:post_detail': {'queries': 10},
+    'posts:search': {'queries': 6, 'per_shard': 1},
+    'posts:follow_index': {'queries': 5, 'per_shard': 1},
+    'api:index': {'queries': 4, 'per_shard': 1},
+    'api:group_posts': {'queries': 5, 'per_shard': 1},
+    'api:profile': {'queries': 7},
+    'api:post_detail': {'queries': 8},
+    'api:follow_index': {'queries': 5, 'per_shard': 1},
+}
+
+# Метрики Prometheus: каждый процесс пишет снимок в METRICS_DIR
+# не чаще раза в METRICS_FLUSH_INTERVAL секунд, /metrics их суммирует.
+# Каталог очищают при деплое.
+METRICS_ENABLED = True
+METRICS_DIR = os.path.join(BASE_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = 5
+
 # IP адреса, при обращении с которых будет доступен DjDT
 
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
+
+# Адреса, с которых доступна страница /metrics
+METRICS_ALLOWED_IPS = INTERNAL_IPS
+# Токен сборщика метрик (Authorization: Bearer <токен>). Пока он
+# не задан, страница /metrics закрыта
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
@@ -0,0 +1,19 @@
+"""Корневые маршруты ASGI-приложения.
+
+Совпадают с yatube.urls, только приложение posts подключено
+через posts.async_urls.
+"""
+from django.urls import URLResolver, include, path
+
+from . import urls
+
+urlpatterns = [
+    path('', include('posts.async_urls', namespace='posts'))
+    if isinstance(pattern, URLResolver) and pattern.namespace == 'posts'
+    else pattern
+    for pattern in urls.urlpatterns
+]
+
+handler404 = urls.handler404
+handler403 = urls.handler403
+handler500 = urls.handler500